@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+"""
+Benchmark of the Digital Ocean API proxy (swarm_tf.common.api_proxy) against a local mock of the API.
+
+The mock answers 429 when it receives more than --limit requests in a sliding window of one second, like the Digital
+Ocean API does per minute. The same burst of requests (terraform creating many resources with -parallelism) runs
+straight to the mock and through the proxy. It runs offline: no Digital Ocean token or terraform is needed.
+
+    python benchmarks/api_proxy.py
+    python benchmarks/api_proxy.py --requests 500 --parallelism 20 --limit 40 --json
+"""
+
+import argparse
+import collections
+import http.client
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from swarm_tf.common.api_proxy import ApiProxy, ThreadingServer
+
+
+class MockApi:
+    """Digital Ocean API mock with a rate limit of `limit` requests per second"""
+
+    def __init__(self, limit, latency=0.02):
+        self.limit = limit
+        self.latency = latency
+        self.window = collections.deque()
+        self.lock = threading.Lock()
+        self.throttled = 0
+        self.server = None
+
+    def allow(self):
+        with self.lock:
+            now = time.monotonic()
+            while self.window and now - self.window[0] > 1:
+                self.window.popleft()
+            if len(self.window) >= self.limit:
+                self.throttled += 1
+                return False
+            self.window.append(now)
+            return True
+
+    def start(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def handle_request(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                if length:
+                    self.rfile.read(length)
+                if mock.allow():
+                    time.sleep(mock.latency)
+                    status, body = 200, json.dumps({"droplet": {"id": 1}}).encode()
+                else:
+                    status, body = 429, json.dumps({"id": "too_many_requests"}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if status == 429:
+                    self.send_header("Retry-After", "1")
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = handle_request
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def client_burst(url, requests, parallelism, retry_delay=1.0, max_retries=30):
+    """Terraform-like clients: on 429 each request waits and retries on its own"""
+    host, port = url[len("http://"):].split(":")
+    throttled = [0]
+
+    def call(number):
+        path = "/v2/droplets" if number % 3 else "/v2/domains/example.com/records"
+        for _ in range(max_retries):
+            connection = http.client.HTTPConnection(host, int(port), timeout=120)
+            connection.request("POST" if number % 2 else "GET", path, body=b"{}" if number % 2 else None)
+            status = connection.getresponse().status
+            connection.close()
+            if status != 429:
+                return status
+            throttled[0] += 1
+            time.sleep(retry_delay)
+        return 429
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        statuses = list(executor.map(call, range(requests)))
+    return {"seconds": round(time.time() - start, 2), "ok": statuses.count(200), "client_429": throttled[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--parallelism", type=int, default=10, help="Concurrent clients (terraform -parallelism)")
+    parser.add_argument("--limit", type=int, default=30, help="Requests per second accepted by the mock")
+    parser.add_argument("--json", action="store_true", help="Print the results as json")
+    args = parser.parse_args()
+
+    results = {}
+    mock = MockApi(args.limit)
+    url = mock.start()
+    results["direct"] = dict(client_burst(url, args.requests, args.parallelism), api_429=mock.throttled)
+
+    mock.throttled = 0
+    proxy = ApiProxy(upstream=url, rate=args.limit * 0.9, burst=max(1, args.limit // 10))
+    proxy.start()
+    results["proxy"] = dict(client_burst(proxy.url, args.requests, args.parallelism), api_429=mock.throttled)
+    proxy.stop()
+    mock.stop()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print("{:<8} {:>9} {:>6} {:>11} {:>8}".format("mode", "seconds", "ok", "client 429", "api 429"))
+        for mode, result in results.items():
+            print("{:<8} {:>9} {:>6} {:>11} {:>8}".format(mode, result["seconds"], result["ok"],
+                                                         result["client_429"], result["api_429"]))
+        print()
+        print(proxy.stats.summary())
+
+
+if __name__ == "__main__":
+    main()
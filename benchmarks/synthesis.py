@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+"""
+Benchmark of the terraform generation (Terraobject graph + json) for large clusters.
+
+Run it from the repository root. It runs offline: no Digital Ocean token or terraform is needed.
+
+    python benchmarks/synthesis.py
+    python benchmarks/synthesis.py --sizes 100 1000 --fleet --json
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from terraobject import Terraobject
+from terrascript import provider, function
+from terrascript.digitalocean.d import digitalocean_ssh_key as data_digitalocean_ssh_key
+from swarm_tf.managers import Manager, ManagerVariables
+from swarm_tf.workers import Worker, WorkerVariables
+from swarm_tf.common import VolumeClaim, get_user_data_script, create_firewall
+
+DEFAULT_SIZES = [10, 100, 1000, 5000]
+
+
+def build_cluster(total_nodes, fleet=False, bootstrap="ssh"):
+    """Build a cluster with 3 managers, 5% of persistent workers and the remaining as workers"""
+    domain = "swarm.example.com"
+    region = "nyc3"
+
+    o = Terraobject()
+    o.terrascript.add(provider("digitalocean", token="benchmark"))
+    sshkey = data_digitalocean_ssh_key("sshkey", name="id_rsa")
+    o.terrascript.add(sshkey)
+
+    managers = 3 if total_nodes >= 10 else 1
+    persistent = max(1, total_nodes // 20)
+    workers = total_nodes - managers - persistent
+
+    manager_var = ManagerVariables()
+    manager_var.region = region
+    manager_var.domain = domain
+    manager_var.total_instances = managers
+    manager_var.user_data = get_user_data_script()
+    manager_var.tags = ["cluster", "manager"]
+    manager_var.ssh_keys = [sshkey.id]
+    manager_var.create_dns = True
+    Manager(o, manager_var).create_managers()
+
+    worker_var = WorkerVariables()
+    worker_var.region = region
+    worker_var.domain = domain
+    worker_var.total_instances = workers
+    worker_var.user_data = get_user_data_script()
+    worker_var.tags = ["cluster", "worker"]
+    worker_var.manager_private_ip = o.shared["manager_nodes"][0].ipv4_address_private
+    worker_var.join_token = function.lookup(o.shared["swarm_tokens"].result, "worker", "")
+    worker_var.ssh_keys = [sshkey.id]
+    worker_var.create_dns = True
+    worker_var.fleet = fleet
+    worker_var.bootstrap = bootstrap
+    Worker(o, worker_var).create_workers()
+
+    worker_var.name = "persistent"
+    worker_var.total_instances = persistent
+    worker_var.persistent_volumes = [VolumeClaim(o, region, "volume-{:04d}".format(i + 1), size=10)
+                                     for i in range(persistent)]
+    Worker(o, worker_var).create_workers()
+
+    create_firewall(o, domain=domain, inbound_ports=[22, 80, 443], tag="cluster")
+    return o
+
+
+def count_resources(o):
+    config = o.terrascript.config
+    total = sum([len(items) for items in config["resource"].values()])
+    total += sum([len(items) for items in config["data"][0].values()])
+    return total
+
+
+def run(total_nodes, fleet=False, bootstrap="ssh", repeat=3):
+    """Return the best build and dump time of `repeat` runs, the peak memory and the size of the result"""
+    build_time = dump_time = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        o = build_cluster(total_nodes, fleet, bootstrap)
+        middle = time.perf_counter()
+        content = o.terrascript.dump()
+        end = time.perf_counter()
+        build_time = min(build_time, middle - start)
+        dump_time = min(dump_time, end - middle)
+
+    tracemalloc.start()
+    o = build_cluster(total_nodes, fleet, bootstrap)
+    o.terrascript.dump()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "nodes": total_nodes,
+        "fleet": fleet,
+        "bootstrap": bootstrap,
+        "build_seconds": round(build_time, 4),
+        "dump_seconds": round(dump_time, 4),
+        "peak_memory_bytes": peak,
+        "resources": count_resources(o),
+        "json_bytes": len(content.encode()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the swarm_tf terraform generation")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Cluster sizes (nodes)")
+    parser.add_argument("--fleet", action="store_true", help="Create the workers in fleet mode")
+    parser.add_argument("--bootstrap", default="ssh", choices=["ssh", "cloud-init"], help="Worker bootstrap mode")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per size (the best time is reported)")
+    parser.add_argument("--json", action="store_true", help="Print the results as json")
+    args = parser.parse_args()
+
+    results = [run(size, args.fleet, args.bootstrap, args.repeat) for size in args.sizes]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print("{:>6} {:>10} {:>10} {:>12} {:>10} {:>12}".format("nodes", "build(s)", "dump(s)", "peak(MiB)",
+                                                          "resources", "json(KiB)"))
+    for result in results:
+        print("{:>6} {:>10.4f} {:>10.4f} {:>12.2f} {:>10} {:>12.1f}".format(result["nodes"],
+                                                                           result["build_seconds"],
+                                                                           result["dump_seconds"],
+                                                                           result["peak_memory_bytes"] / 2**20,
+                                                                           result["resources"],
+                                                                           result["json_bytes"] / 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,10 @@ with open("README.md", "r") as fh:
 setuptools.setup(
     name="swarm_tf",
     version="0.2.4",
-    scripts=["scripts/terrascript", "scripts/connect_to_manager"],
+    scripts=["scripts/terrascript", "scripts/connect_to_manager", "scripts/swarm_autoscale",
+             "scripts/swarm_rolling_update", "scripts/swarm_build_image",
+             "scripts/swarm_timeline", "scripts/swarm_profile",
+             "scripts/swarm_tf", "scripts/swarm_probe"],
     author="Joao Gilberto Magalhaes",
     author_email="joao@byjg.com.br",
     description="Create a Swarm Cluster on Digital Ocean using Terraform Wrapped by Python",
@@ -18,17 +21,22 @@ setuptools.setup(
         'swarm_tf.common',
         'swarm_tf.managers',
         'swarm_tf.workers',
+        'swarm_tf.topology',
+        'swarm_tf.images',
     ],
     package_dir={
         'swarm_tf': 'src/swarm_tf',
         'swarm_tf.common': 'src/swarm_tf/common',
         'swarm_tf.managers': 'src/swarm_tf/managers',
         'swarm_tf.workers': 'src/swarm_tf/workers',
+        'swarm_tf.topology': 'src/swarm_tf/topology',
+        'swarm_tf.images': 'src/swarm_tf/images',
     },
     package_data={
-        'swarm_tf.common': ['scripts/*.sh'],
+        'swarm_tf.common': ['scripts/*.sh', 'scripts/*.py'],
         'swarm_tf.managers': ['scripts/*.sh', 'scripts/*.yml', 'scripts/certs/*'],
         'swarm_tf.workers': ['scripts/*.sh'],
+        'swarm_tf.images': ['scripts/*.sh'],
     },
     include_package_data=True,
     license="MIT",
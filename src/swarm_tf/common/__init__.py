@@ -1,9 +1,30 @@
+import hashlib
+import json
 import os
-from terrascript import function, output, provisioner
+import re
+from terrascript import connection, function, output, provisioner, resource
 from terrascript.digitalocean.r import digitalocean_droplet, digitalocean_volume, digitalocean_tag, \
-    digitalocean_firewall, digitalocean_record
+    digitalocean_record
 from terrascript.digitalocean.d import digitalocean_volume as data_digitalocean_volume
-from terrascript.template.d import template_file
+from terrascript.digitalocean.d import digitalocean_image as data_digitalocean_image
+from terrascript.template.d import template_file, template_cloudinit_config
+from swarm_tf.common.firewall import FirewallBuilder
+from swarm_tf.common.profiles import get_profile
+
+scripts_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "workers", "scripts")
+common_scripts_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts")
+
+# Pull-through cache of the Docker Hub served by the node groups with registry_mirror = True
+REGISTRY_MIRROR_IMAGE = "registry:2"
+REGISTRY_MIRROR_PORT = 5000
+
+# Replaced by the names of the volumes of each droplet in the shared attach_volume.sh template
+VOLUMES_PLACEHOLDER = "__SWARM_TF_VOLUMES__"
+
+# The user data of the cloud-init bootstrap renders the join token and the manager address: a token rotation or a
+# new first manager must not replace the droplets. The existing nodes keep their user data, only the new ones use
+# the changes
+CLOUD_INIT_LIFECYCLE = {"ignore_changes": ["user_data"]}
 
 
 class Node:
@@ -11,10 +32,19 @@ class Node:
         """type o: Terraobject"""
         """type variables: Variables"""
         self.o = o
-        self.variables = variables
+        # Validated copy: the variables can be changed and reused for the next node group
+        self.variables = variables.copy().freeze()
+        self.total_instances = self.get_total_instances()
         if "__variables" not in o.shared:
             o.shared["__variables"] = []
-        o.shared["__variables"] += [{"type": variables.name, "instances": variables.total_instances}]
+        o.shared["__variables"] += [{"type": self.variables.name, "instances": self.total_instances}]
+
+    def get_total_instances(self):
+        return self.variables.total_instances
+
+    def add(self, item):
+        """Add the item to the terrascript and to the section of this node group"""
+        return add_item(self.o, item, self.variables.name)
 
     def fmt_number(self, number):
         return "{0:02d}".format(number)
@@ -27,71 +57,226 @@ class Node:
         for tag in self.variables.tags:
             if "tags:" + tag not in self.o.shared:
                 tag_obj = digitalocean_tag(tag, name=tag)
-                self.o.terrascript.add(tag_obj)
+                self.add(tag_obj)
                 self.o.shared["tags:" + tag] = tag_obj
             tag_list += [self.o.shared["tags:" + tag].id]
         return tag_list
 
-    def create_droplet(self, droplet_type, number, conn, prov):
+    def get_image(self):
+        """The droplet image, or the pre-baked snapshot (see swarm_tf.images) when defined"""
+        if self.variables.snapshot is None:
+            return self.variables.image
+
+        key = "snapshot:" + self.variables.snapshot
+        if key not in self.o.shared:
+            self.o.shared[key] = self.add(data_digitalocean_image(re.sub("[^0-9a-zA-Z]+", "_", self.variables.snapshot),
+                                                                  name=self.variables.snapshot))
+        return self.o.shared[key].image
+
+    def get_user_data(self):
+        # The pre-baked snapshot already has Docker installed
+        if self.variables.snapshot is not None and isinstance(self.variables.user_data, DockerUserData):
+            return ""
+        return self.variables.user_data
+
+    def prepare_attach_template(self, claim):
+        key = "attach_volume:" + claim.template_key()
+        if key not in self.o.shared:
+            tmpl_attach = template_file("attach_volume_{}".format(claim.template_key()),
+                                        template=function.file(os.path.join(scripts_dir, "attach_volume.sh")),
+                                        vars=dict(claim.template_vars(), mark=mark_script(),
+                                                  volumes=VOLUMES_PLACEHOLDER))
+            self.add(tmpl_attach)
+            self.o.shared[key] = tmpl_attach
+        return self.o.shared[key]
+
+    def attach_volume(self, claim, prov, cloud_init, volumes=None):
+        """Attach script of the claim. `volumes` is the expression of the volume names of the droplet, separated by
+        spaces (default: the names of the claim)"""
+        tmpl_attach = self.prepare_attach_template(claim)
+        if volumes is None:
+            volumes = '"{}"'.format(" ".join(claim.volume_names()))
+        if cloud_init:
+            return with_volumes(self.get_cloud_init(tmpl_attach), volumes)
+
+        prov.append(provisioner("file",
+                                content=with_volumes(tmpl_attach.rendered, volumes),
+                                destination="/tmp/attach_volume.sh"))
+
+        prov.append(provisioner("remote-exec",
+                                inline=[
+                                  "chmod +x /tmp/attach_volume.sh",
+                                  "/tmp/attach_volume.sh"]))
+        return self.get_user_data()
+
+    def get_registry_mirrors(self):
+        """URLs of the registry mirrors used by the nodes. By default the mirrors served by the node groups created
+        before this one"""
+        if self.variables.registry_mirrors is not None:
+            return self.variables.registry_mirrors
+        return self.o.shared.get("registry_mirrors", [])
+
+    def prepare_registry_template(self):
+        """Registry mirror and image pre-pull script of the node group. None when not used"""
+        mirrors = self.get_registry_mirrors()
+        if not (self.variables.registry_mirror or mirrors or self.variables.prepull_images):
+            return None
+
+        key = "registry_mirror:" + self.variables.name
+        if key not in self.o.shared:
+            tmpl = template_file("registry_mirror_{}".format(self.variables.name),
+                                 template=function.file(os.path.join(common_scripts_dir, "registry-mirror.sh")),
+                                 vars={
+                                     "mark": mark_script(),
+                                     "docker_cmd": self.variables.docker_cmd,
+                                     "serve": "true" if self.variables.registry_mirror else "false",
+                                     "registry_image": REGISTRY_MIRROR_IMAGE,
+                                     "port": REGISTRY_MIRROR_PORT,
+                                     "mirrors": ",".join(mirrors),
+                                     "images": " ".join(self.variables.prepull_images),
+                                     "parallel": self.variables.prepull_parallel
+                                 })
+            self.add(tmpl)
+            self.o.shared[key] = tmpl
+        return self.o.shared[key]
+
+    def prepare_tuning_template(self):
+        """Performance profile script of the node group. None when the group has no profile"""
+        profile = get_profile(self.variables.profile)
+        if profile is None:
+            return None
+
+        key = "tune_node:" + self.variables.name
+        if key not in self.o.shared:
+            tmpl = template_file("tune_node_{}".format(self.variables.name),
+                                 template=function.file(os.path.join(common_scripts_dir, "tune-node.sh")),
+                                 vars={
+                                     "mark": mark_script(),
+                                     "docker_cmd": self.variables.docker_cmd,
+                                     "daemon_json": profile.daemon_json(),
+                                     "sysctl": profile.sysctl_conf(),
+                                     "swap_size": "" if profile.swap_size is None else profile.swap_size
+                                 })
+            self.add(tmpl)
+            self.o.shared[key] = tmpl
+        return self.o.shared[key]
+
+    def bootstrap_templates(self):
+        """Scripts executed before the node joins the cluster, as a list of (file name, template)"""
+        templates = [("20-tune-node.sh", self.prepare_tuning_template()),
+                     ("30-registry-mirror.sh", self.prepare_registry_template()),
+                     ("40-local-dns.sh", self.prepare_dns_template())]
+        return [(filename, tmpl) for filename, tmpl in templates if tmpl is not None]
+
+    def bootstrap_provisioners(self):
+        """Provisioners running the bootstrap scripts (ssh bootstrap)"""
+        prov = []
+        for filename, tmpl in self.bootstrap_templates():
+            destination = "/tmp/" + filename
+            prov.append(provisioner("file",
+                                    content=tmpl.rendered,
+                                    destination=destination))
+            prov.append(provisioner("remote-exec",
+                                    inline=[
+                                        "chmod +x " + destination,
+                                        destination]))
+        return prov
+
+    def register_registry_mirror(self, droplets):
+        """Make the registry mirror served by the droplets the default of the node groups created next"""
+        if not self.variables.registry_mirror:
+            return
+        urls = []
+        for droplet in droplets:
+            if isinstance(droplet, DropletGroup):
+                urls.append('${{join(",", formatlist("http://%s:{}", {}))}}'
+                            .format(REGISTRY_MIRROR_PORT, unwrap(droplet.ipv4_address_private)))
+            else:
+                urls.append("http://{}:{}".format(droplet.ipv4_address_private, REGISTRY_MIRROR_PORT))
+        self.o.shared["registry_mirrors"] = self.o.shared.get("registry_mirrors", []) + urls
+
+    def cloud_init_parts(self):
+        """Extra scripts executed at the first boot when the node bootstraps by cloud-init"""
+        return [{
+            "filename": filename,
+            "content_type": "text/x-shellscript",
+            "content": tmpl.rendered
+        } for filename, tmpl in self.bootstrap_templates()]
+
+    def get_cloud_init(self, tmpl_attach=None):
+        name = "{}_user_data{}".format(self.variables.name, "" if tmpl_attach is None else "_" + tmpl_attach._name)
+        if name not in self.o.shared:
+            parts = [{
+                "filename": "00-user-data.sh",
+                "content_type": "text/x-shellscript",
+                "content": self.get_user_data()
+            }]
+            if tmpl_attach is not None:
+                parts.append({
+                    "filename": "10-attach-volume.sh",
+                    "content_type": "text/x-shellscript",
+                    "content": tmpl_attach.rendered
+                })
+            user_data = template_cloudinit_config(name,
+                                                  gzip=False,
+                                                  base64_encode=False,
+                                                  part=parts + self.cloud_init_parts())
+            self.add(user_data)
+            self.o.shared[name] = user_data
+        return self.o.shared[name].rendered
+
+    def create_droplet(self, droplet_type, number, conn, prov, cloud_init=False):
         number_str = self.fmt_number(number)
         droplet_name = self.fmt_name(self.variables.name, number)
         droplet_name_dns = self.fmt_name(self.variables.name, number, "-")
 
-        volume = None
+        volumes = []
+        user_data = None
         if self.variables.persistent_volumes is not None and number <= len(self.variables.persistent_volumes):
-            volume = self.variables.persistent_volumes[number-1].create()
-
-            tmpl_attach = template_file("attach_volume_{}".format(droplet_name),
-                                        template=function.file(os.path.join(self.curdir, "scripts", "attach_volume.sh")),
-                                        vars={
-                                            "volume_name": "/dev/sda",
-                                            "mount": self.variables.persistent_volumes[number-1].mount
-                                        })
-            self.o.terrascript.add(tmpl_attach)
-            prov.append(provisioner("file",
-                                    content=tmpl_attach.rendered,
-                                    destination="/tmp/attach_volume.sh"))
-
-            prov.append(provisioner("remote-exec",
-                                    inline=[
-                                      "chmod +x /tmp/attach_volume.sh",
-                                      "/tmp/attach_volume.sh"]))
+            volumes = [self.add(volume) for volume in self.variables.persistent_volumes[number-1].create_stripes()]
+            user_data = self.attach_volume(self.variables.persistent_volumes[number-1], prov, cloud_init)
+        elif cloud_init:
+            user_data = self.get_cloud_init()
+        else:
+            user_data = self.get_user_data()
 
         droplet = digitalocean_droplet(droplet_name,
                                        ssh_keys=self.variables.ssh_keys,
-                                       image=self.variables.image,
+                                       image=self.get_image(),
                                        region=self.variables.region,
                                        size=self.variables.size,
                                        private_networking="true",
                                        backups=self.variables.backups,
                                        ipv6="false",
-                                       user_data=self.variables.user_data,
+                                       user_data=user_data,
                                        tags=self.get_tags_id(),
                                        count=1,
                                        name="{}.{}".format(droplet_name_dns, self.variables.domain),
                                        connection=conn,
-                                       volume_ids=[volume.id] if not(volume is None) else None,
+                                       volume_ids=[volume.id for volume in volumes] if volumes else None,
+                                       lifecycle=CLOUD_INIT_LIFECYCLE if cloud_init else None,
                                        provisioner=prov)
 
         self.o.shared[droplet_type + "_nodes"].append(droplet)
-        self.o.terrascript.add(droplet)
-        self.o.terrascript.add(output("{}_id".format(droplet_name),
-                                      value=droplet.id,
-                                      description="The {} node id".format(droplet_type)))
-        self.o.terrascript.add(output("{}_ipv4_public".format(droplet_name),
-                                      value=droplet.ipv4_address,
-                                      description="The {} nodes public ipv4 address".format(droplet_type)))
-        self.o.terrascript.add(output("{}_ipv4_private".format(droplet_name),
-                                      value=droplet.ipv4_address_private,
-                                      description="The {} nodes private ipv4 address".format(droplet_type)))
+        self.add(droplet)
+        self.add(output("{}_id".format(droplet_name),
+                        value=droplet.id,
+                        description="The {} node id".format(droplet_type)))
+        self.add(output("{}_ipv4_public".format(droplet_name),
+                        value=droplet.ipv4_address,
+                        description="The {} nodes public ipv4 address".format(droplet_type)))
+        self.add(output("{}_ipv4_private".format(droplet_name),
+                        value=droplet.ipv4_address_private,
+                        description="The {} nodes private ipv4 address".format(droplet_type)))
 
-        if self.variables.create_dns:
+        if self.variables.create_dns and not self.variables.dns_grouped:
             self.create_dns_entry(domain=self.variables.domain,
                                   entry=droplet_name_dns,
                                   ip=droplet.ipv4_address)
-            self.create_dns_entry(domain=self.variables.domain,
-                                  entry="{}-internal".format(droplet_name_dns),
-                                  ip=droplet.ipv4_address_private)
+            if not self.is_local_dns():
+                self.create_dns_entry(domain=self.variables.domain,
+                                      entry="{}-internal".format(droplet_name_dns),
+                                      ip=droplet.ipv4_address_private)
             self.create_dns_entry(domain=self.variables.domain,
                                   entry=self.variables.tags[0],
                                   ip=droplet.ipv4_address,
@@ -99,33 +284,293 @@ class Node:
 
         return droplet
 
-    def create_dns_entry(self, domain, entry, ip, name=None):
+    def create_droplet_group(self, droplet_type, conn, prov, cloud_init=False):
+        """Create all the instances as a single counted droplet resource (fleet mode)"""
+        total = self.total_instances
+        droplet_name = self.variables.name
+        count_name = '${{format("{}-%02d", count.index + 1)}}'.format(droplet_name)
+
+        volume_ids = None
+        user_data = None
+        if self.variables.persistent_volumes is not None:
+            claims = self.variables.persistent_volumes[:total]
+            if len(claims) < total:
+                raise ValueError("Fleet mode needs one persistent volume per instance ({} < {})"
+                                 .format(len(claims), total))
+            if len(set([claim.template_key() for claim in claims])) > 1:
+                raise ValueError("Fleet mode needs the same mount point and settings for all the persistent volumes")
+
+            # One list per stripe, indexed by the droplet
+            stripes = [[unwrap(self.add(volume).id) for volume in claim.create_stripes()] for claim in claims]
+            volume_ids = ["${{element(list({}), count.index)}}".format(",".join(ids)) for ids in zip(*stripes)]
+            names = ",".join(['"{}"'.format(" ".join(claim.volume_names())) for claim in claims])
+            user_data = self.attach_volume(claims[0], prov, cloud_init, "element(list({}), count.index)".format(names))
+        elif cloud_init:
+            user_data = self.get_cloud_init()
+        else:
+            user_data = self.get_user_data()
+
+        droplet = digitalocean_droplet(droplet_name,
+                                       ssh_keys=self.variables.ssh_keys,
+                                       image=self.get_image(),
+                                       region=self.variables.region,
+                                       size=self.variables.size,
+                                       private_networking="true",
+                                       backups=self.variables.backups,
+                                       ipv6="false",
+                                       user_data=user_data,
+                                       tags=self.get_tags_id(),
+                                       count=total,
+                                       name="{}.{}".format(count_name, self.variables.domain),
+                                       connection=conn,
+                                       volume_ids=volume_ids,
+                                       lifecycle=CLOUD_INIT_LIFECYCLE if cloud_init else None,
+                                       provisioner=prov)
+
+        group = DropletGroup(droplet)
+        self.o.shared[droplet_type + "_nodes"].append(group)
+        self.add(droplet)
+        self.add(output("{}_ids".format(droplet_name),
+                        value=[group.id],
+                        description="The {} node ids".format(droplet_type)))
+        self.add(output("{}_ipv4_public".format(droplet_name),
+                        value=[group.ipv4_address],
+                        description="The {} nodes public ipv4 addresses".format(droplet_type)))
+        self.add(output("{}_ipv4_private".format(droplet_name),
+                        value=[group.ipv4_address_private],
+                        description="The {} nodes private ipv4 addresses".format(droplet_type)))
+
+        if self.variables.create_dns:
+            self.create_dns_entry(domain=self.variables.domain,
+                                  entry=count_name,
+                                  ip=group.element("ipv4_address"),
+                                  name=droplet_name,
+                                  count=total)
+            if not self.is_local_dns():
+                self.create_dns_entry(domain=self.variables.domain,
+                                      entry='{}-internal'.format(count_name),
+                                      ip=group.element("ipv4_address_private"),
+                                      name="{}-internal".format(droplet_name),
+                                      count=total)
+            self.create_dns_entry(domain=self.variables.domain,
+                                  entry=self.variables.tags[0],
+                                  ip=group.element("ipv4_address"),
+                                  name="{}-{}".format(droplet_name, self.variables.tags[0]),
+                                  count=total)
+
+        return group
+
+    def create_dns_entry(self, domain, entry, ip, name=None, count=None, ttl=None):
         if name is None:
             name = "{}_{}".format(domain.replace(".", "_"), entry)
         else:
             name = "{}_{}".format(domain.replace(".", "_"), name)
 
-        self.o.terrascript.add(digitalocean_record(name,
-                                                   domain=domain,
-                                                   type="A",
-                                                   name=entry,
-                                                   value=ip,
-                                                   ttl=60))
+        self.add(digitalocean_record(name,
+                                     domain=domain,
+                                     type="A",
+                                     name=entry,
+                                     value=ip,
+                                     ttl=ttl or self.variables.dns_ttl,
+                                     count=count))
+
+    def is_local_dns(self):
+        """True when the internal names are served by the CoreDNS of the managers instead of Digital Ocean"""
+        return self.serves_local_dns() or "local_dns" in self.o.shared
+
+    def serves_local_dns(self):
+        return False
+
+    def dns_hosts(self, droplets):
+        """List of (host name, public ip, private ip) of the droplets of the group"""
+        hosts = []
+        for droplet in droplets:
+            if isinstance(droplet, DropletGroup):
+                hosts += [(self.fmt_name(self.variables.name, index + 1, "-"),
+                           "${{element({}, {})}}".format(unwrap(droplet.ipv4_address), index),
+                           "${{element({}, {})}}".format(unwrap(droplet.ipv4_address_private), index))
+                          for index in range(self.total_instances)]
+            else:
+                hosts.append((self.fmt_name(self.variables.name, len(hosts) + 1, "-"),
+                              droplet.ipv4_address, droplet.ipv4_address_private))
+        return hosts
+
+    def create_dns(self, droplets):
+        """Records created per node group: the grouped Digital Ocean records (dns_grouped) and the names of the
+        group in the local DNS of the managers"""
+        hosts = self.dns_hosts(droplets)
+        domain = self.variables.domain
+        fleet = any([isinstance(droplet, DropletGroup) for droplet in droplets])
+        if self.variables.create_dns and self.variables.dns_grouped and not fleet:
+            # One counted record per kind instead of one record per droplet
+            def indexed(values):
+                return "${{element(list({}), count.index)}}".format(",".join(values))
+
+            public = indexed([unwrap(host[1]) for host in hosts])
+            self.create_dns_entry(domain=domain, entry=indexed(['"{}"'.format(host[0]) for host in hosts]),
+                                  ip=public, name=self.variables.name, count=len(hosts))
+            if not self.is_local_dns():
+                self.create_dns_entry(domain=domain,
+                                      entry=indexed(['"{}-internal"'.format(host[0]) for host in hosts]),
+                                      ip=indexed([unwrap(host[2]) for host in hosts]),
+                                      name="{}-internal".format(self.variables.name), count=len(hosts))
+            self.create_dns_entry(domain=domain, entry=self.variables.tags[0], ip=public,
+                                  name="{}-{}".format(self.variables.name, self.variables.tags[0]), count=len(hosts))
+
+        if not self.is_local_dns():
+            return
+
+        # hosts file of the group, round robin on the tag name
+        lines = ["{} {}-internal.{}".format(private, name, domain) for name, _, private in hosts]
+        if self.variables.tags:
+            lines += ["{} {}-internal.{}".format(private, self.variables.tags[0], domain) for _, _, private in hosts]
+        content = "\n".join(lines) + "\n"
+
+        local = self.o.shared["local_dns"]
+        path = "/etc/swarm_tf/dns/hosts.d/{}".format(self.variables.name)
+        self.add(resource("null_resource", "{}_dns".format(self.variables.name),
+                          count=len(local["hosts"]),
+                          connection=connection(type="ssh",
+                                                host="${{element(list({}), count.index)}}".format(
+                                                    ",".join([unwrap(host) for host in local["hosts"]])),
+                                                user=self.variables.provision_user,
+                                                private_key=function.file(self.variables.provision_ssh_key),
+                                                timeout=self.variables.connection_timeout),
+                          triggers={
+                              "hosts": content,
+                              "server": "${{element(list({}), count.index)}}".format(
+                                  ",".join([unwrap(host) for host in local["hosts"]]))
+                          },
+                          provisioner=[
+                              provisioner("file",
+                                          content=content,
+                                          destination="/tmp/{}.hosts".format(self.variables.name)),
+                              provisioner("remote-exec",
+                                          inline=[
+                                              "sudo mkdir -p /etc/swarm_tf/dns/hosts.d",
+                                              "sudo mv /tmp/{}.hosts {}".format(self.variables.name, path),
+                                              "cat /etc/swarm_tf/dns/hosts.d/* | sudo tee /etc/swarm_tf/dns/hosts "
+                                              "> /dev/null"])
+                          ]))
+
+    def prepare_dns_template(self):
+        """Resolver configuration of the node group when the managers serve the internal names. None otherwise"""
+        if not self.is_local_dns():
+            return None
+
+        key = "local_dns:" + self.variables.name
+        if key not in self.o.shared:
+            servers = [] if self.serves_local_dns() else self.o.shared["local_dns"]["servers"]
+            tmpl = template_file("local_dns_{}".format(self.variables.name),
+                                 template=function.file(os.path.join(common_scripts_dir, "local-dns.sh")),
+                                 vars={
+                                     "domain": self.variables.domain,
+                                     "servers": ",".join(servers)
+                                 })
+            self.add(tmpl)
+            self.o.shared[key] = tmpl
+        return self.o.shared[key]
+
+
+class DropletGroup:
+    """Reference to a counted droplet resource. The attributes are splat expressions (lists)"""
+    def __init__(self, droplet):
+        self.droplet = droplet
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return "${{{}.*.{}}}".format(self.droplet.fullname, name)
+
+    def element(self, name):
+        return "${{element({}.*.{}, count.index)}}".format(self.droplet.fullname, name)
+
+    def join_ids(self):
+        return '${{join(",", {}.*.id)}}'.format(self.droplet.fullname)
+
+
+def add_item(o, item, group="main"):
+    """Add the item to the terrascript, remembering the section (node group) it belongs to"""
+    if "__groups" not in o.shared:
+        o.shared["__groups"] = {}
+    o.shared["__groups"][id(item)] = group
+    return o.terrascript.add(item)
+
+
+def unwrap(reference):
+    """Remove the interpolation delimiters "${...}" to use a reference inside another expression"""
+    return reference[2:-1]
+
+
+def with_volumes(rendered, volumes):
+    """The rendered attach script (or cloud-init config) with the volume names expression of the droplet"""
+    return '${{replace({}, "{}", {})}}'.format(unwrap(rendered), VOLUMES_PLACEHOLDER, volumes)
 
 
 class VolumeClaim:
-    def __init__(self, o, region, name, size=None, mount="/data"):
+    def __init__(self, o, region, name, size=None, mount="/data", filesystem="ext4", stripes=1, stripe_mode="raid0",
+                 mount_options="defaults,noatime,nofail", mkfs_options="", readahead=None, fstrim=True):
+        """Persistent storage of a droplet.
+
+        With stripes > 1 the droplet receives `stripes` volumes (named <name>-01, <name>-02, ...) combined in one
+        striped device (stripe_mode 'raid0' with mdadm or 'lvm'). The file system ('ext4'|'xfs') is created on the
+        first attach when the device is empty. `readahead` is in KB. With `fstrim` the unused blocks are discarded
+        by the weekly fstrim timer instead of the `discard` mount option."""
+        if filesystem not in ["ext4", "xfs"]:
+            raise ValueError("Invalid filesystem '{}'. Use 'ext4' or 'xfs'".format(filesystem))
+        if stripe_mode not in ["raid0", "lvm"]:
+            raise ValueError("Invalid stripe_mode '{}'. Use 'raid0' or 'lvm'".format(stripe_mode))
+        if stripes < 1:
+            raise ValueError("stripes must be at least 1")
         self.o = o
         self.region = region
         self.name = name
         self.size = size
         self.mount = mount
+        self.filesystem = filesystem
+        self.stripes = stripes
+        self.stripe_mode = stripe_mode
+        self.mount_options = mount_options
+        self.mkfs_options = mkfs_options
+        self.readahead = readahead
+        self.fstrim = fstrim
+
+    def volume_names(self):
+        if self.stripes == 1:
+            return [self.name]
+        return ["{}-{:02d}".format(self.name, number) for number in range(1, self.stripes + 1)]
 
     def create(self):
+        """Return the volume of the claim. The claims with stripes > 1 have one volume per stripe, see
+        create_stripes"""
+        if self.stripes > 1:
+            raise ValueError("The volume claim '{}' has {} stripes: use create_stripes()".format(self.name,
+                                                                                                 self.stripes))
+        return self.create_stripes()[0]
+
+    def create_stripes(self):
+        """Return the list of volumes, one per stripe"""
         if self.size is None:
-            return self.__existent(self.name)
+            return [self.__existent(name) for name in self.volume_names()]
         else:
-            return self.__new(self.name, self.size)
+            return [self.__new(name, self.size) for name in self.volume_names()]
+
+    def template_vars(self):
+        return {
+            "mount": self.mount,
+            "filesystem": self.filesystem,
+            "stripes": self.stripes,
+            "stripe_mode": self.stripe_mode,
+            "mount_options": self.mount_options,
+            "mkfs_options": self.mkfs_options,
+            "readahead": "" if self.readahead is None else self.readahead,
+            "fstrim": "true" if self.fstrim else "false"
+        }
+
+    def template_key(self):
+        """Name of the attach template. The droplets with the same settings share the template"""
+        digest = hashlib.sha1(json.dumps(self.template_vars(), sort_keys=True).encode()).hexdigest()[:8]
+        return "{}_{}".format(re.sub("[^0-9a-zA-Z]+", "_", self.mount).strip("_"), digest)
 
     def __existent(self, name):
         volume = data_digitalocean_volume(name, name=name, region=self.region)
@@ -137,69 +582,35 @@ class VolumeClaim:
                                      region=self.region,
                                      name=name,
                                      size=size,
-                                     initial_filesystem_type="ext4",
+                                     initial_filesystem_type=self.filesystem if self.stripes == 1 else None,
                                      description="Swarm Volume {} of {} gb".format(name, size))
         self.o.terrascript.add(volume)
         return volume
 
 
-def get_user_data_script():
-    return function.file(os.path.join(os.path.dirname(__file__), "scripts", "install-docker-ce.sh"))
+def mark_script():
+    """The mark() shell function of the provisioning scripts (template variable "mark")"""
+    return function.file(os.path.join(common_scripts_dir, "mark.sh"))
 
 
-def create_firewall(o, domain, inbound_ports, tag):
-    # droplet_ids = []
-    # for droplet in o.shared["manager_nodes"] + o.shared["worker_nodes"]:
-    #     droplet_ids += [droplet.id]
-    inbound_rules = [
-        {
-            "protocol": "icmp",
-            "source_tags": [tag]
-        },
-        {
-            "protocol": "tcp",
-            "port_range": "1-65535",
-            "source_tags": [tag]
-        },
-        {
-            "protocol": "udp",
-            "port_range": "1-65535",
-            "source_tags": [tag]
-        }
-    ]
-    for port in inbound_ports:
-        rule = {
-            "protocol": "tcp",
-            "port_range": port,
-            "source_addresses": ["0.0.0.0/0", "::/0"]
-        }
-        inbound_rules += [rule]
-
-    outbound_rules = [
-        {
-            "protocol": "icmp",
-            "destination_addresses": ["0.0.0.0/0", "::/0"],
-            "destination_tags": [tag]
-        },
-        {
-            "protocol": "tcp",
-            "port_range": "1-65535",
-            "destination_addresses": ["0.0.0.0/0", "::/0"],
-            "destination_tags": [tag]
-        },
-        {
-            "protocol": "udp",
-            "port_range": "1-65535",
-            "destination_addresses": ["0.0.0.0/0", "::/0"],
-            "destination_tags": [tag]
-        }
-    ]
+class DockerUserData(str):
+    """User data installing Docker (see get_user_data_script), whatever the swap size: the droplets created from a
+    pre-baked snapshot do not use it"""
+
 
-    firewall = digitalocean_firewall("firewall",
-                                     name="swarm.firewall.for.{}".format(domain),
-                                     tags=[tag],
-                                     inbound_rule=inbound_rules,
-                                     outbound_rule=outbound_rules
-                                     )
-    o.terrascript.add(firewall)
+def get_user_data_script(swap_size="2G"):
+    """User data installing Docker and a swap file of `swap_size` ("0" creates no swap file). The user data of a
+    droplet cannot change without replacing it: the default is the script file as is"""
+    script = function.file(os.path.join(os.path.dirname(__file__), "scripts", "install-docker-ce.sh"))
+    if swap_size == "2G":
+        return DockerUserData(script)
+    if str(swap_size) == "0":
+        return DockerUserData('${{replace({}, "/(?s)# Install Swap file.*# Install Docker/", "# Install Docker")}}'
+                              .format(unwrap(script)))
+    return DockerUserData('${{replace({}, "fallocate -l 2G", "fallocate -l {}")}}'.format(unwrap(script), swap_size))
 
+
+def create_firewall(o, domain, inbound_ports, tag):
+    """Firewall opening all the ports between the nodes and the `inbound_ports` to anywhere. See FirewallBuilder
+    to open only the swarm ports between the nodes"""
+    return FirewallBuilder(o, domain, tag, swarm_only=False, ssh_sources=False).expose("inbound", inbound_ports).build()
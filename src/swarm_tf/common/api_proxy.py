@@ -0,0 +1,276 @@
+import collections
+import http.client
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse
+
+DEFAULT_UPSTREAM = "https://api.digitalocean.com"
+
+# The Digital Ocean API allows 250 requests per minute and 5000 per hour: 4 per second with bursts of 10 stay
+# within the limit per minute, a second bucket keeps the requests within the limit per hour
+DEFAULT_RATE = 4.0
+DEFAULT_BURST = 10
+DEFAULT_HOURLY_LIMIT = 5000
+
+HOP_BY_HOP = ["connection", "keep-alive", "proxy-connection", "transfer-encoding", "te", "trailer", "upgrade", "host",
+              "content-length"]
+IDEMPOTENT = ["GET", "HEAD", "PUT", "DELETE", "OPTIONS"]
+
+
+class TokenBucket:
+    """Pace the requests to `rate` per second with bursts of `burst` requests"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Wait for a token. Return the seconds waited"""
+        start = time.monotonic()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return now - start
+                wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def limit(self, tokens):
+        """Lower the available tokens to `tokens` (the remaining budget reported by the API)"""
+        with self.lock:
+            self.tokens = min(self.tokens, float(tokens))
+
+    def pause(self, seconds):
+        """Stop all the requests for `seconds` (the API answered 429)"""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+
+class AdaptiveLimit:
+    """Concurrent requests to the API: grows by one after `window` successful requests, halves on throttling"""
+
+    def __init__(self, initial=4, minimum=1, maximum=16, window=10):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.window = window
+        self.successes = 0
+        self.active = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+
+    def release(self, throttled=False):
+        with self.condition:
+            self.active -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit // 2)
+                self.successes = 0
+            else:
+                self.successes += 1
+                if self.successes >= self.window and self.limit < self.maximum:
+                    self.limit += 1
+                    self.successes = 0
+            self.condition.notify_all()
+
+
+def resource_type(path):
+    """API resource of the path: /v2/domains/example.com/records/1 -> domains/records"""
+    parts = [part for part in urlparse(path).path.split("/") if part and part != "v2"]
+    return "/".join(parts[0::2]) or "/"
+
+
+class ApiStats:
+    def __init__(self):
+        self.calls = collections.defaultdict(collections.Counter)
+        self.throttled = 0
+        self.retries = 0
+        self.errors = 0
+        self.waited = 0.0
+        self.lock = threading.Lock()
+
+    def record(self, method, path, status):
+        with self.lock:
+            self.calls[resource_type(path)][method] += 1
+            if status == 429:
+                self.throttled += 1
+            elif status is None or status >= 500:
+                self.errors += 1
+
+    def summary(self):
+        total = sum([sum(methods.values()) for methods in self.calls.values()])
+        lines = ["DigitalOcean API: {} calls, {} throttled (429), {} errors, {} retries, {:.1f}s paced".format(
+            total, self.throttled, self.errors, self.retries, self.waited)]
+        for name, methods in sorted(self.calls.items(), key=lambda item: -sum(item[1].values())):
+            lines.append("  {:<24} {:>6} ({})".format(name, sum(methods.values()), ", ".join(
+                ["{} {}".format(method, count) for method, count in sorted(methods.items())])))
+        return "\n".join(lines)
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class ApiProxy:
+    """Local proxy of the Digital Ocean API with a rate limit budget, used by terraform through the
+    DIGITALOCEAN_API_URL environment variable (see scripts/terrascript).
+
+    The requests are paced by a token bucket per second and one per hour (synchronized with the RateLimit-Remaining
+    header of the API, which counts the requests of the hour) and the concurrent requests adapt to the throttling.
+    The throttled requests (429) and the failed idempotent requests are retried with exponential backoff and jitter,
+    honoring the Retry-After and RateLimit-Reset headers. `upstream` can be a local mock of the API."""
+
+    def __init__(self, upstream=DEFAULT_UPSTREAM, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 hourly_limit=DEFAULT_HOURLY_LIMIT, max_retries=8, max_delay=60, max_concurrency=16, timeout=60):
+        url = urlparse(upstream)
+        self.scheme = url.scheme
+        self.host = url.hostname
+        self.port = url.port
+        self.bucket = TokenBucket(rate, burst)
+        self.hourly = TokenBucket(hourly_limit / 3600.0, hourly_limit)
+        self.limit = AdaptiveLimit(maximum=max_concurrency)
+        self.stats = ApiStats()
+        self.max_retries = max_retries
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.local = threading.local()
+        self.server = None
+
+    def connection(self):
+        """Persistent connection to the API, one per thread"""
+        if getattr(self.local, "connection", None) is None:
+            cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+            self.local.connection = cls(self.host, self.port, timeout=self.timeout)
+        return self.local.connection
+
+    def send(self, method, path, headers, body):
+        connection = self.connection()
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            return response.status, response.getheaders(), response.read()
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            self.local.connection = None
+            raise
+
+    def delay(self, attempt, headers):
+        headers = {key.lower(): value for key, value in headers}
+        try:
+            if "retry-after" in headers:
+                return min(float(headers["retry-after"]), self.max_delay)
+            if headers.get("ratelimit-remaining") == "0" and "ratelimit-reset" in headers:
+                return min(max(float(headers["ratelimit-reset"]) - time.time(), 1), self.max_delay)
+        except ValueError:
+            pass
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(self.max_delay, 2 ** attempt))
+
+    def sync_hourly(self, headers):
+        """Lower the hourly budget to the remaining requests reported by the API (the calls made before the proxy
+        started or by other clients count too)"""
+        for key, value in headers:
+            if key.lower() == "ratelimit-remaining":
+                try:
+                    self.hourly.limit(int(value))
+                except ValueError:
+                    pass
+
+    def forward(self, method, path, headers, body):
+        """Send the request to the API. Return (status, headers, body)"""
+        headers = {key: value for key, value in headers.items() if key.lower() not in HOP_BY_HOP}
+        result = (502, [("Content-Type", "application/json")], b'{"id": "proxy_error", "message": "API unreachable"}')
+        for attempt in range(self.max_retries + 1):
+            waited = self.hourly.acquire() + self.bucket.acquire()
+            with self.stats.lock:
+                self.stats.waited += waited
+            self.limit.acquire()
+            status = None
+            try:
+                result = self.send(method, path, headers, body)
+                status = result[0]
+            except (OSError, http.client.HTTPException):
+                pass
+            finally:
+                self.limit.release(throttled=status == 429)
+            self.stats.record(method, path, status)
+            if status is not None:
+                self.sync_hourly(result[1])
+
+            retry = status == 429 or (method in IDEMPOTENT and (status is None or status >= 500))
+            if not retry or attempt == self.max_retries:
+                break
+
+            delay = self.delay(attempt, result[1] if status is not None else [])
+            if status == 429:
+                self.bucket.pause(delay)
+            with self.stats.lock:
+                self.stats.retries += 1
+            time.sleep(delay)
+        return result
+
+    def handler(self):
+        proxy = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def handle_request(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else None
+                status, headers, content = proxy.forward(self.command, self.path, dict(self.headers), body)
+                self.send_response(status)
+                for key, value in headers:
+                    if key.lower() not in HOP_BY_HOP:
+                        self.send_header(key, value)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                if self.command != "HEAD":
+                    self.wfile.write(content)
+
+            do_GET = do_POST = do_PUT = do_DELETE = do_PATCH = do_HEAD = handle_request
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self, port=0):
+        """Start the proxy in background. Return its URL"""
+        self.server = ThreadingServer(("127.0.0.1", port), self.handler())
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.url
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{}".format(self.server.server_address[1])
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+        print(self.stats.summary(), file=sys.stderr)
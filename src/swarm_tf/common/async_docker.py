@@ -0,0 +1,184 @@
+import asyncio
+import json
+import os
+from urllib.parse import urlencode
+
+
+class AsyncDockerClient:
+    """Docker Engine API client over a unix socket (e.g. the socket of a manager forwarded by SSHTunnel).
+
+    The requests reuse one persistent (keep-alive) connection. The event streams use their own connection."""
+
+    def __init__(self, path, version="v1.30", timeout=10):
+        self.path = path
+        self.version = version
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.lock = asyncio.Lock()
+
+    async def connect(self):
+        if self.writer is None or self.writer.is_closing():
+            self.reader, self.writer = await asyncio.wait_for(asyncio.open_unix_connection(self.path), self.timeout)
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def url(self, path, params=None):
+        url = "/{}{}".format(self.version, path)
+        if params:
+            url += "?" + urlencode({key: json.dumps(value) if isinstance(value, (dict, list)) else value
+                                    for key, value in params.items()})
+        return url
+
+    @staticmethod
+    async def send(writer, method, url):
+        writer.write("{} {} HTTP/1.1\r\nHost: docker\r\nConnection: keep-alive\r\n\r\n".format(method, url).encode())
+        await writer.drain()
+
+    @staticmethod
+    async def read_head(reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by the Docker API")
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode().strip()
+            if not line:
+                break
+            key, _, value = line.partition(":")
+            headers[key.strip().lower()] = value.strip()
+        return status, headers
+
+    @staticmethod
+    async def read_chunks(reader):
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                await reader.readline()
+                return
+            data = await reader.readexactly(size + 2)
+            yield data[:-2]
+
+    async def read_body(self, headers):
+        if headers.get("transfer-encoding") == "chunked":
+            return b"".join([chunk async for chunk in self.read_chunks(self.reader)])
+        return await self.reader.readexactly(int(headers.get("content-length", 0)))
+
+    async def request(self, method, path, params=None):
+        async with self.lock:
+            # A kept alive connection may have been closed by the server: retry once with a new connection
+            for attempt in range(2):
+                await self.connect()
+                try:
+                    await self.send(self.writer, method, self.url(path, params))
+                    status, headers = await asyncio.wait_for(self.read_head(self.reader), self.timeout)
+                    body = await asyncio.wait_for(self.read_body(headers), self.timeout)
+                    break
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    await self.close()
+                    if attempt == 1:
+                        raise
+            if headers.get("connection", "").lower() == "close":
+                await self.close()
+
+        content = body.decode()
+        if status >= 400:
+            try:
+                message = json.loads(content).get("message", content)
+            except ValueError:
+                message = content
+            raise RuntimeError("Docker API error {}: {}".format(status, message))
+        return json.loads(content) if content.strip() else None
+
+    async def info(self):
+        return await self.request("GET", "/info")
+
+    async def nodes(self):
+        return await self.request("GET", "/nodes")
+
+    async def services(self):
+        return await self.request("GET", "/services")
+
+    async def tasks(self, filters=None):
+        return await self.request("GET", "/tasks", {"filters": filters} if filters else None)
+
+    async def events(self, filters=None):
+        """Yield the events (dicts) as they happen"""
+        reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(self.path), self.timeout)
+        try:
+            await self.send(writer, "GET", self.url("/events", {"filters": filters} if filters else None))
+            status, headers = await self.read_head(reader)
+            if status >= 400:
+                raise RuntimeError("Docker API error {}".format(status))
+            buffer = b""
+            async for chunk in self.read_chunks(reader):
+                buffer += chunk
+                lines = buffer.split(b"\n")
+                buffer = lines.pop()
+                for line in lines:
+                    if line.strip():
+                        yield json.loads(line.decode())
+        finally:
+            writer.close()
+
+
+class SSHTunnel:
+    """Docker socket of a manager forwarded to a local unix socket by a background SSH master connection.
+
+    The tunnel stays open between the commands until `close()` (swarm_tf disconnect)."""
+
+    def __init__(self, host, user="root", private_key="~/.ssh/id_rsa", directory=".swarm_tf/tunnels", timeout=10):
+        self.host = host
+        self.user = user
+        self.private_key = os.path.expanduser(private_key)
+        self.directory = directory
+        self.timeout = timeout
+        # Relative paths: the unix socket paths are limited to 108 characters
+        self.socket = os.path.join(directory, "{}.sock".format(host))
+        self.control = os.path.join(directory, "{}.ctl".format(host))
+
+    def destination(self):
+        return "{}@{}".format(self.user, self.host)
+
+    async def ssh(self, *args):
+        process = await asyncio.create_subprocess_exec("ssh", "-S", self.control, *args,
+                                                       stdout=asyncio.subprocess.DEVNULL,
+                                                       stderr=asyncio.subprocess.PIPE)
+        _, stderr = await process.communicate()
+        return process.returncode, stderr.decode().strip()
+
+    async def is_open(self):
+        if not os.path.exists(self.control):
+            return False
+        returncode, _ = await self.ssh("-O", "check", self.destination())
+        return returncode == 0
+
+    async def open(self):
+        if await self.is_open():
+            return self.socket
+
+        os.makedirs(self.directory, exist_ok=True)
+        for path in [self.socket, self.control]:
+            if os.path.exists(path):
+                os.remove(path)
+        returncode, error = await self.ssh("-M", "-f", "-N",
+                                           "-o", "IdentitiesOnly=true", "-o", "StrictHostKeyChecking=no",
+                                           "-o", "UserKnownHostsFile=/dev/null", "-o", "LogLevel=ERROR",
+                                           "-o", "ExitOnForwardFailure=yes",
+                                           "-o", "ConnectTimeout={}".format(self.timeout),
+                                           "-i", self.private_key,
+                                           "-L", "{}:/var/run/docker.sock".format(self.socket),
+                                           self.destination())
+        if returncode != 0:
+            raise RuntimeError("SSH tunnel to {} failed: {}".format(self.host, error))
+        return self.socket
+
+    async def close(self):
+        if await self.is_open():
+            await self.ssh("-O", "exit", self.destination())
+        if os.path.exists(self.socket):
+            os.remove(self.socket)
@@ -0,0 +1,146 @@
+import http.client
+import json
+import os
+import socket
+from urllib.parse import urlparse, urlencode
+
+DEFAULT_DOCKER_HOST = "tcp://localhost:2374"
+
+
+class DockerApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__("Docker API error {}: {}".format(status, message))
+        self.status = status
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a unix socket (DOCKER_HOST=unix:///var/run/docker.sock)"""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class DockerClient:
+    """Minimal client of the Docker Engine API (swarm endpoints) over TCP or a unix socket.
+
+    The default host is the tunnel created by `connect_to_manager -c`. Any HTTP server implementing the same
+    endpoints (e.g. a fake API in the tests) can be used."""
+
+    def __init__(self, host=None, timeout=10, version="v1.30"):
+        host = host or os.environ.get("DOCKER_HOST") or DEFAULT_DOCKER_HOST
+        url = urlparse(host.replace("tcp://", "http://"))
+        if url.scheme == "unix" and url.path:
+            self.socket_path = url.path
+        elif url.scheme == "http" and url.hostname:
+            self.socket_path = None
+        else:
+            raise ValueError("Unsupported Docker host '{}': use tcp://<host>:<port> or unix://<socket path>"
+                             .format(host))
+        self.host = url.hostname
+        self.port = url.port or 2375
+        self.timeout = timeout
+        self.version = version
+
+    def connection(self):
+        if self.socket_path is not None:
+            return UnixHTTPConnection(self.socket_path, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def request(self, method, path, params=None, body=None, raw=False):
+        """Return the decoded json response, or the bytes with `raw`"""
+        url = "/{}{}".format(self.version, path)
+        if params:
+            url += "?" + urlencode({key: json.dumps(value) if isinstance(value, (dict, list)) else value
+                                    for key, value in params.items()})
+        connection = self.connection()
+        try:
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            connection.request(method, url, body=None if body is None else json.dumps(body), headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+        finally:
+            connection.close()
+
+        if raw and response.status < 400:
+            return data
+        content = data.decode(errors="replace")
+        if response.status >= 400:
+            try:
+                message = json.loads(content).get("message", content)
+            except ValueError:
+                message = content
+            raise DockerApiError(response.status, message)
+        return json.loads(content) if content.strip() else None
+
+    def nodes(self, filters=None):
+        return self.request("GET", "/nodes", {"filters": filters} if filters else None)
+
+    def node(self, node_id):
+        return self.request("GET", "/nodes/{}".format(node_id))
+
+    def update_node(self, node_id, version, spec):
+        return self.request("POST", "/nodes/{}/update".format(node_id), {"version": version}, spec)
+
+    def remove_node(self, node_id, force=True):
+        return self.request("DELETE", "/nodes/{}".format(node_id), {"force": "true" if force else "false"})
+
+    def set_availability(self, node_id, availability):
+        node = self.node(node_id)
+        spec = node["Spec"]
+        spec["Availability"] = availability
+        return self.update_node(node_id, node["Version"]["Index"], spec)
+
+    def services(self, filters=None):
+        return self.request("GET", "/services", {"filters": filters} if filters else None)
+
+    def tasks(self, filters=None):
+        return self.request("GET", "/tasks", {"filters": filters} if filters else None)
+
+    def create_service(self, spec):
+        return self.request("POST", "/services/create", body=spec)["ID"]
+
+    def remove_service(self, service_id):
+        return self.request("DELETE", "/services/{}".format(service_id))
+
+    def service_logs(self, service_id):
+        """stdout and stderr of the tasks of the service"""
+        return demux(self.request("GET", "/services/{}/logs".format(service_id), {"stdout": 1, "stderr": 1},
+                                  raw=True))
+
+    def networks(self, filters=None):
+        return self.request("GET", "/networks", {"filters": filters} if filters else None)
+
+    def create_network(self, spec):
+        return self.request("POST", "/networks/create", body=spec)["Id"]
+
+    def remove_network(self, network_id):
+        return self.request("DELETE", "/networks/{}".format(network_id))
+
+
+def demux(data):
+    """Text of a multiplexed log stream: frames with an 8 bytes header (stream, 0, 0, 0, size)"""
+    output = []
+    while len(data) >= 8 and data[0] in (0, 1, 2) and data[1:4] == b"\x00\x00\x00":
+        size = int.from_bytes(data[4:8], "big")
+        output.append(data[8:8 + size])
+        data = data[8 + size:]
+    output.append(data)
+    return b"".join(output).decode(errors="replace")
+
+
+def is_group_node(node, group):
+    """True if the node is a droplet of the node group (hostname <group>-NN.<domain>)"""
+    hostname = node["Description"]["Hostname"]
+    prefix = group + "-"
+    return hostname.startswith(prefix) and hostname[len(prefix):].split(".")[0].isdigit()
+
+
+def group_node_number(node, group):
+    """Number of a droplet of the node group: 3 for <group>-03.<domain>"""
+    return int(node["Description"]["Hostname"][len(group) + 1:].split(".")[0])
@@ -0,0 +1,262 @@
+import hashlib
+import json
+import os
+import re
+import sys
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from swarm_tf.common.api_proxy import DEFAULT_UPSTREAM
+from swarm_tf.common.state import TerraformState
+
+# Blocks of the configuration identified by "<block>.<name>": a change in any of them needs a full plan
+GLOBAL_BLOCKS = ["provider", "output", "variable", "locals", "terraform", "module"]
+
+REFERENCE = re.compile(r"(?<![\w.])(data\.)?([a-z][a-z0-9]*_[a-z0-9_]*)\.([\w-]+)")
+INTERPOLATION = re.compile(r"\$\{[^}]*\}")
+
+
+def config_entities(config):
+    """{address: config} of the resources ("type.name"), data sources ("data.type.name") and the other blocks
+    ("output.name", "provider.name", ...) of a terraform json configuration"""
+    entities = {}
+    for block, items in config.items():
+        # terrascript writes some blocks as lists of mappings
+        for item in items if isinstance(items, list) else [items]:
+            if block in ["resource", "data"]:
+                for resource_type, resources in item.items():
+                    for name, value in resources.items():
+                        prefix = "data." if block == "data" else ""
+                        entities["{}{}.{}".format(prefix, resource_type, name)] = value
+            elif isinstance(item, dict):
+                for name, value in item.items():
+                    entities["{}.{}".format(block, name)] = value
+    return entities
+
+
+def entity_hash(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def config_address(address):
+    """Configuration block of a state address: digitalocean_droplet.worker[2] -> digitalocean_droplet.worker"""
+    return re.sub(r"(\[[^\]]*\]|\.[0-9]+)$", "", address)
+
+
+def references(value):
+    """Addresses of the resources and data sources referenced by a configuration block"""
+    found = set()
+    content = json.dumps(value)
+    for expression in INTERPOLATION.findall(content):
+        for data, resource_type, name in REFERENCE.findall(expression):
+            found.add("{}{}.{}".format(data, resource_type, name))
+    if isinstance(value, dict):
+        found.update(value.get("depends_on", []))
+    return found
+
+
+def dependents(entities, addresses):
+    """The addresses plus all the blocks depending on them, directly or through data sources"""
+    reverse = {}
+    for address, value in entities.items():
+        for reference in references(value):
+            reverse.setdefault(reference, set()).add(address)
+    result = set(addresses)
+    pending = list(addresses)
+    while pending:
+        for dependent in reverse.get(pending.pop(), []):
+            if dependent not in result:
+                result.add(dependent)
+                pending.append(dependent)
+    return result
+
+
+def flat_list(attributes, key):
+    """A list attribute of the state: a list (format 4) or flatmap keys "key.N" (format 3)"""
+    if isinstance(attributes.get(key), list):
+        return attributes[key]
+    pattern = re.compile(r"^{}\.[0-9]+$".format(re.escape(key)))
+    return [value for name, value in attributes.items() if pattern.match(name)]
+
+
+def flat_count(attributes, key):
+    if isinstance(attributes.get(key), list):
+        return len(attributes[key])
+    return int(attributes.get(key + ".#", 0))
+
+
+class DigitalOceanApi:
+    """Read-only client of the Digital Ocean API listing the resources (200 per request)"""
+
+    def __init__(self, token, url=None, timeout=30):
+        self.token = token
+        self.url = (url or DEFAULT_UPSTREAM).rstrip("/")
+        self.timeout = timeout
+
+    def get(self, path):
+        request = urllib.request.Request(self.url + path, headers={"Authorization": "Bearer " + self.token})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read().decode())
+
+    def list(self, path, key):
+        items = []
+        path = "/v2{}?per_page=200".format(path)
+        while path:
+            data = self.get(path)
+            items += data.get(key, [])
+            next_page = data.get("links", {}).get("pages", {}).get("next")
+            path = None if next_page is None else "{0.path}?{0.query}".format(urlparse(next_page))
+        return items
+
+
+class DriftDetector:
+    """Targets of a plan without a full refresh: the blocks whose configuration changed since the last apply
+    (hash of each resource, see Manifest), the resources of the state changed or deleted outside terraform (a few
+    list calls to the Digital Ocean API instead of one refresh per resource) and all the blocks depending on them.
+
+    `targets()` returns None when a full plan is needed (no state, provider or outputs changed)."""
+
+    def __init__(self, manifest, api=None, state_file="terraform.tfstate"):
+        self.manifest = manifest
+        self.directory = manifest.directory
+        self.api = api
+        self.state_path = os.path.join(self.directory, state_file)
+        self.reasons = {}
+
+    def changed_config(self, entities, applied):
+        changed = set()
+        for address, value in entities.items():
+            if applied.get(address) != entity_hash(value):
+                changed.add(address)
+                self.reasons[address] = "new" if address not in applied else "configuration changed"
+        for address in applied:
+            if address not in entities:
+                changed.add(address)
+                self.reasons[address] = "removed"
+        return changed
+
+    def listings(self, state_resources):
+        """{name: {id: item}} of the Digital Ocean resources of the types in the state, listed concurrently"""
+        types = set([resource["type"] for resource in state_resources])
+        calls = {}
+        if "digitalocean_droplet" in types:
+            calls["droplets"] = ("/droplets", "droplets", "id")
+        if types & set(["digitalocean_volume", "digitalocean_volume_attachment"]):
+            calls["volumes"] = ("/volumes", "volumes", "id")
+        if "digitalocean_firewall" in types:
+            calls["firewalls"] = ("/firewalls", "firewalls", "id")
+        if "digitalocean_tag" in types:
+            calls["tags"] = ("/tags", "tags", "name")
+        for domain in set([resource["attributes"].get("domain") for resource in state_resources
+                           if resource["type"] == "digitalocean_record" and resource["attributes"].get("domain")]):
+            calls["records:" + domain] = ("/domains/{}/records".format(domain), "domain_records", "id")
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = {name: executor.submit(self.api.list, path, key) for name, (path, key, _) in calls.items()}
+            return {name: {str(item[calls[name][2]]): item for item in future.result()}
+                    for name, future in futures.items()}
+
+    def drift_reason(self, resource, listings):
+        """Why the resource of the state differs from the Digital Ocean resource, or None"""
+        attributes = resource["attributes"]
+        if resource["type"] == "digitalocean_droplet":
+            droplet = listings["droplets"].get(resource["id"])
+            if droplet is None:
+                return "deleted outside terraform"
+            if attributes.get("size") and droplet["size_slug"] != attributes["size"]:
+                return "resized to {}".format(droplet["size_slug"])
+            if flat_count(attributes, "tags") and sorted(droplet["tags"]) != sorted(flat_list(attributes, "tags")):
+                return "tags changed"
+        elif resource["type"] == "digitalocean_volume":
+            volume = listings["volumes"].get(resource["id"])
+            if volume is None:
+                return "deleted outside terraform"
+            if attributes.get("size") and str(volume["size_gigabytes"]) != str(attributes["size"]):
+                return "resized to {}GB".format(volume["size_gigabytes"])
+        elif resource["type"] == "digitalocean_volume_attachment":
+            volume = listings["volumes"].get(attributes.get("volume_id"))
+            if volume is None or str(attributes.get("droplet_id")) not in [str(i) for i in volume["droplet_ids"]]:
+                return "detached outside terraform"
+        elif resource["type"] == "digitalocean_firewall":
+            firewall = listings["firewalls"].get(resource["id"])
+            if firewall is None:
+                return "deleted outside terraform"
+            if len(firewall["inbound_rules"]) != flat_count(attributes, "inbound_rule"):
+                return "inbound rules changed"
+        elif resource["type"] == "digitalocean_tag":
+            if resource["id"] not in listings["tags"]:
+                return "deleted outside terraform"
+        elif resource["type"] == "digitalocean_record" and attributes.get("domain"):
+            record = listings["records:" + attributes["domain"]].get(resource["id"])
+            if record is None:
+                return "deleted outside terraform"
+            if attributes.get("value") and record["data"] != attributes["value"]:
+                return "value changed to {}".format(record["data"])
+            if attributes.get("ttl") and str(record["ttl"]) != str(attributes["ttl"]):
+                return "ttl changed to {}".format(record["ttl"])
+        return None
+
+    def changed_state(self, state):
+        """Addresses of the resources changed outside terraform"""
+        if self.api is None:
+            return set()
+        resources = state.resources()
+        listings = self.listings(resources)
+        changed = set()
+        for resource in resources:
+            reason = self.drift_reason(resource, listings)
+            if reason is not None:
+                address = config_address(resource["address"])
+                changed.add(address)
+                self.reasons[address] = "{} ({})".format(reason, resource["address"])
+        return changed
+
+    def targets(self):
+        applied = self.manifest.applied_entities()
+        if applied is None or not os.path.exists(self.state_path):
+            return None
+        entities = self.manifest.entities()
+        changed = self.changed_config(entities, applied) | self.changed_state(TerraformState(self.state_path))
+        if [address for address in changed if address.split(".")[0] in GLOBAL_BLOCKS]:
+            return None
+        targets = dependents(entities, changed)
+        # -target only accepts resources: the data sources are refreshed with the resources using them
+        return sorted([address for address in targets if not address.startswith("data.") and
+                       address.split(".")[0] not in GLOBAL_BLOCKS])
+
+
+def api_token(directory="."):
+    """The Digital Ocean token of the provider block"""
+    path = os.path.join(directory, "main.tf.json")
+    if os.path.exists(path):
+        with open(path) as f:
+            provider = json.load(f).get("provider", {}).get("digitalocean", {})
+        if isinstance(provider, list):
+            provider = provider[0] if provider else {}
+        # terrascript writes the provider without alias as "__DEFAULT__"
+        token = provider.get("__DEFAULT__", provider).get("token")
+        if token and "${" not in token:
+            return token
+    return None
+
+
+def drift_targets(manifest, prefix="", env=None):
+    """Targets of the drift mode (see DriftDetector), printing the reasons. None when a full plan is needed"""
+    env = os.environ if env is None else env
+    token = env.get("DIGITALOCEAN_TOKEN") or api_token(manifest.directory)
+    if token is None:
+        print("{}No Digital Ocean token (DIGITALOCEAN_TOKEN): only the configuration changes are detected"
+              .format(prefix), file=sys.stderr)
+    # The API calls go through the API proxy of terrascript when it is running
+    detector = DriftDetector(manifest, DigitalOceanApi(token, env.get("DIGITALOCEAN_API_URL")) if token else None)
+    try:
+        targets = detector.targets()
+    except OSError as e:
+        print("{}Drift detection failed ({}): full plan needed".format(prefix, e))
+        return None
+    if targets is None:
+        print("{}Drift detection: full plan needed".format(prefix))
+        return None
+    for address, reason in sorted(detector.reasons.items()):
+        print("{}Drift: {} {}".format(prefix, address, reason))
+    return targets
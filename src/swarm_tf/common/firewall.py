@@ -0,0 +1,119 @@
+import re
+from terrascript.digitalocean.r import digitalocean_firewall
+
+ANYWHERE = ["0.0.0.0/0", "::/0"]
+
+# Swarm ports between the nodes: cluster management, node communication (gossip) and overlay data path (VXLAN)
+SWARM_PORTS = [("tcp", 2377), ("tcp", 7946), ("udp", 7946)]
+DEFAULT_DATA_PATH_PORT = 4789
+
+
+def parse_range(port):
+    """Return (start, end) of a port (80), a range string ("8000-8010") or a tuple"""
+    if isinstance(port, (tuple, list)):
+        start, end = port
+    elif isinstance(port, int):
+        start, end = port, port
+    else:
+        match = re.match(r"^\s*(\d+)\s*(?:-\s*(\d+)\s*)?$", str(port))
+        if match is None:
+            raise ValueError("Invalid port or port range '{}'".format(port))
+        start, end = int(match.group(1)), int(match.group(2) or match.group(1))
+    start, end = int(start), int(end)
+    if not 1 <= start <= end <= 65535:
+        raise ValueError("Invalid port range {}-{}".format(start, end))
+    return start, end
+
+
+def merge_ranges(ranges):
+    """Merge the overlapping and adjacent port ranges, e.g. [80, 81, (82, 90), 85, 443] -> [(80, 90), (443, 443)]"""
+    merged = []
+    for start, end in sorted([parse_range(port) for port in ranges]):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def format_range(port_range):
+    start, end = port_range
+    return str(start) if start == end else "{}-{}".format(start, end)
+
+
+class FirewallBuilder:
+    """Build a Digital Ocean firewall with the minimal rule set for the declared service ports.
+
+    The ports with the same protocol and sources are merged in ranges. Between the nodes (tag) only the swarm ports
+    are opened (`swarm_only=True`), plus the ports declared with `allow_internal`. The rules are sorted (the
+    internal ones, then the public ones by protocol and sources), so the same rule set always generates the same
+    terraform json."""
+
+    def __init__(self, o, domain, tag, name="firewall", swarm_only=True, ssh_sources=None, data_path_port=None):
+        self.o = o
+        self.domain = domain
+        self.tag = tag
+        self.name = name
+        self.swarm_only = swarm_only
+        self.data_path_port = data_path_port or o.shared.get("data_path_port") or DEFAULT_DATA_PATH_PORT
+        self.public = {}
+        self.internal = {"tcp": [], "udp": []}
+        # Terraform connects to the droplets by SSH
+        if ssh_sources is not False:
+            self.expose("ssh", [22], sources=ssh_sources)
+
+    def expose(self, service, ports, protocol="tcp", sources=None):
+        """Open the ports (80, "8000-8010", (8000, 8010)) of a service to the sources (default: anywhere). The name
+        of the service only documents the rule"""
+        if protocol not in ["tcp", "udp"]:
+            raise ValueError("Invalid protocol '{}'. Use 'tcp' or 'udp'".format(protocol))
+        key = (protocol, tuple(sorted(sources or ANYWHERE)))
+        self.public.setdefault(key, []).extend([parse_range(port) for port in ports])
+        return self
+
+    def allow_internal(self, ports, protocol="tcp"):
+        """Open the ports between the nodes of the cluster (e.g. an exporter scraped by Prometheus)"""
+        self.internal[protocol].extend([parse_range(port) for port in ports])
+        return self
+
+    def internal_ranges(self, protocol):
+        ranges = list(self.internal[protocol])
+        if not self.swarm_only:
+            return [(1, 65535)]
+        ranges += [(port, port) for rule_protocol, port in SWARM_PORTS if rule_protocol == protocol]
+        if protocol == "udp":
+            ranges.append((self.data_path_port, self.data_path_port))
+        if protocol == "tcp" and self.o.shared.get("registry_mirrors"):
+            ranges.append((5000, 5000))
+        # CoreDNS of the managers serving the internal names (ManagerVariables.local_dns)
+        if self.o.shared.get("local_dns"):
+            ranges.append((53, 53))
+        return merge_ranges(ranges)
+
+    def inbound_rules(self):
+        rules = [{"protocol": "icmp", "source_tags": [self.tag]}]
+        for protocol in ["tcp", "udp"]:
+            rules += [{"protocol": protocol, "port_range": format_range(port_range), "source_tags": [self.tag]}
+                      for port_range in self.internal_ranges(protocol)]
+        for (protocol, sources), ranges in sorted(self.public.items()):
+            rules += [{"protocol": protocol, "port_range": format_range(port_range), "source_addresses": list(sources)}
+                      for port_range in merge_ranges(ranges)]
+        return rules
+
+    def outbound_rules(self):
+        return [
+            {"protocol": "icmp", "destination_addresses": ANYWHERE, "destination_tags": [self.tag]},
+            {"protocol": "tcp", "port_range": "1-65535", "destination_addresses": ANYWHERE,
+             "destination_tags": [self.tag]},
+            {"protocol": "udp", "port_range": "1-65535", "destination_addresses": ANYWHERE,
+             "destination_tags": [self.tag]}
+        ]
+
+    def build(self):
+        firewall = digitalocean_firewall(self.name,
+                                         name="swarm.{}.for.{}".format(self.name, self.domain),
+                                         tags=[self.tag],
+                                         inbound_rule=self.inbound_rules(),
+                                         outbound_rule=self.outbound_rules())
+        self.o.terrascript.add(firewall)
+        return firewall
@@ -0,0 +1,345 @@
+import copy
+import json
+import os
+import statistics
+import time
+from datetime import datetime
+
+from swarm_tf.common.docker_api import DockerApiError, is_group_node
+from swarm_tf.common.variables import load_file
+
+scripts_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scripts")
+
+PROBE_PREFIX = "SWARM_TF_PROBE "
+PROBE_LABEL = "swarm_tf.probe"
+PROBE_NETWORK = "swarm_tf_probe"
+
+# The thresholds are disabled (None) by default: the probes only report. A probe without result always fails
+DEFAULTS = {
+    # Image of the probes (python 3). The tools (iperf3, ab, fio) are installed with apk when missing
+    "image": "python:3.8-alpine",
+    # Seconds to wait for each step (image pulls, tasks)
+    "timeout": 600,
+    "network": {
+        "enabled": True,
+        "seconds": 5,
+        # Nodes tested by each node (the next ones in the hostname order)
+        "peers": 1,
+        "min_mbps": None,
+        "max_rtt_ms": None
+    },
+    "mesh": {
+        "enabled": True,
+        "image": "nginx:1.17-alpine",
+        "replicas": 2,
+        # Port published by the probe web service in the ingress network. Must be free
+        "port": 18080,
+        "seconds": 10,
+        "concurrency": 32,
+        "min_rps": None,
+        "max_error_rate": None,
+        "max_p99_ms": None
+    },
+    "disk": {
+        # Mount points of the persistent volumes, e.g. [{"group": "persistent", "path": "/data"}]
+        "targets": [],
+        "seconds": 10,
+        "size": "256M",
+        "block_size": "4k",
+        "iodepth": 32,
+        # O_DIRECT, not supported by some file systems (e.g. the overlay of a docker-in-docker stand-in)
+        "direct": True,
+        "min_read_iops": None,
+        "min_write_iops": None
+    }
+}
+
+# (probe, result key, threshold, lower limit)
+THRESHOLDS = [
+    ("network", "mbps", "min_mbps", True),
+    ("network", "rtt_ms", "max_rtt_ms", False),
+    ("mesh", "rps", "min_rps", True),
+    ("mesh", "error_rate", "max_error_rate", False),
+    ("mesh", "p99_ms", "max_p99_ms", False),
+    ("disk", "read_iops", "min_read_iops", True),
+    ("disk", "write_iops", "min_write_iops", True),
+]
+
+TERMINAL_STATES = ["complete", "failed", "rejected", "shutdown", "orphaned", "remove"]
+
+
+def load_config(path=None):
+    """The probe settings and thresholds of a JSON or YAML file, over the defaults"""
+    config = copy.deepcopy(DEFAULTS)
+    if path is None:
+        return config
+    data = load_file(path) or {}
+    for key, value in data.items():
+        if key not in config:
+            raise ValueError("{}: unknown setting '{}'".format(path, key))
+        if isinstance(config[key], dict):
+            unknown = set(value) - set(config[key])
+            if unknown:
+                raise ValueError("{}: unknown settings {} in '{}'".format(path, ", ".join(sorted(unknown)), key))
+            config[key].update(value)
+        else:
+            config[key] = value
+    return config
+
+
+def probe_script(name):
+    with open(os.path.join(scripts_dir, "probe-{}.py".format(name))) as f:
+        return f.read()
+
+
+def parse_results(logs):
+    return [json.loads(line.split(PROBE_PREFIX, 1)[1]) for line in logs.splitlines() if PROBE_PREFIX in line]
+
+
+class ProbeRun:
+    """Post-apply benchmark of a cluster: short-lived probe services measure the overlay network between the nodes
+    (RTT and bandwidth), the routing mesh (requests per second on a published port) and the persistent volumes
+    (IOPS). The probe services are removed at the end, also on errors.
+
+    `client` is a swarm_tf.common.docker_api.DockerClient of a manager, or of a local docker-in-docker swarm."""
+
+    def __init__(self, client, config=None, log=print):
+        self.client = client
+        self.config = config or load_config()
+        self.log = log
+        self.services = []
+
+    def eligible_nodes(self):
+        """The nodes receiving the tasks of the global services"""
+        return sorted([node for node in self.client.nodes() if node["Status"]["State"] == "ready" and
+                       node["Spec"].get("Availability") == "active"],
+                      key=lambda node: node["Description"]["Hostname"])
+
+    def command(self, tools):
+        """Install the missing tools, then run the probe script of $SWARM_TF_PROBE"""
+        install = ["command -v {} > /dev/null || apk add --no-cache -q {} > /dev/null".format(tool, package)
+                   for tool, package in tools]
+        return ["sh", "-c", "; ".join(install + ["exec python3 -c \"$SWARM_TF_PROBE\""])]
+
+    def create_service(self, name, image, command, env=None, replicas=None, networks=None, mounts=None,
+                       constraints=None, ports=None, restart=False):
+        spec = {
+            "Name": "swarm_tf_probe_{}".format(name),
+            "Labels": {PROBE_LABEL: "true"},
+            "TaskTemplate": {
+                "ContainerSpec": {
+                    "Image": image,
+                    "Env": ["PROBE_NODE={{.Node.Hostname}}"] + ["{}={}".format(key, value)
+                                                                for key, value in sorted((env or {}).items())],
+                    "Mounts": mounts or []
+                },
+                "RestartPolicy": {"Condition": "any" if restart else "none"},
+                "Placement": {"Constraints": constraints or []},
+                "Networks": [{"Target": network} for network in networks or []]
+            },
+            "Mode": {"Global": {}} if replicas is None else {"Replicated": {"Replicas": replicas}},
+            "EndpointSpec": {"Ports": ports or []}
+        }
+        if command is not None:
+            spec["TaskTemplate"]["ContainerSpec"]["Command"] = command
+        service_id = self.client.create_service(spec)
+        self.services.append(service_id)
+        return service_id
+
+    def wait_tasks(self, service_id, count, states, description):
+        """Wait until `count` tasks of the service are in one of the states. Return the tasks"""
+        deadline = time.time() + self.config["timeout"]
+        while True:
+            tasks = self.client.tasks({"service": [service_id]})
+            if len([task for task in tasks if task["Status"]["State"] in states]) >= count:
+                return tasks
+            if time.time() > deadline:
+                errors = set([task["Status"].get("Err") for task in tasks if task["Status"].get("Err")])
+                raise RuntimeError("Timeout waiting for {}{}".format(
+                    description, ": " + "; ".join(sorted(errors)) if errors else ""))
+            time.sleep(2)
+
+    def collect(self, service_id, nodes, description, details=None):
+        """Wait for the tasks of a probe (one per node) to finish and return their results"""
+        tasks = self.wait_tasks(service_id, len(nodes), TERMINAL_STATES, description)
+        results = parse_results(self.client.service_logs(service_id))
+        reported = set([result["node"] for result in results])
+        hostnames = {node["ID"]: node["Description"]["Hostname"] for node in nodes}
+        for task in tasks:
+            hostname = hostnames.get(task.get("NodeID"))
+            if hostname is not None and hostname not in reported:
+                reason = task["Status"].get("Err") or task["Status"].get("Message")
+                results.append(dict(details or {}, node=hostname, error="no result ({}{})".format(
+                    task["Status"]["State"], ": " + reason if reason else "")))
+        return results
+
+    def remove_services(self):
+        for service_id in self.services:
+            try:
+                self.client.remove_service(service_id)
+            except DockerApiError:
+                pass
+        self.services = []
+
+    def cleanup(self):
+        """Remove the probe services and network, also the ones left by an interrupted run"""
+        self.services += [service["ID"] for service in self.client.services({"label": [PROBE_LABEL]})]
+        self.remove_services()
+        for network in self.client.networks({"label": [PROBE_LABEL]}):
+            # The network is in use until the tasks of the removed services are stopped
+            deadline = time.time() + 60
+            while True:
+                try:
+                    self.client.remove_network(network["Id"])
+                    break
+                except DockerApiError:
+                    if time.time() > deadline:
+                        raise
+                    time.sleep(2)
+
+    def probe_network(self, nodes):
+        settings = self.config["network"]
+        self.client.create_network({"Name": PROBE_NETWORK, "Driver": "overlay", "Attachable": True,
+                                    "Labels": {PROBE_LABEL: "true"}})
+        server = self.create_service("iperf", self.config["image"],
+                                     ["sh", "-c", "command -v iperf3 > /dev/null || apk add --no-cache -q iperf3; "
+                                                  "exec iperf3 -s"],
+                                     networks=[PROBE_NETWORK], restart=True)
+        tasks = self.wait_tasks(server, len(nodes), ["running"], "the iperf3 servers")
+
+        # Address of the server of each node in the probe network
+        addresses = {}
+        for task in tasks:
+            if task["Status"]["State"] != "running":
+                continue
+            for attachment in task.get("NetworksAttachments", []):
+                if attachment["Network"]["Spec"]["Name"] == PROBE_NETWORK:
+                    addresses[task["NodeID"]] = attachment["Addresses"][0].split("/")[0]
+        hostnames = [node["Description"]["Hostname"] for node in nodes if node["ID"] in addresses]
+        ips = [addresses[node["ID"]] for node in nodes if node["ID"] in addresses]
+        peers = {}
+        for i, hostname in enumerate(hostnames):
+            count = min(settings["peers"], len(hostnames) - 1) or 1
+            peers[hostname] = [ips[(i + offset) % len(ips)] for offset in range(1, count + 1)]
+
+        client = self.create_service("network", self.config["image"], self.command([("iperf3", "iperf3")]),
+                                     env={"SWARM_TF_PROBE": probe_script("network"),
+                                          "PROBE_PEERS": json.dumps(peers),
+                                          "PROBE_SECONDS": settings["seconds"]},
+                                     networks=[PROBE_NETWORK])
+        results = self.collect(client, nodes, "the network probes")
+        names = dict(zip(ips, hostnames))
+        for result in results:
+            if "peer" in result:
+                result["peer"] = names.get(result["peer"], result["peer"])
+        return results
+
+    def probe_mesh(self, nodes):
+        settings = self.config["mesh"]
+        web = self.create_service("web", settings["image"], None, replicas=settings["replicas"],
+                                  ports=[{"Protocol": "tcp", "TargetPort": 80, "PublishedPort": settings["port"],
+                                          "PublishMode": "ingress"}],
+                                  restart=True)
+        self.wait_tasks(web, settings["replicas"], ["running"], "the probe web service")
+        # The load generators use the host network: the requests to the published port go through the routing mesh
+        load = self.create_service("mesh", self.config["image"], self.command([("ab", "apache2-utils")]),
+                                   env={"SWARM_TF_PROBE": probe_script("mesh"),
+                                        "PROBE_PORT": settings["port"],
+                                        "PROBE_SECONDS": settings["seconds"],
+                                        "PROBE_CONCURRENCY": settings["concurrency"]},
+                                   networks=["host"])
+        return self.collect(load, nodes, "the routing mesh probes")
+
+    def probe_disk(self, nodes):
+        settings = self.config["disk"]
+        services = []
+        for target in settings["targets"]:
+            for node in [node for node in nodes if is_group_node(node, target["group"])]:
+                service_id = self.create_service(
+                    "disk_{}".format(len(services) + 1), self.config["image"], self.command([("fio", "fio")]),
+                    env={"SWARM_TF_PROBE": probe_script("disk"),
+                         "PROBE_PATH": target["path"],
+                         "PROBE_SECONDS": settings["seconds"],
+                         "PROBE_SIZE": settings["size"],
+                         "PROBE_BLOCK_SIZE": settings["block_size"],
+                         "PROBE_IODEPTH": settings["iodepth"],
+                         "PROBE_DIRECT": 1 if settings["direct"] else 0},
+                    replicas=1, constraints=["node.id=={}".format(node["ID"])],
+                    mounts=[{"Type": "bind", "Source": target["path"], "Target": "/probe"}])
+                services.append((service_id, node, target["path"]))
+        results = []
+        for service_id, node, path in services:
+            results += self.collect(service_id, [node], "the disk probe of {}".format(node["Description"]["Hostname"]),
+                                    {"path": path})
+        return results
+
+    def run(self):
+        """Run the enabled probes. Return the report"""
+        start = time.time()
+        nodes = self.eligible_nodes()
+        report = {"started": datetime.now().isoformat(timespec="seconds"),
+                  "nodes": [node["Description"]["Hostname"] for node in nodes]}
+        probes = [("network", self.probe_network, self.config["network"]["enabled"]),
+                  ("mesh", self.probe_mesh, self.config["mesh"]["enabled"]),
+                  ("disk", self.probe_disk, bool(self.config["disk"]["targets"]))]
+        try:
+            self.cleanup()
+            for name, probe, enabled in probes:
+                if not enabled:
+                    continue
+                self.log("Probe {}...".format(name))
+                probe_start = time.time()
+                try:
+                    report[name] = probe(nodes)
+                finally:
+                    self.cleanup()
+                self.log("Probe {}: {:.1f}s".format(name, time.time() - probe_start))
+        finally:
+            self.cleanup()
+        report["seconds"] = round(time.time() - start, 1)
+        report["failures"] = check(report, self.config)
+        report["passed"] = not report["failures"]
+        return report
+
+
+def describe(result):
+    return result["node"] + (" -> {}".format(result["peer"]) if "peer" in result else "") + \
+        (" {}".format(result["path"]) if "path" in result else "")
+
+
+def check(report, config):
+    """The results out of the thresholds and the probes without result"""
+    failures = []
+    for probe in ["network", "mesh", "disk"]:
+        for result in report.get(probe, []):
+            if result.get("error"):
+                failures.append("{} {}: {}".format(probe, describe(result), result["error"]))
+    for probe, key, threshold, lower in THRESHOLDS:
+        limit = config[probe][threshold]
+        if limit is None:
+            continue
+        for result in report.get(probe, []):
+            value = result.get(key)
+            if value is not None and (value < limit if lower else value > limit):
+                failures.append("{} {}: {} {} {} {}".format(probe, describe(result), key, value,
+                                                            "<" if lower else ">", limit))
+    return failures
+
+
+def format_report(report):
+    lines = ["Nodes: {}".format(len(report["nodes"]))]
+    for probe, keys in [("network", ["mbps", "rtt_ms"]), ("mesh", ["rps", "p99_ms", "error_rate"]),
+                        ("disk", ["read_iops", "write_iops"])]:
+        if probe not in report:
+            continue
+        results = report[probe]
+        lines.append("{}: {} results".format(probe.capitalize(), len(results)))
+        for key in keys:
+            values = [result[key] for result in results if result.get(key) is not None]
+            if values:
+                lines.append("  {:<12} min {:>10.2f}  median {:>10.2f}  max {:>10.2f}".format(
+                    key, min(values), statistics.median(values), max(values)))
+    for failure in report["failures"]:
+        lines.append("FAIL " + failure)
+    lines.append("{} in {:.1f}s".format("Passed" if report["passed"] else "Failed", report["seconds"]))
+    return "\n".join(lines)
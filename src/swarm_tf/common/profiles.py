@@ -0,0 +1,110 @@
+import copy
+import json
+import re
+
+
+class PerformanceProfile:
+    """Docker daemon (daemon.json), kernel (sysctl) and swap settings applied to the nodes of a group before they
+    join the cluster (ManagerVariables.profile / WorkerVariables.profile).
+
+    `swap_size` replaces the swap file created by the user data ("0" removes it, None keeps it)."""
+
+    def __init__(self, name, daemon=None, sysctl=None, swap_size=None):
+        self.name = name
+        self.daemon = daemon or {}
+        self.sysctl = sysctl or {}
+        self.swap_size = swap_size
+        self.validate()
+
+    def validate(self):
+        if self.daemon.get("live-restore"):
+            raise ValueError("Profile '{}': live-restore is not compatible with the swarm mode".format(self.name))
+        if self.swap_size is not None and not re.match("^([0-9]+[KMG]|0)$", str(self.swap_size)):
+            raise ValueError("Profile '{}': invalid swap_size '{}'. Use e.g. '512M', '2G' or '0'"
+                             .format(self.name, self.swap_size))
+
+    def extend(self, name=None, daemon=None, sysctl=None, swap_size=None):
+        """New profile with the settings of this one updated by the arguments"""
+        merged = copy.deepcopy(self.daemon)
+        merged.update(daemon or {})
+        settings = dict(self.sysctl)
+        settings.update(sysctl or {})
+        return PerformanceProfile(name or self.name, merged, settings,
+                                  self.swap_size if swap_size is None else swap_size)
+
+    def daemon_json(self):
+        return json.dumps(self.daemon, indent=2, sort_keys=True)
+
+    def sysctl_conf(self):
+        return "\n".join(["{} = {}".format(key, value) for key, value in sorted(self.sysctl.items())])
+
+    def render(self):
+        """Dry-run: the files written in the nodes"""
+        lines = ["# Profile: {}".format(self.name),
+                 "",
+                 "# /etc/docker/daemon.json (merged with the existing settings)",
+                 self.daemon_json(),
+                 "",
+                 "# /etc/sysctl.d/60-swarm-tf.conf",
+                 self.sysctl_conf(),
+                 "",
+                 "# Swap: {}".format("unchanged" if self.swap_size is None else
+                                      "disabled" if str(self.swap_size) == "0" else self.swap_size)]
+        return "\n".join(lines)
+
+
+BASE = PerformanceProfile("base", daemon={
+    "storage-driver": "overlay2",
+    "log-driver": "json-file",
+    "log-opts": {"max-size": "10m", "max-file": "3"},
+    "max-concurrent-downloads": 6,
+    "max-concurrent-uploads": 5,
+    "live-restore": False
+}, sysctl={
+    "fs.file-max": 2097152,
+    "fs.inotify.max_user_watches": 524288,
+    "net.netfilter.nf_conntrack_max": 524288,
+    "vm.max_map_count": 262144
+})
+
+PROFILES = {
+    # Many short connections: bigger accept queues, port range and conntrack table
+    "web": BASE.extend("web", daemon={
+        "max-concurrent-downloads": 10
+    }, sysctl={
+        "net.core.somaxconn": 65535,
+        "net.core.netdev_max_backlog": 16384,
+        "net.ipv4.tcp_max_syn_backlog": 65535,
+        "net.ipv4.ip_local_port_range": "1024 65535",
+        "net.ipv4.tcp_tw_reuse": 1,
+        "net.ipv4.tcp_fin_timeout": 15,
+        "net.netfilter.nf_conntrack_max": 1048576,
+        "vm.swappiness": 10
+    }),
+    # Throughput jobs: verbose logs, swap as a safety net for memory peaks
+    "batch": BASE.extend("batch", daemon={
+        "log-opts": {"max-size": "50m", "max-file": "5"},
+        "max-concurrent-downloads": 10
+    }, sysctl={
+        "vm.swappiness": 30,
+        "vm.dirty_ratio": 40,
+        "vm.dirty_background_ratio": 10
+    }),
+    # Databases and queues: no swap, small write back bursts
+    "stateful": BASE.extend("stateful", sysctl={
+        "net.core.somaxconn": 4096,
+        "vm.swappiness": 1,
+        "vm.dirty_ratio": 10,
+        "vm.dirty_background_ratio": 5,
+        "vm.overcommit_memory": 1
+    }, swap_size="0")
+}
+
+
+def get_profile(profile):
+    """Return the PerformanceProfile of a preset name, the profile itself or None"""
+    if profile is None or isinstance(profile, PerformanceProfile):
+        return profile
+    if profile not in PROFILES:
+        raise ValueError("Unknown profile '{}'. Use one of: {}".format(profile, ", ".join(sorted(PROFILES))))
+    return PROFILES[profile]
@@ -0,0 +1,13 @@
+#!/bin/bash
+
+# Resolve the internal names of the cluster (${domain}) with the CoreDNS of the managers
+SERVERS="${servers}"
+if [ -z "$SERVERS" ]; then
+  # This node is a manager: use its own server
+  SERVERS=$(curl -s http://169.254.169.254/metadata/v1/interfaces/private/0/ipv4/address)
+fi
+
+sudo mkdir -p /etc/systemd/resolved.conf.d
+printf "[Resolve]\nDNS=%s\nDomains=~%s\n" "$(echo $SERVERS | tr ',' ' ')" "${domain}" \
+  | sudo tee /etc/systemd/resolved.conf.d/swarm_tf.conf > /dev/null
+sudo systemctl restart systemd-resolved
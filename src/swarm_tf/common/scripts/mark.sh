@@ -0,0 +1,23 @@
+# mark <phase> start|end: timeline marks of the provisioning scripts (see swarm_tf.common.timeline), included by
+# their template variable "mark" (see swarm_tf.common.mark_script)
+mark() {
+  sudo mkdir -p /var/log/swarm_tf
+  echo "$(date +%s.%N) $1 $2" | sudo tee -a /var/log/swarm_tf/timeline.log > /dev/null
+}
+
+# mark_docker_install: the docker_install phase of the default user data (install-docker-ce.sh, not changed to keep
+# the droplets), from the cloud-init log (start of the user data scripts) and the dpkg log (docker-ce installed).
+# Recorded once by the first provisioning script, only when Docker was installed by this boot (not by a snapshot)
+mark_docker_install() {
+  sudo grep -qs " docker_install " /var/log/swarm_tf/timeline.log && return 0
+  local start end
+  start=$(sudo grep -hs "Running command \['/var/lib/cloud/instance/scripts/" /var/log/cloud-init.log | head -n 1 |
+    cut -d, -f1)
+  end=$(sudo grep -hs " status installed docker-ce:" /var/log/dpkg.log | tail -n 1 | cut -d" " -f1-2)
+  [ -n "$start" ] && [ -n "$end" ] || return 0
+  start=$(date -d "$start" +%s) && end=$(date -d "$end" +%s) || return 0
+  [ "$end" -ge "$start" ] || return 0
+  sudo mkdir -p /var/log/swarm_tf
+  printf "%s docker_install start\n%s docker_install end\n" "$start" "$end" |
+    sudo tee -a /var/log/swarm_tf/timeline.log > /dev/null
+}
@@ -0,0 +1,38 @@
+# Disk probe (see swarm_tf.common.probes): random read and write IOPS (fio) on the persistent volume mounted
+# in /probe. The test file is removed after the test
+import json
+import os
+import subprocess
+
+node = os.environ["PROBE_NODE"]
+path = "/probe/.swarm_tf_probe"
+
+
+def emit(result):
+    print("SWARM_TF_PROBE " + json.dumps(dict(result, probe="disk", node=node, path=os.environ["PROBE_PATH"])),
+          flush=True)
+
+
+try:
+    result = subprocess.run(["fio", "--name=probe", "--filename=" + path, "--rw=randrw", "--rwmixread=70",
+                             "--bs=" + os.environ.get("PROBE_BLOCK_SIZE", "4k"),
+                             "--size=" + os.environ.get("PROBE_SIZE", "256M"),
+                             "--iodepth=" + os.environ.get("PROBE_IODEPTH", "32"),
+                             "--runtime=" + os.environ.get("PROBE_SECONDS", "10"), "--time_based",
+                             "--ioengine=libaio", "--direct=" + os.environ.get("PROBE_DIRECT", "1"),
+                             "--output-format=json"],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    try:
+        job = json.loads(result.stdout[result.stdout.index("{"):])["jobs"][0]
+        emit({
+            "read_iops": round(job["read"]["iops"]),
+            "write_iops": round(job["write"]["iops"]),
+            "read_p99_ms": job["read"]["clat_ns"]["percentile"].get("99.000000", 0) / 1e6,
+            "write_p99_ms": job["write"]["clat_ns"]["percentile"].get("99.000000", 0) / 1e6,
+            "error": None
+        })
+    except (ValueError, KeyError, IndexError):
+        emit({"error": result.stdout.strip()[-500:]})
+finally:
+    if os.path.exists(path):
+        os.remove(path)
@@ -0,0 +1,52 @@
+# Routing mesh probe (see swarm_tf.common.probes): requests per second and latency of the published port of the
+# probe web service, requested on this node (host network) and balanced by the ingress network to all the replicas
+import json
+import os
+import re
+import subprocess
+import time
+import urllib.request
+
+node = os.environ["PROBE_NODE"]
+url = "http://127.0.0.1:{}/".format(os.environ["PROBE_PORT"])
+
+
+def emit(result):
+    print("SWARM_TF_PROBE " + json.dumps(dict(result, probe="mesh", node=node)), flush=True)
+
+
+def number(pattern, output):
+    match = re.search(pattern, output, re.M)
+    return float(match.group(1)) if match else None
+
+
+# The published port is open on every node once the ingress network is configured
+deadline = time.time() + 120
+while True:
+    try:
+        urllib.request.urlopen(url, timeout=5).read()
+        break
+    except OSError as e:
+        if time.time() > deadline:
+            emit({"error": "{} not reachable: {}".format(url, e)})
+            raise SystemExit(0)
+        time.sleep(2)
+
+result = subprocess.run(["ab", "-k", "-q", "-r", "-c", os.environ.get("PROBE_CONCURRENCY", "32"),
+                         "-t", os.environ.get("PROBE_SECONDS", "10"), "-n", "10000000", url],
+                        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+output = result.stdout
+complete = number(r"^Complete requests:\s+([0-9]+)", output)
+if complete is None:
+    emit({"error": output.strip()[-500:]})
+else:
+    failed = (number(r"^Failed requests:\s+([0-9]+)", output) or 0) + \
+             (number(r"^Non-2xx responses:\s+([0-9]+)", output) or 0)
+    emit({
+        "requests": int(complete),
+        "rps": number(r"^Requests per second:\s+([0-9.]+)", output),
+        "error_rate": failed / complete if complete else 1.0,
+        "p50_ms": number(r"^\s+50%\s+([0-9]+)", output),
+        "p99_ms": number(r"^\s+99%\s+([0-9]+)", output),
+        "error": None
+    })
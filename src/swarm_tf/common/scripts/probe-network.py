@@ -0,0 +1,48 @@
+# Network probe (see swarm_tf.common.probes): round trip time (ping) and bandwidth (iperf3) over the overlay
+# network from this node to its peers. Runs in a task of a global service, one line per peer
+import json
+import os
+import random
+import re
+import subprocess
+import time
+
+node = os.environ["PROBE_NODE"]
+peers = json.loads(os.environ["PROBE_PEERS"]).get(node, [])
+seconds = os.environ.get("PROBE_SECONDS", "5")
+
+
+def emit(result):
+    print("SWARM_TF_PROBE " + json.dumps(dict(result, probe="network", node=node)), flush=True)
+
+
+def ping(address):
+    output = subprocess.run(["ping", "-c", "10", "-i", "0.2", "-q", address], stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT, universal_newlines=True).stdout
+    match = re.search(r"= [0-9.]+/([0-9.]+)/([0-9.]+)", output)
+    return (float(match.group(1)), float(match.group(2))) if match else (None, None)
+
+
+def iperf(address):
+    # The servers run one test at a time and may still be starting: retry
+    deadline = time.time() + 120
+    while True:
+        result = subprocess.run(["iperf3", "-c", address, "-t", seconds, "-J"], stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, universal_newlines=True)
+        try:
+            report = json.loads(result.stdout)
+        except ValueError:
+            report = {"error": result.stdout.strip()}
+        if "error" not in report:
+            return report["end"]["sum_received"]["bits_per_second"] / 1e6, \
+                report["end"]["sum_sent"].get("retransmits"), None
+        if time.time() > deadline:
+            return None, None, report["error"]
+        time.sleep(random.uniform(1, 3))
+
+
+for peer in peers:
+    rtt, rtt_max = ping(peer)
+    mbps, retransmits, error = iperf(peer)
+    emit({"peer": peer, "rtt_ms": rtt, "rtt_max_ms": rtt_max, "mbps": mbps, "retransmits": retransmits,
+          "error": error})
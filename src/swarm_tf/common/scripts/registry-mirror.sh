@@ -0,0 +1,60 @@
+#!/bin/bash
+
+# Registry mirror (pull-through cache of the Docker Hub) and pre-pull of the hot images.
+# Runs before the node joins the swarm, so the node does not receive tasks before the images are in place.
+
+MIRRORS="${mirrors}"
+
+${mark}
+
+# Wait until Docker is running correctly
+while [ -z "$(${docker_cmd} info 2>/dev/null | grep CPUs)" ]; do
+  echo Waiting for Docker to start...
+  sleep 2
+done
+
+if [ "${serve}" == "true" ]; then
+  mark registry_mirror start
+  # Only reachable in the private network
+  PRIVATE_ADDR=$(curl -s http://169.254.169.254/metadata/v1/interfaces/private/0/ipv4/address)
+  if [ -z "$(${docker_cmd} ps -a -q -f name=^/swarm_tf_registry_mirror$)" ]; then
+    ${docker_cmd} run -d --restart always --name swarm_tf_registry_mirror \
+      -p $PRIVATE_ADDR:${port}:5000 \
+      -e REGISTRY_PROXY_REMOTEURL=https://registry-1.docker.io \
+      -v /var/lib/swarm_tf/registry:/var/lib/registry \
+      ${registry_image}
+  fi
+  # The node uses its own cache first
+  MIRRORS="http://$PRIVATE_ADDR:${port}$${MIRRORS:+,$MIRRORS}"
+  mark registry_mirror end
+fi
+
+if [ -n "$MIRRORS" ]; then
+  # Merge the mirrors in the daemon configuration. The registry mirrors are reloaded without restarting Docker
+  sudo python3 - "$MIRRORS" <<'PYTHON'
+import json
+import os
+import sys
+
+path = "/etc/docker/daemon.json"
+config = {}
+if os.path.exists(path):
+    with open(path) as f:
+        config = json.load(f)
+
+mirrors = [mirror for mirror in sys.argv[1].split(",") if mirror]
+config["registry-mirrors"] = mirrors
+insecure = [mirror.split("://", 1)[1] for mirror in mirrors if mirror.startswith("http://")]
+config["insecure-registries"] = sorted(set(config.get("insecure-registries", []) + insecure))
+
+with open(path, "w") as f:
+    json.dump(config, f, indent=2)
+PYTHON
+  sudo systemctl reload docker
+fi
+
+if [ -n "${images}" ]; then
+  mark image_prepull start
+  echo "${images}" | tr ' ' '\n' | xargs -r -n 1 -P ${parallel} ${docker_cmd} pull
+  mark image_prepull end
+fi
@@ -0,0 +1,64 @@
+#!/bin/bash
+
+# Performance profile: Docker daemon settings, kernel settings and swap (see swarm_tf.common.profiles).
+# Runs before the node joins the swarm, so the Docker restart does not affect running tasks.
+
+${mark}
+
+# Wait until Docker is running correctly
+while [ -z "$(${docker_cmd} info 2>/dev/null | grep CPUs)" ]; do
+  echo Waiting for Docker to start...
+  sleep 2
+done
+
+mark tune_node start
+
+cat <<'SYSCTL' | sudo tee /etc/sysctl.d/60-swarm-tf.conf > /dev/null
+${sysctl}
+SYSCTL
+sudo sysctl --system > /dev/null || true
+
+# Merge the profile in the daemon configuration (keep the other settings, e.g. the registry mirrors)
+cat <<'DAEMON' > /tmp/swarm-tf-daemon.json
+${daemon_json}
+DAEMON
+sudo python3 - /tmp/swarm-tf-daemon.json <<'PYTHON'
+import json
+import os
+import sys
+
+path = "/etc/docker/daemon.json"
+config = {}
+if os.path.exists(path):
+    with open(path) as f:
+        config = json.load(f)
+
+with open(sys.argv[1]) as f:
+    config.update(json.load(f))
+
+with open(path, "w") as f:
+    json.dump(config, f, indent=2)
+PYTHON
+rm -f /tmp/swarm-tf-daemon.json
+sudo systemctl restart docker
+
+SWAP_SIZE="${swap_size}"
+if [ -n "$SWAP_SIZE" ]; then
+  sudo swapoff /swapfile 2>/dev/null
+  sudo rm -f /swapfile
+  sudo sed -i '/^\/swapfile /d' /etc/fstab
+  if [ "$SWAP_SIZE" != "0" ]; then
+    sudo fallocate -l $SWAP_SIZE /swapfile
+    sudo chmod 600 /swapfile
+    sudo mkswap /swapfile
+    sudo swapon /swapfile
+    echo '/swapfile none swap sw 0 0' | sudo tee -a /etc/fstab
+  fi
+fi
+
+# Wait for Docker after the restart
+while [ -z "$(${docker_cmd} info 2>/dev/null | grep CPUs)" ]; do
+  sleep 1
+done
+
+mark tune_node end
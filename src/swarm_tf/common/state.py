@@ -0,0 +1,60 @@
+import json
+import os
+
+
+class TerraformState:
+    """Read the outputs and resources straight from the terraform state file (format 3, terraform 0.11,
+    and format 4, terraform 0.12+), without running terraform"""
+
+    def __init__(self, path="terraform.tfstate"):
+        if not os.path.exists(path):
+            raise RuntimeError("State file {} not found. Run terrascript apply first".format(path))
+        with open(path) as f:
+            self.data = json.load(f)
+
+    def outputs(self):
+        if self.data.get("version", 0) >= 4:
+            outputs = self.data.get("outputs", {})
+        else:
+            outputs = {}
+            for module in self.data.get("modules", []):
+                if module.get("path") == ["root"]:
+                    outputs = module.get("outputs", {})
+        return {name: output["value"] for name, output in outputs.items()}
+
+    def output(self, name, default=None):
+        return self.outputs().get(name, default)
+
+    def resources(self, resource_type=None):
+        """Return a list of {"address", "type", "id", "attributes"} of the managed resources"""
+        result = []
+        if self.data.get("version", 0) >= 4:
+            for resource in self.data.get("resources", []):
+                if resource.get("mode", "managed") != "managed" or resource.get("module"):
+                    continue
+                for instance in resource.get("instances", []):
+                    address = "{}.{}".format(resource["type"], resource["name"])
+                    if "index_key" in instance:
+                        address += "[{}]".format(json.dumps(instance["index_key"]))
+                    result.append({"address": address, "type": resource["type"],
+                                   "id": instance["attributes"].get("id"), "attributes": instance["attributes"]})
+        else:
+            for module in self.data.get("modules", []):
+                if module.get("path") != ["root"]:
+                    continue
+                for key, resource in module.get("resources", {}).items():
+                    if key.startswith("data."):
+                        continue
+                    parts = key.split(".")
+                    address = ".".join(parts[:2]) + ("[{}]".format(parts[2]) if len(parts) > 2 else "")
+                    result.append({"address": address, "type": resource["type"],
+                                   "id": resource["primary"]["id"], "attributes": resource["primary"]["attributes"]})
+
+        if resource_type is not None:
+            result = [resource for resource in result if resource["type"] == resource_type]
+        return result
+
+    def droplets(self):
+        """Return {hostname: attributes} of the droplets"""
+        return {droplet["attributes"]["name"]: droplet["attributes"]
+                for droplet in self.resources("digitalocean_droplet")}
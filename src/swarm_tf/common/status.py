@@ -0,0 +1,201 @@
+import asyncio
+import collections
+import sys
+import time
+from datetime import datetime
+
+from swarm_tf.common.async_docker import AsyncDockerClient, SSHTunnel
+
+
+def manager_hosts(state, name="manager"):
+    """Public addresses of the managers: the manager_ips output or the droplets named <name>-NN"""
+    ips = state.output("manager_ips")
+    if ips:
+        return ips if isinstance(ips, list) else ips.split(",")
+    return [attributes["ipv4_address"] for hostname, attributes in sorted(state.droplets().items())
+            if hostname.split(".")[0].rsplit("-", 1)[0] == name]
+
+
+class Cluster:
+    """Persistent connections to all the managers. The requests fan out to the managers concurrently"""
+
+    def __init__(self, hosts, user="root", private_key="~/.ssh/id_rsa", timeout=10):
+        self.tunnels = [SSHTunnel(host, user, private_key, timeout=timeout) for host in hosts]
+        self.clients = {}
+        self.timeout = timeout
+
+    async def connect(self):
+        """Open (or reuse) the tunnels. Return {host: error} of the unreachable managers"""
+        results = await asyncio.gather(*[tunnel.open() for tunnel in self.tunnels], return_exceptions=True)
+        errors = {}
+        for tunnel, result in zip(self.tunnels, results):
+            if isinstance(result, Exception):
+                errors[tunnel.host] = str(result)
+            else:
+                self.clients[tunnel.host] = AsyncDockerClient(result, timeout=self.timeout)
+        return errors
+
+    async def disconnect(self):
+        await self.close()
+        await asyncio.gather(*[tunnel.close() for tunnel in self.tunnels])
+
+    async def close(self):
+        await asyncio.gather(*[client.close() for client in self.clients.values()])
+
+    async def fan_out(self, call):
+        """Run `call(client)` on all the managers. Return {host: result or exception}"""
+        hosts = list(self.clients)
+        results = await asyncio.gather(*[call(self.clients[host]) for host in hosts], return_exceptions=True)
+        return dict(zip(hosts, results))
+
+    async def status(self):
+        start = time.time()
+        errors = await self.connect()
+
+        async def probe(client):
+            probe_start = time.time()
+            info = await client.info()
+            return info, time.time() - probe_start
+
+        probes = await self.fan_out(probe)
+        managers = []
+        for tunnel in self.tunnels:
+            result = probes.get(tunnel.host)
+            if isinstance(result, tuple):
+                info, latency = result
+                managers.append({"host": tunnel.host, "reachable": True, "node_id": info["Swarm"].get("NodeID"),
+                                 "latency": round(latency, 4)})
+            else:
+                managers.append({"host": tunnel.host, "reachable": False,
+                                 "error": errors.get(tunnel.host, str(result))})
+
+        reachable = [manager["host"] for manager in managers if manager["reachable"]]
+        if not reachable:
+            return {"managers": managers, "nodes": [], "services": [], "seconds": round(time.time() - start, 3)}
+
+        # The cluster state is the same in all the managers: read it from the fastest one
+        client = self.clients[min(reachable, key=lambda host: probes[host][1])]
+        nodes, services, tasks = await asyncio.gather(client.nodes(), client.services(),
+                                                      client.tasks({"desired-state": ["running"]}))
+        return {
+            "managers": managers,
+            "nodes": summarize_nodes(nodes),
+            "services": summarize_services(services, tasks),
+            "seconds": round(time.time() - start, 3)
+        }
+
+    async def events(self, types=("node", "service")):
+        """Yield the events of all the managers, without the duplicates. A stream that stops is reported in the
+        stderr; RuntimeError when no manager is reachable or all the streams stopped"""
+        errors = await self.connect()
+        if not self.clients:
+            raise RuntimeError("No manager reachable: {}".format(", ".join(["{} ({})".format(host, error)
+                                                                           for host, error in errors.items()])))
+        queue = asyncio.Queue()
+
+        async def forward(host, client):
+            try:
+                async for event in client.events({"type": list(types)}):
+                    await queue.put((host, event, None))
+                error = "the stream was closed"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = str(e) or type(e).__name__
+            await queue.put((host, None, error))
+
+        streams = [asyncio.ensure_future(forward(host, client)) for host, client in self.clients.items()]
+        active = len(streams)
+        seen = collections.deque(maxlen=1000)
+        try:
+            while active:
+                host, event, error = await queue.get()
+                if error is not None:
+                    active -= 1
+                    print("Events of {} stopped: {}".format(host, error), file=sys.stderr, flush=True)
+                    continue
+                key = (event.get("Type"), event.get("Action"), event.get("Actor", {}).get("ID"),
+                       event.get("timeNano"))
+                if key in seen:
+                    continue
+                seen.append(key)
+                yield event
+            raise RuntimeError("The event streams of all the managers stopped")
+        finally:
+            for stream in streams:
+                stream.cancel()
+
+
+def summarize_nodes(nodes):
+    return [{
+        "hostname": node["Description"]["Hostname"],
+        "role": node["Spec"].get("Role"),
+        "availability": node["Spec"].get("Availability"),
+        "state": node["Status"]["State"],
+        "address": node["Status"].get("Addr"),
+        "leader": node.get("ManagerStatus", {}).get("Leader", False)
+    } for node in sorted(nodes, key=lambda node: node["Description"]["Hostname"])]
+
+
+def summarize_services(services, tasks):
+    running = collections.Counter()
+    desired = collections.Counter()
+    for task in tasks:
+        desired[task["ServiceID"]] += 1
+        if task["Status"]["State"] == "running":
+            running[task["ServiceID"]] += 1
+
+    result = []
+    for service in sorted(services, key=lambda service: service["Spec"]["Name"]):
+        replicated = service["Spec"].get("Mode", {}).get("Replicated")
+        result.append({
+            "name": service["Spec"]["Name"],
+            "mode": "replicated" if replicated is not None else "global",
+            "running": running[service["ID"]],
+            "desired": replicated.get("Replicas", 0) if replicated is not None else desired[service["ID"]]
+        })
+    return result
+
+
+def format_status(status):
+    lines = []
+    managers = status["managers"]
+    reachable = [manager for manager in managers if manager["reachable"]]
+    lines.append("Managers: {}/{} reachable".format(len(reachable), len(managers)))
+    for manager in managers:
+        if manager["reachable"]:
+            lines.append("  {:<16} {:>7.1f}ms".format(manager["host"], manager["latency"] * 1000))
+        else:
+            lines.append("  {:<16} unreachable: {}".format(manager["host"], manager["error"]))
+
+    nodes = status["nodes"]
+    if nodes:
+        states = collections.Counter([node["state"] for node in nodes])
+        availability = collections.Counter([node["availability"] for node in nodes])
+        leader = [node["hostname"] for node in nodes if node["leader"]]
+        lines.append("Nodes: {} ({}; {}), leader {}".format(
+            len(nodes),
+            ", ".join(["{} {}".format(key, value) for key, value in sorted(states.items())]),
+            ", ".join(["{} {}".format(key, value) for key, value in sorted(availability.items())]),
+            leader[0] if leader else "-"))
+        for node in nodes:
+            if node["state"] != "ready":
+                lines.append("  {:<40} {}".format(node["hostname"], node["state"]))
+
+    services = status["services"]
+    converged = [service for service in services if service["running"] >= service["desired"]]
+    lines.append("Services: {} ({} converged)".format(len(services), len(converged)))
+    for service in services:
+        if service["running"] < service["desired"]:
+            lines.append("  {:<40} {}/{}".format(service["name"], service["running"], service["desired"]))
+
+    lines.append("Collected in {:.2f}s".format(status["seconds"]))
+    return "\n".join(lines)
+
+
+def format_event(event):
+    attributes = event.get("Actor", {}).get("Attributes", {})
+    details = " ".join(["{}={}".format(key, value) for key, value in sorted(attributes.items()) if key != "name"])
+    return "{} {:<8} {:<8} {} {}".format(datetime.fromtimestamp(event.get("time", 0)).strftime("%H:%M:%S"),
+                                         event.get("Type", ""), event.get("Action", ""),
+                                         attributes.get("name", event.get("Actor", {}).get("ID", "")), details)
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from terrascript import Terrascript
+
+from swarm_tf.common.drift import GLOBAL_BLOCKS, config_entities, dependents, drift_targets, entity_hash
+
+MANIFEST = os.path.join(".swarm_tf", "manifest.json")
+
+
+class Manifest:
+    """Content hash of each section (node group) of the generated terraform json"""
+
+    def __init__(self, directory="."):
+        self.directory = directory
+        self.path = os.path.join(directory, MANIFEST)
+        self.data = {"sections": {}, "applied": None, "applied_entities": None}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.data = json.load(f)
+
+    @property
+    def sections(self):
+        return self.data["sections"]
+
+    def digest(self):
+        """Hash of the whole configuration, combining the hash of all the sections"""
+        content = "".join(["{}:{};".format(name, self.sections[name]["hash"]) for name in sorted(self.sections)])
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def is_applied(self):
+        return self.data["applied"] == self.digest()
+
+    def mark_applied(self, targets=None):
+        """Record the applied configuration and the hash of each applied block: all of them, or only the `targets`
+        of a drift mode apply (the configuration is applied when the targets covered all the changes)"""
+        entities = self.entities()
+        current = {address: entity_hash(value) for address, value in entities.items()}
+        applied = self.data.get("applied_entities")
+        if targets is None:
+            self.data["applied"] = self.digest()
+            self.data["applied_entities"] = current
+            return
+        if applied is None:
+            return
+        targets = set(targets)
+        # The data sources cannot be targeted: they are applied with the resources using them, if any
+        for address in set(current) | set(applied):
+            if address.startswith("data."):
+                users = [user for user in dependents(entities, [address]) if not user.startswith("data.") and
+                         user.split(".")[0] not in GLOBAL_BLOCKS]
+                if set(users) <= targets:
+                    targets.add(address)
+        for address in targets:
+            if address in current:
+                applied[address] = current[address]
+            else:
+                applied.pop(address, None)
+        if applied == current:
+            self.data["applied"] = self.digest()
+
+    def reset_applied(self):
+        """Forget the last apply: the state changed outside of an apply (destroy, taint, import, ...)"""
+        self.data["applied"] = None
+        self.data["applied_entities"] = None
+
+    def entities(self):
+        """{address: configuration} of the blocks of all the section files"""
+        entities = {}
+        for section in self.sections.values():
+            path = os.path.join(self.directory, section["file"])
+            if os.path.exists(path):
+                with open(path) as f:
+                    entities.update(config_entities(json.load(f)))
+        return entities
+
+    def applied_entities(self):
+        """{address: hash} of the blocks at the last apply. None when unknown"""
+        applied = self.data.get("applied_entities")
+        if applied is None and self.is_applied():
+            # Applied before the hashes were recorded
+            return {address: entity_hash(value) for address, value in self.entities().items()}
+        return applied
+
+    def write_section(self, name, content):
+        """Write the section file only if its content changed. Return True if the file was written"""
+        filename = section_filename(name)
+        digest = hashlib.sha256(content.encode()).hexdigest()
+        path = os.path.join(self.directory, filename)
+        if name in self.sections and self.sections[name]["hash"] == digest and os.path.exists(path):
+            return False
+
+        write_atomic(path, content)
+        self.sections[name] = {"file": filename, "hash": digest}
+        return True
+
+    def remove_sections(self, keep):
+        """Remove the files of the sections not in the list `keep`. Return the removed sections"""
+        removed = [name for name in self.sections if name not in keep]
+        for name in removed:
+            path = os.path.join(self.directory, self.sections[name]["file"])
+            if os.path.exists(path):
+                os.remove(path)
+            del self.sections[name]
+        return removed
+
+    def save(self):
+        write_atomic(self.path, json.dumps(self.data, indent=2, sort_keys=True))
+
+
+def section_filename(name):
+    return "main.tf.json" if name == "main" else "swarm_{}.tf.json".format(name)
+
+
+def write_atomic(path, content):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write(content)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
+
+
+def section_targets(name, directory="."):
+    """Terraform addresses of the resources in the section file (see synthesize)"""
+    path = os.path.join(directory, section_filename(name))
+    if not os.path.exists(path):
+        raise RuntimeError("{} not found. The main.py must call synthesize(o)".format(path))
+    with open(path) as f:
+        config = json.load(f)
+    return set(["{}.{}".format(resource_type, resource_name)
+                for resource_type, resources in config.get("resource", {}).items()
+                for resource_name in resources])
+
+
+def split_sections(o):
+    """Split the terrascript in one Terrascript object per node group. Items added outside of a node group
+    (provider, firewall, outputs, ...) go to the "main" section"""
+    groups = o.shared.get("__groups", {})
+    sections = {"main": Terrascript()}
+    for item in o.terrascript._item_list:
+        name = groups.get(id(item), "main")
+        if name not in sections:
+            sections[name] = Terrascript()
+        sections[name].add(item)
+    return sections
+
+
+def synthesize(o, directory="."):
+    """Write one terraform json file per node group, rewriting only the files whose content changed.
+    Return the list of the changed (written or removed) sections"""
+    manifest = Manifest(directory)
+    sections = split_sections(o)
+
+    changed = [name for name in sorted(sections) if manifest.write_section(name, sections[name].dump())]
+    changed += manifest.remove_sections(sections.keys())
+    manifest.save()
+    return changed
+
+
+# Commands changing the state: the next plan/apply must run terraform
+STATE_COMMANDS = ["destroy", "taint", "untaint", "import"]
+STATE_SUBCOMMANDS = ["rm", "mv", "push", "replace-provider"]
+
+
+def changes_state(args):
+    return args[0] in STATE_COMMANDS or (args[0] == "state" and len(args) > 1 and args[1] in STATE_SUBCOMMANDS)
+
+
+def is_drift_mode(args):
+    """True when run_terraform plans only the drift (TERRASCRIPT_DRIFT=1, a plan file is applied as is)"""
+    return args[0] in ["plan", "apply"] and os.environ.get("TERRASCRIPT_DRIFT", "0") != "0" and \
+        [arg for arg in args[1:] if not arg.startswith("-")] == []
+
+
+def is_unchanged(args, directory="."):
+    """True when run_terraform skips the plan/apply without running terraform: the configuration did not change
+    since the last successful apply (and neither TERRASCRIPT_FORCE nor the drift mode are set)"""
+    return args[0] in ["plan", "apply"] and not is_drift_mode(args) and not os.environ.get("TERRASCRIPT_FORCE") \
+        and Manifest(directory).is_applied()
+
+
+def run_terraform(args, directory=".", prefix=None, env=None):
+    """Run terraform in the directory, skipping plan/apply when nothing changed since the last successful apply
+    (forgotten by the commands changing the state: destroy, taint, import, state rm, ...). Set the environment
+    variable TERRASCRIPT_FORCE=1 to run terraform anyway (e.g. to detect changes made outside terraform) or
+    TERRASCRIPT_DRIFT=1 to plan only the resources changed in the configuration or outside terraform (see
+    swarm_tf.common.drift). When `prefix` is set the output lines are prefixed with it. `env` replaces the environment
+    of terraform. Return the exit code"""
+    manifest = Manifest(directory)
+    drift = None
+    # Drift mode: plan only the blocks changed in the configuration or outside terraform (a plan file is applied as is)
+    if is_drift_mode(args):
+        drift = drift_targets(manifest, prefix or "", env)
+        if drift == []:
+            print("{}No drift since the last apply. Skipping terraform {}.".format(prefix or "", args[0]))
+            if args[0] == "apply":
+                # Record the changes of the data sources without users
+                manifest.mark_applied([])
+                manifest.save()
+            return 0
+        if drift is not None:
+            args = args + ["-target={}".format(target) for target in drift]
+    elif is_unchanged(args, directory):
+        print("{}The configuration did not change since the last apply. Skipping terraform {}."
+              .format(prefix or "", args[0]))
+        return 0
+
+    if prefix is None:
+        returncode = subprocess.call(["terraform"] + args, cwd=directory, env=env)
+    else:
+        process = subprocess.Popen(["terraform"] + args, cwd=directory, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT, universal_newlines=True, env=env)
+        for line in process.stdout:
+            sys.stdout.write(prefix + line)
+            sys.stdout.flush()
+        returncode = process.wait()
+
+    # Even a failed command may have changed a part of the state
+    if changes_state(args):
+        manifest.reset_applied()
+        manifest.save()
+    # An apply restricted with -target leaves the other changes pending, except the targets of the drift mode
+    elif args[0] == "apply" and returncode == 0:
+        if drift:
+            manifest.mark_applied(drift)
+            manifest.save()
+        elif not [arg for arg in args if arg.startswith("-target")]:
+            manifest.mark_applied()
+            manifest.save()
+    return returncode
@@ -0,0 +1,148 @@
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+TIMELINE_LOG = "/var/log/swarm_tf/timeline.log"
+
+# Prints the phase marks of the provisioning scripts ("<epoch> <phase> start|end") and the boot and cloud-init
+# finished events ("<epoch> <event> point")
+COLLECT_COMMAND = " ".join([
+    "sudo cat {} 2>/dev/null;".format(TIMELINE_LOG),
+    "echo \"$(date -d \"$(uptime -s)\" +%s) boot point\";",
+    "test -f /var/lib/cloud/data/result.json && echo \"$(stat -c %Y /var/lib/cloud/data/result.json)"
+    " cloud_init_finished point\";",
+    "true"
+])
+
+
+def parse_marks(content):
+    """Parse the collected lines in a list of (timestamp, name, kind)"""
+    marks = []
+    for line in content.splitlines():
+        parts = line.split()
+        if len(parts) != 3:
+            continue
+        try:
+            marks.append((float(parts[0]), parts[1], parts[2]))
+        except ValueError:
+            continue
+    return sorted(marks)
+
+
+def node_timeline(hostname, marks, created=None):
+    """Build the timeline of a node: the phases (start, end and duration) and the events, relative to the creation
+    of the droplet (or the boot when the creation time is not known)"""
+    events = {name: timestamp for timestamp, name, kind in marks if kind == "point"}
+    origin = created if created is not None else events.get("boot")
+
+    phases = []
+    started = {}
+    for timestamp, name, kind in marks:
+        if kind == "start":
+            started[name] = timestamp
+        elif kind == "end" and name in started:
+            start = started.pop(name)
+            phases.append({"phase": name, "start": start, "end": timestamp, "seconds": round(timestamp - start, 3)})
+
+    # Derived phase from the events
+    if created is not None and "boot" in events:
+        phases.append({"phase": "droplet_create", "start": created, "end": events["boot"],
+                       "seconds": round(events["boot"] - created, 3)})
+    phases.sort(key=lambda phase: phase["start"])
+
+    end = max([phase["end"] for phase in phases] + list(events.values())) if phases or events else None
+    return {
+        "hostname": hostname,
+        "origin": origin,
+        "end": end,
+        "seconds": round(end - origin, 3) if end is not None and origin is not None else None,
+        "phases": phases,
+        "events": events,
+        "unfinished": sorted(started)
+    }
+
+
+def critical_path(timelines):
+    """Cluster report: the node finishing last defines the cluster provisioning time (critical path)"""
+    nodes = [timeline for timeline in timelines if timeline["end"] is not None]
+    if not nodes:
+        return {"nodes": len(timelines), "seconds": None, "critical_node": None, "phases": {}}
+
+    start = min([timeline["origin"] if timeline["origin"] is not None else timeline["phases"][0]["start"]
+                 for timeline in nodes if timeline["origin"] is not None or timeline["phases"]] or [0])
+    last = max(nodes, key=lambda timeline: timeline["end"])
+
+    phases = {}
+    for timeline in nodes:
+        for phase in timeline["phases"]:
+            phases.setdefault(phase["phase"], []).append(phase["seconds"])
+
+    return {
+        "nodes": len(timelines),
+        "start": start,
+        "end": last["end"],
+        "seconds": round(last["end"] - start, 3),
+        "critical_node": last["hostname"],
+        "critical_path": [{"phase": phase["phase"], "seconds": phase["seconds"]} for phase in last["phases"]],
+        "phases": {name: {"count": len(values),
+                          "mean": round(sum(values) / len(values), 3),
+                          "max": max(values)} for name, values in sorted(phases.items())},
+        "unfinished": {timeline["hostname"]: timeline["unfinished"] for timeline in timelines
+                       if timeline["unfinished"]}
+    }
+
+
+def collect_node(host, user, private_key, timeout=20):
+    cmd = ["ssh", "-o", "IdentitiesOnly=true", "-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null",
+           "-o", "LogLevel=ERROR", "-o", "ConnectTimeout={}".format(timeout), "-i", os.path.expanduser(private_key),
+           "{}@{}".format(user, host), COLLECT_COMMAND]
+    return subprocess.check_output(cmd, universal_newlines=True, timeout=timeout * 2)
+
+
+def parse_created(value):
+    """Timestamp of the droplet creation (created_at attribute, when the provider stores it)"""
+    try:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=timezone.utc).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def collect(droplets, user, private_key, parallel=20):
+    """Collect the timeline of all the droplets ({hostname: state attributes}) in parallel"""
+    def collect_one(item):
+        hostname, attributes = item
+        try:
+            content = collect_node(attributes["ipv4_address"], user, private_key)
+        except (subprocess.SubprocessError, OSError) as error:
+            return dict(node_timeline(hostname, []), error=str(error))
+        return node_timeline(hostname, parse_marks(content), parse_created(attributes.get("created_at")))
+
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        return list(executor.map(collect_one, sorted(droplets.items())))
+
+
+def report(timelines):
+    return {"cluster": critical_path(timelines), "nodes": timelines}
+
+
+def summary(result):
+    """Text summary of the report"""
+    cluster = result["cluster"]
+    if cluster["seconds"] is None:
+        return "No timeline found in the {} nodes".format(cluster["nodes"])
+
+    lines = ["Cluster provisioning: {:.1f}s over {} nodes".format(cluster["seconds"], cluster["nodes"]),
+             "Critical node: {}".format(cluster["critical_node"])]
+    for phase in cluster["critical_path"]:
+        lines.append("  {:<20} {:>8.1f}s".format(phase["phase"], phase["seconds"]))
+    lines.append("Phases (all nodes):")
+    lines.append("  {:<20} {:>6} {:>9} {:>9}".format("phase", "nodes", "mean", "max"))
+    for name, stats in cluster["phases"].items():
+        lines.append("  {:<20} {:>6} {:>8.1f}s {:>8.1f}s".format(name, stats["count"], stats["mean"], stats["max"]))
+    for hostname, phases in cluster["unfinished"].items():
+        lines.append("Unfinished on {}: {}".format(hostname, ", ".join(phases)))
+    for node in result["nodes"]:
+        if "error" in node:
+            lines.append("Failed to collect {}: {}".format(node["hostname"], node["error"]))
+    return "\n".join(lines)
@@ -0,0 +1,238 @@
+import json
+import os
+import re
+
+from swarm_tf.common.profiles import get_profile
+
+AVAILABILITIES = ["active", "pause", "drain"]
+
+
+class Field:
+    """Declaration of a variable of a Variables class: default value, accepted types and checks.
+
+    `convert` is applied to the assigned values (e.g. dicts loaded from YAML to objects) and `check` returns an error
+    message or None. None is accepted when the default is None."""
+
+    __slots__ = ("name", "default", "types", "choices", "convert", "check", "items")
+
+    def __init__(self, default=None, types=None, choices=None, convert=None, check=None, items=None):
+        self.name = None
+        self.default = tuple(default) if isinstance(default, list) else default
+        self.types = types
+        self.choices = choices
+        self.convert = convert
+        self.check = check
+        # Accepted types of the items of the list variables
+        self.items = items
+
+    def is_list(self):
+        return self.types is list
+
+    def validate(self, value):
+        if self.convert is not None and value is not None:
+            value = self.convert(value)
+        if value is None:
+            if self.default is not None:
+                raise ValueError("{} can not be None".format(self.name))
+            return value
+        if self.is_list():
+            if not isinstance(value, (list, tuple)):
+                raise ValueError("{} must be a list (got {!r})".format(self.name, value))
+            if self.items is not None:
+                for item in value:
+                    if not isinstance(item, self.items) or isinstance(item, bool):
+                        raise ValueError("Invalid item {!r} in {}".format(item, self.name))
+            value = list(value)
+        elif self.types is not None:
+            # bool is an int: do not accept True for a number of instances
+            if not isinstance(value, self.types) or (isinstance(value, bool) and bool not in self.types):
+                raise ValueError("{} must be {} (got {!r})".format(
+                    self.name, " or ".join([t.__name__ for t in self.types]), value))
+        if self.choices is not None and value not in self.choices:
+            raise ValueError("Invalid {} {!r}. Use {}".format(
+                self.name, value, "|".join(["'{}'".format(choice) for choice in self.choices])))
+        if self.check is not None:
+            error = self.check(value)
+            if error is not None:
+                raise ValueError("Invalid {} {!r}: {}".format(self.name, value, error))
+        return value
+
+
+def non_negative(value):
+    return "must be >= 0" if value < 0 else None
+
+
+def positive(value):
+    return "must be > 0" if value <= 0 else None
+
+
+class VariablesMeta(type):
+    """Turn the Field declarations of a Variables class into slots"""
+
+    def __new__(mcs, name, bases, namespace):
+        fields = {}
+        for base in reversed(bases):
+            fields.update(getattr(base, "FIELDS", {}))
+        declared = [(key, value) for key, value in namespace.items() if isinstance(value, Field)]
+        for key, field in declared:
+            del namespace[key]
+            field.name = key
+            fields[key] = field
+        namespace["__slots__"] = tuple(namespace.get("__slots__", ())) + tuple([key for key, _ in declared])
+        namespace["FIELDS"] = fields
+        return super().__new__(mcs, name, bases, namespace)
+
+
+class Variables(metaclass=VariablesMeta):
+    """Variables of a node group, validated when they are assigned.
+
+    Only the assigned values are stored (slots), the others read the default of the field. The node groups use a
+    frozen copy (`copy().freeze()`), so the same object can be changed and reused for the next group. `freeze()`
+    also checks the variables depending on each other and fails before anything is synthesized."""
+
+    __slots__ = ("_frozen",)
+
+    def __init__(self, **values):
+        object.__setattr__(self, "_frozen", False)
+        for key, value in values.items():
+            setattr(self, key, value)
+
+    def __getattr__(self, name):
+        # Only called for the slots not assigned yet
+        field = self.FIELDS.get(name)
+        if field is None:
+            raise AttributeError("'{}' has no variable '{}'".format(type(self).__name__, name))
+        if field.is_list() and field.default is not None and not self._frozen:
+            # Mutable copy of the default, e.g. variables.tags.append("web")
+            value = list(field.default)
+            object.__setattr__(self, name, value)
+            return value
+        return field.default
+
+    def __setattr__(self, name, value):
+        if self._frozen:
+            raise AttributeError("The variables of '{}' are frozen. Use copy() to change them".format(self.name))
+        field = self.FIELDS.get(name)
+        if field is None:
+            raise AttributeError("'{}' has no variable '{}'".format(type(self).__name__, name))
+        object.__setattr__(self, name, field.validate(value))
+
+    def __delattr__(self, name):
+        raise AttributeError("The variables can not be deleted")
+
+    def assigned(self):
+        """The assigned variables (the others have the default value)"""
+        values = {}
+        for name in self.FIELDS:
+            try:
+                values[name] = object.__getattribute__(self, name)
+            except AttributeError:
+                pass
+        return values
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    def __eq__(self, other):
+        def normalized(variables):
+            return {name: tuple(value) if isinstance(value, list) else value
+                    for name, value in variables.to_dict().items()}
+        return type(self) is type(other) and normalized(self) == normalized(other)
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, ", ".join(
+            ["{}={!r}".format(key, value) for key, value in sorted(self.assigned().items())]))
+
+    def errors(self):
+        """Errors of the variables depending on each other"""
+        return []
+
+    def validate(self):
+        errors = self.errors()
+        if errors:
+            raise ValueError("Invalid variables for '{}':\n  {}".format(self.name, "\n  ".join(errors)))
+        return self
+
+    def freeze(self):
+        """Validate the variables and forbid the changes. The lists are turned to tuples"""
+        if self._frozen:
+            return self
+        self.validate()
+        for name, value in self.assigned().items():
+            if isinstance(value, list):
+                object.__setattr__(self, name, tuple(value))
+        object.__setattr__(self, "_frozen", True)
+        return self
+
+    @property
+    def frozen(self):
+        return self._frozen
+
+    def copy(self, **changes):
+        """Copy not frozen, with some variables changed. Only the assigned variables are copied"""
+        other = type(self).__new__(type(self))
+        object.__setattr__(other, "_frozen", False)
+        for name, value in self.assigned().items():
+            object.__setattr__(other, name, list(value) if isinstance(value, (list, tuple)) else value)
+        for name, value in changes.items():
+            setattr(other, name, value)
+        return other
+
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict):
+            raise ValueError("The variables of {} must be a mapping (got {!r})".format(cls.__name__, data))
+        return cls(**data)
+
+    @classmethod
+    def load(cls, path, key=None):
+        """Load the variables from a JSON or YAML (PyYAML needed) file. `key` selects a section of the file, e.g.
+        WorkerVariables.load("cluster.yml", "workers")"""
+        data = load_file(path)
+        if key is not None:
+            if not isinstance(data, dict) or key not in data:
+                raise ValueError("No section '{}' in {}".format(key, path))
+            data = data[key]
+        try:
+            return cls.from_dict(data)
+        except (ValueError, AttributeError) as e:
+            raise ValueError("{}: {}".format(path, e))
+
+
+def load_file(path):
+    with open(path) as f:
+        content = f.read()
+    if os.path.splitext(path)[1] in [".yml", ".yaml"]:
+        try:
+            import yaml
+        except ImportError:
+            raise RuntimeError("PyYAML is needed to load {} (pip install pyyaml)".format(path))
+        return yaml.safe_load(content)
+    return json.loads(content)
+
+
+def duration(value):
+    return None if re.match(r"^([0-9]+(\.[0-9]+)?(ns|us|ms|s|m|h))+$", value) else "use a duration, e.g. '10s'"
+
+
+def profile_error(value):
+    try:
+        get_profile(value)
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+def port(value):
+    # The data path port must be outside of the ephemeral ports
+    return None if 1024 <= value <= 49151 else "use a port between 1024 and 49151"
+
+
+def node_errors(variables):
+    """Errors of the variables shared by the managers and the workers"""
+    errors = []
+    if variables.create_dns and not variables.domain:
+        errors.append("create_dns needs a domain")
+    if variables.create_dns and not variables.tags:
+        errors.append("create_dns needs at least one tag (the name of the group record)")
+    return errors
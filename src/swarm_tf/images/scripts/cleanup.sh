@@ -0,0 +1,13 @@
+#!/bin/bash
+
+# Remove the node identity before the snapshot, so every droplet created from it is a new swarm node
+systemctl stop docker
+rm -f /etc/docker/key.json
+rm -rf /var/lib/docker/swarm
+systemctl enable docker
+
+# Let cloud-init run again (user_data) on the droplets created from the snapshot
+if [ -x "$(command -v cloud-init)" ]; then
+  cloud-init clean --logs
+fi
+rm -f /etc/ssh/ssh_host_*
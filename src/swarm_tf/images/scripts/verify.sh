@@ -0,0 +1,10 @@
+#!/bin/bash
+
+set -e
+
+# The image is usable if Docker is installed and enabled at boot
+docker --version
+if [ -d /run/systemd/system ]; then
+  systemctl is-enabled docker
+fi
+test -f /etc/swarm_tf/image.json
@@ -1,7 +1,15 @@
 import os
 from terrascript.template.d import *
-from terrascript import connection, function, provisioner, output, resource, data
-from swarm_tf.common import Node
+from terrascript import connection, function, provisioner, resource, data
+from swarm_tf.common import Node, VolumeClaim, mark_script
+from swarm_tf.common.profiles import PerformanceProfile
+from swarm_tf.common.variables import Variables, Field, AVAILABILITIES, duration, non_negative, node_errors, port, \
+    positive, profile_error
+from swarm_tf.managers.networks import OverlayNetwork, remove_ingress_commands
+
+
+# CoreDNS serving the internal names when ManagerVariables.local_dns is enabled
+LOCAL_DNS_IMAGE = "coredns/coredns:1.6.9"
 
 
 class Manager(Node):
@@ -16,21 +24,36 @@ class Manager(Node):
                              template=function.file(os.path.join(self.curdir, "scripts", "provision-first-manager.sh")),
                              vars={
                                   "docker_cmd": self.variables.docker_cmd,
-                                  "availability": self.variables.availability
+                                  "mark": mark_script(),
+                                  "availability": self.variables.availability,
+                                  "data_path_port": "" if self.variables.data_path_port is None else
+                                                    "--data-path-port {}".format(self.variables.data_path_port)
                              })
 
         self.o.shared["provision_first_manager"]=tmpl
-        self.o.terrascript.add(tmpl)
+        self.add(tmpl)
 
         tmpl3 = template_file("provision_manager",
                               template=function.file(os.path.join(self.curdir, "scripts", "provision-manager.sh")),
                               vars={
                                 "docker_cmd": self.variables.docker_cmd,
+                                "mark": mark_script(),
                                 "availability": self.variables.availability,
                               })
 
         self.o.shared["provision_manager"] = tmpl3
-        self.o.terrascript.add(tmpl3)
+        self.add(tmpl3)
+
+        if self.variables.drain_above is not None:
+            tmpl4 = template_file("manager_availability",
+                                  template=function.file(os.path.join(self.curdir, "scripts",
+                                                                      "manager-availability.sh")),
+                                  vars={
+                                      "availability": self.variables.availability,
+                                      "drain_above": self.variables.drain_above
+                                  })
+            self.o.shared["manager_availability"] = tmpl4
+            self.add(tmpl4)
 
     def node(self, number):
         conn = connection(type="ssh",
@@ -58,6 +81,16 @@ class Manager(Node):
         prov = [prov4]
         if number == 1:
             prov = [prov1, prov3] + prov
+        prov = self.bootstrap_provisioners() + prov
+
+        if self.variables.drain_above is not None:
+            prov.append(provisioner("file",
+                                    content=self.o.shared["manager_availability"].rendered,
+                                    destination="/tmp/manager-availability.sh"))
+            prov.append(provisioner("remote-exec",
+                                    inline=[
+                                        "chmod +x /tmp/manager-availability.sh",
+                                        "/tmp/manager-availability.sh"]))
 
         if not(self.variables.remote_api_ca is None or
            self.variables.remote_api_certificate is None or
@@ -87,21 +120,111 @@ class Manager(Node):
 
         return self.create_droplet(droplet_type="manager", number=number, conn=conn, prov=prov)
 
+    def serves_local_dns(self):
+        return self.variables.local_dns
+
+    def prepare_dns_server_template(self):
+        if "local_dns_server" not in self.o.shared:
+            tmpl = template_file("local_dns_server",
+                                 template=function.file(os.path.join(self.curdir, "scripts", "local-dns-server.sh")),
+                                 vars={
+                                     "docker_cmd": self.variables.docker_cmd,
+                                     "mark": mark_script(),
+                                     "domain": self.variables.domain,
+                                     "ttl": self.variables.local_dns_ttl,
+                                     "upstreams": " ".join(self.variables.local_dns_upstreams),
+                                     "image": LOCAL_DNS_IMAGE
+                                 })
+            self.add(tmpl)
+            self.o.shared["local_dns_server"] = tmpl
+        return self.o.shared["local_dns_server"]
+
+    def bootstrap_templates(self):
+        templates = super().bootstrap_templates()
+        if self.variables.local_dns:
+            templates.insert(0, ("35-local-dns-server.sh", self.prepare_dns_server_template()))
+            templates.sort(key=lambda template: template[0])
+        return templates
+
+    def get_networks(self):
+        if self.variables.networks is None:
+            return [OverlayNetwork("main")]
+        return self.variables.networks
+
+    def create_networks(self, droplet_manager):
+        """Create the overlay networks from the first manager. New networks are created on the next apply"""
+        commands = []
+        if self.variables.ingress is False:
+            commands += remove_ingress_commands(self.variables.docker_cmd)
+        elif self.variables.ingress is not None:
+            commands += self.variables.ingress.ingress_commands(self.variables.docker_cmd)
+        for network in self.get_networks():
+            commands += network.commands(self.variables.docker_cmd)
+
+        self.add(resource("null_resource", "networks",
+                          connection=connection(type="ssh",
+                                                host=droplet_manager.ipv4_address,
+                                                user=self.variables.provision_user,
+                                                private_key=function.file(self.variables.provision_ssh_key),
+                                                timeout=self.variables.connection_timeout),
+                          triggers={
+                              "cluster_instance_ids": droplet_manager.id,
+                              "networks": ",".join([network.digest() for network in self.get_networks()]),
+                              "ingress": "removed" if self.variables.ingress is False else
+                                         "default" if self.variables.ingress is None else
+                                         self.variables.ingress.digest(ingress=True)
+                          },
+                          provisioner=provisioner("remote-exec", inline=commands)))
+
+    def swarm_update_options(self):
+        options = [("--snapshot-interval", self.variables.raft_snapshot_interval),
+                   ("--max-snapshots", self.variables.raft_keep_old_snapshots),
+                   ("--dispatcher-heartbeat", self.variables.dispatcher_heartbeat),
+                   ("--task-history-limit", self.variables.task_history_limit)]
+        return ["{} {}".format(option, value) for option, value in options if value is not None]
+
+    def create_swarm_settings(self, droplet_manager):
+        """Apply the raft and dispatcher settings from the first manager, again when they change"""
+        options = self.swarm_update_options()
+        if not options:
+            return
+
+        self.add(resource("null_resource", "swarm_settings",
+                          connection=connection(type="ssh",
+                                                host=droplet_manager.ipv4_address,
+                                                user=self.variables.provision_user,
+                                                private_key=function.file(self.variables.provision_ssh_key),
+                                                timeout=self.variables.connection_timeout),
+                          triggers={
+                              "cluster_instance_ids": droplet_manager.id,
+                              "options": " ".join(options)
+                          },
+                          provisioner=provisioner("remote-exec", inline=[
+                              "{} swarm update {}".format(self.variables.docker_cmd, " ".join(options))
+                          ])))
+
     def create_managers(self):
         self.prepare_template()
-        for i in range(self.variables.total_instances):
+        if self.variables.data_path_port is not None:
+            self.o.shared["data_path_port"] = self.variables.data_path_port
+        droplets = []
+        for i in range(self.total_instances):
             droplet_manager = self.node(i+1)
+            droplets.append(droplet_manager)
 
             if i == 0:
                 swarm_tokens = data("external", "swarm_tokens",
-                                    program=["bash", self.curdir + "/scripts/get-swarm-join-tokens.sh"],
+                                    program=["python", os.path.join(self.curdir, "tokens.py")],
                                     query={
                                         "host": droplet_manager.ipv4_address,
                                         "user": self.variables.provision_user,
-                                        "private_key": self.variables.provision_ssh_key
+                                        "private_key": self.variables.provision_ssh_key,
+                                        "manager_id": droplet_manager.id,
+                                        "cache": self.variables.token_cache,
+                                        "ttl": str(self.variables.token_cache_ttl)
                                     })
                 self.o.shared["swarm_tokens"] = swarm_tokens
-                self.o.terrascript.add(swarm_tokens)
+                self.add(swarm_tokens)
 
             prov = list()
             prov.append(provisioner("file",
@@ -114,73 +237,183 @@ class Manager(Node):
                                       "/tmp/provision-manager.sh " + droplet_manager.ipv4_address_private + " " +
                                       function.lookup(self.o.shared["swarm_tokens"].result, "manager", ""),
                                     ]))
-            self.o.terrascript.add(resource("null_resource", "bootstrap",
-                                            connection=connection(type="ssh",
-                                                                  host=droplet_manager.ipv4_address,
-                                                                  user=self.variables.provision_user,
-                                                                  private_key=function.file(self.variables.provision_ssh_key),
-                                                                  timeout=self.variables.connection_timeout),
-                                            triggers={
-                                                "cluster_instance_ids": droplet_manager.id
-                                            },
-                                            provisioner=prov))
-
-
-class ManagerVariables:
+            self.add(resource("null_resource", "bootstrap",
+                              connection=connection(type="ssh",
+                                                    host=droplet_manager.ipv4_address,
+                                                    user=self.variables.provision_user,
+                                                    private_key=function.file(self.variables.provision_ssh_key),
+                                                    timeout=self.variables.connection_timeout),
+                              triggers={
+                                  "cluster_instance_ids": droplet_manager.id
+                              },
+                              provisioner=prov))
+
+        if self.variables.local_dns:
+            self.o.shared["local_dns"] = {
+                "hosts": [droplet.ipv4_address for droplet in droplets],
+                "servers": [droplet.ipv4_address_private for droplet in droplets]
+            }
+        self.create_dns(droplets)
+        self.create_networks(droplets[0])
+        self.create_swarm_settings(droplets[0])
+        self.register_registry_mirror(droplets)
+
+
+def overlay_network(value):
+    """OverlayNetwork of a mapping loaded from a YAML/JSON file"""
+    return OverlayNetwork(**value) if isinstance(value, dict) else value
+
+
+def overlay_networks(value):
+    return [overlay_network(network) for network in value] if isinstance(value, (list, tuple)) else value
+
+
+def ingress_error(value):
+    return "use an OverlayNetwork, False or None" if value is True else None
+
+
+class ManagerVariables(Variables):
     # Timeout for connection to servers"
-    connection_timeout = "2m"
+    connection_timeout = Field("2m", (str,), check=duration)
 
     # Domain name used in droplet hostnames, e.g example.com"
-    domain = ""
+    domain = Field("", (str,))
 
     # A list of SSH IDs or fingerprints to enable in the format [12345, 123456] that are added to manager nodes"
-    ssh_keys = []
+    ssh_keys = Field([], list, items=(str, int))
 
     # File path to SSH private key used to access the provisioned nodes.
     # Ensure this key is listed in the manager and work ssh keys list"
-    provision_ssh_key = "~/.ssh/id_rsa"
+    provision_ssh_key = Field("~/.ssh/id_rsa", (str,))
 
     # User used to log in to the droplets via ssh for issueing Docker commands"
-    provision_user = "root"
+    provision_user = Field("root", (str,))
 
     # Datacenter region in which the cluster will be created"
-    region = "nyc3"
+    region = Field("nyc3", (str,))
 
-    # Total number of managers in cluster"
-    total_instances = 1
+    # Total number of managers in cluster. Must be odd (1, 3, 5 or 7) to keep the raft quorum"
+    total_instances = Field(1, (int,), check=non_negative)
 
     # Droplet image used for the manager nodes"
-    image = "ubuntu-18-04-x64"
+    image = Field("ubuntu-18-04-x64", (str,))
+
+    # Name of a snapshot built with swarm_build_image (Docker pre-installed). When defined the droplets are created
+    # from this snapshot instead of `image` and the default user_data (get_user_data_script) is not used
+    snapshot = Field(None, (str,))
 
     # Droplet size of manager nodes"
-    size = "s-1vcpu-1gb"
+    size = Field("s-1vcpu-1gb", (str,))
 
     # Prefix for name of manager nodes"
-    name = "manager"
+    name = Field("manager", (str,))
 
     # Enable DigitalOcean droplet backups"
-    backups = "false"
+    backups = Field("false", (str, bool))
 
     # User data content for manager nodes"
-    user_data = ""
+    user_data = Field("", (str,))
 
     # Docker command"
-    docker_cmd = "sudo docker"
+    docker_cmd = Field("sudo docker", (str,))
 
     # List of DigitalOcean tag ids"
-    tags = []
+    tags = Field([], list, items=(str,))
 
     # Availability of the node ('active'|'pause'|'drain')"
-    availability = "active"
+    availability = Field("active", (str,), choices=AVAILABILITIES)
 
-    remote_api_ca = None
+    remote_api_ca = Field(None, (str,))
 
-    remote_api_key = None
+    remote_api_key = Field(None, (str,))
 
-    remote_api_certificate = None
+    remote_api_certificate = Field(None, (str,))
 
     # Persistent volume to attach to the Droplets (Array, one volume per droplet)"
-    persistent_volumes = None
+    persistent_volumes = Field(None, list, items=(VolumeClaim,))
 
     # Create the Host entries in the domain specified above
-    create_dns = False
+    create_dns = Field(False, (bool,))
+
+    # TTL of the Digital Ocean DNS records
+    dns_ttl = Field(60, (int,), check=positive)
+
+    # Create one counted record per kind (name, internal name, tag) for the whole group instead of one record per node
+    dns_grouped = Field(False, (bool,))
+
+    # Serve the internal names (<name>-NN-internal.<domain> and <tag>-internal.<domain>, round robin) with a CoreDNS
+    # running on the managers instead of Digital Ocean records. All the node groups created after the managers
+    # resolve <domain> with the managers
+    local_dns = Field(False, (bool,))
+
+    # TTL of the internal names served by the managers
+    local_dns_ttl = Field(30, (int,), check=positive)
+
+    # Resolvers used by the managers for the other names (default: the Digital Ocean resolvers)
+    local_dns_upstreams = Field(["67.207.67.2", "67.207.67.3"], list, items=(str,))
+
+    # Local cache of the swarm join tokens, keyed by the swarm ID. Avoid connecting to the manager on every plan
+    token_cache = Field(".terraform/swarm_tokens.json", (str,))
+
+    # Seconds before the cached tokens are fetched again from the manager. They are also fetched again when the first
+    # manager is replaced or the tokens are rotated
+    token_cache_ttl = Field(3600, (int,), check=positive)
+
+    # Drain the managers when the cluster has more than this number of nodes, so only the workers run tasks and the
+    # raft writes are not slowed down by the workloads (None = never, 0 = always). Checked every minute by a timer in
+    # the managers, so it follows the autoscaler. Below the limit the managers use `availability`
+    drain_above = Field(None, (int,), check=non_negative)
+
+    # Raft log entries between snapshots (docker swarm update --snapshot-interval, Docker default 10000)
+    raft_snapshot_interval = Field(None, (int,), check=positive)
+
+    # Old raft snapshots kept (--max-snapshots, Docker default 0)
+    raft_keep_old_snapshots = Field(None, (int,), check=non_negative)
+
+    # Heartbeat period of the nodes to the managers, e.g. "10s" (--dispatcher-heartbeat, Docker default 5s).
+    # Longer periods reduce the load of the managers in big clusters
+    dispatcher_heartbeat = Field(None, (str,), check=duration)
+
+    # Tasks kept in the history of each service slot (--task-history-limit, Docker default 5)
+    task_history_limit = Field(None, (int,), check=non_negative)
+
+    # Overlay networks (swarm_tf.managers.networks.OverlayNetwork) created by the first manager.
+    # None creates the attachable network "main" with the MTU of the Digital Ocean private network
+    networks = Field(None, list, items=(OverlayNetwork,), convert=overlay_networks)
+
+    # Ingress network (routing mesh). None keeps the Docker default, an OverlayNetwork replaces it (e.g. to set the
+    # MTU) and False removes it, so the services only publish ports in the host mode
+    ingress = Field(None, (OverlayNetwork, bool), convert=overlay_network, check=ingress_error)
+
+    # UDP port of the data path (VXLAN). None uses the Docker default (4789)
+    data_path_port = Field(None, (int,), check=port)
+
+    # Performance profile: a preset name ('web'|'batch'|'stateful') or a swarm_tf.common.profiles.PerformanceProfile
+    # with the Docker daemon, kernel and swap settings applied before the node joins the cluster.
+    # Dry-run: swarm_profile <name>
+    profile = Field(None, (str, PerformanceProfile), check=profile_error)
+
+    # Run a pull-through cache of the Docker Hub on every manager. The worker groups use it as registry mirror
+    registry_mirror = Field(False, (bool,))
+
+    # URLs of the registry mirrors configured in the Docker daemon, e.g. ["http://10.0.0.2:5000"]
+    registry_mirrors = Field(None, list, items=(str,))
+
+    # Images pulled during the provisioning, before the node joins the cluster
+    prepull_images = Field([], list, items=(str,))
+
+    # Images pulled in parallel
+    prepull_parallel = Field(4, (int,), check=positive)
+
+    def errors(self):
+        errors = node_errors(self)
+        if self.total_instances % 2 == 0:
+            # An even number of managers tolerates the same failures as one manager less, with slower raft writes
+            errors.append("The number of managers must be odd to keep the raft quorum (got {})"
+                          .format(self.total_instances))
+        if self.local_dns and not self.domain:
+            errors.append("local_dns needs a domain")
+        names = [network.name for network in self.networks or []]
+        if len(set(names)) != len(names):
+            errors.append("Duplicated overlay networks: {}".format(", ".join(names)))
+        return errors
@@ -0,0 +1,71 @@
+import hashlib
+import ipaddress
+import json
+
+# The Digital Ocean private network has a MTU of 1500. VXLAN adds 50 bytes and the IPsec encryption
+# (encrypted overlay) about 50 more, so the default overlay MTU (1500) fragments every full packet
+DEFAULT_MTU = 1450
+DEFAULT_ENCRYPTED_MTU = 1400
+
+
+class OverlayNetwork:
+    """Overlay network created by the first manager (ManagerVariables.networks, ManagerVariables.ingress).
+
+    `subnet` is the network CIDR (e.g. "10.10.0.0/20", enough for 4k tasks). `encrypted` encrypts the traffic
+    between the nodes (IPsec). Each network has its own VXLAN, so the services only receive the traffic of the
+    networks they are attached to."""
+
+    def __init__(self, name, subnet=None, gateway=None, mtu=None, encrypted=False, attachable=True, labels=None):
+        if subnet is not None:
+            network = ipaddress.ip_network(subnet)
+            if gateway is not None and ipaddress.ip_address(gateway) not in network:
+                raise ValueError("Gateway {} is not in the subnet {}".format(gateway, subnet))
+        elif gateway is not None:
+            raise ValueError("The gateway needs a subnet")
+        self.name = name
+        self.subnet = subnet
+        self.gateway = gateway
+        self.mtu = mtu or (DEFAULT_ENCRYPTED_MTU if encrypted else DEFAULT_MTU)
+        self.encrypted = encrypted
+        self.attachable = attachable
+        self.labels = labels or {}
+
+    def options(self, ingress=False):
+        args = ["--driver overlay", "--opt com.docker.network.driver.mtu={}".format(self.mtu)]
+        if ingress:
+            args.append("--ingress")
+        elif self.attachable:
+            args.append("--attachable")
+        if self.encrypted:
+            args.append("--opt encrypted")
+        if self.subnet is not None:
+            args.append("--subnet {}".format(self.subnet))
+        if self.gateway is not None:
+            args.append("--gateway {}".format(self.gateway))
+        for key, value in sorted(self.labels.items()):
+            args.append("--label {}={}".format(key, value))
+        return args
+
+    def digest(self, ingress=False):
+        name = "ingress" if ingress else self.name
+        return hashlib.sha1(json.dumps([name] + self.options(ingress)).encode()).hexdigest()[:12]
+
+    def commands(self, docker_cmd):
+        """Create the network when it does not exist. The settings of an existing network are not changed"""
+        return ["{0} network inspect {1} > /dev/null 2>&1 || {0} network create {2} {1}"
+                .format(docker_cmd, self.name, " ".join(self.options()))]
+
+    def ingress_commands(self, docker_cmd):
+        """Replace the ingress network (routing mesh) by this one when its settings changed. The network is always
+        named 'ingress'. Fails when services publish ports in the ingress mode"""
+        digest = self.digest(ingress=True)
+        return ["if [ \"$({0} network inspect ingress --format '{{{{index .Labels \"swarm_tf.digest\"}}}}' "
+                "2>/dev/null)\" != \"{1}\" ]; then "
+                "(echo y | {0} network rm ingress > /dev/null 2>&1; sleep 5; "
+                "{0} network create {2} --label swarm_tf.digest={1} ingress); fi"
+                .format(docker_cmd, digest, " ".join(self.options(ingress=True)))]
+
+
+def remove_ingress_commands(docker_cmd):
+    """Remove the ingress network: the services can only publish ports in the host mode"""
+    return ["echo y | {} network rm ingress > /dev/null 2>&1 || true".format(docker_cmd)]
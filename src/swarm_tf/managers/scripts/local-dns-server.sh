@@ -0,0 +1,45 @@
+#!/bin/bash
+
+# CoreDNS serving the internal names of the cluster (${domain}) from /etc/swarm_tf/dns/hosts, in the private network.
+# Each node group uploads its names to /etc/swarm_tf/dns/hosts.d/<group>; the file is reloaded automatically.
+
+${mark}
+
+# Wait until Docker is running correctly
+while [ -z "$(${docker_cmd} info 2>/dev/null | grep CPUs)" ]; do
+  echo Waiting for Docker to start...
+  sleep 2
+done
+
+mark local_dns start
+PRIVATE_ADDR=$(curl -s http://169.254.169.254/metadata/v1/interfaces/private/0/ipv4/address)
+sudo mkdir -p /etc/swarm_tf/dns/hosts.d
+sudo touch /etc/swarm_tf/dns/hosts
+
+cat <<COREFILE | sudo tee /etc/swarm_tf/dns/Corefile > /dev/null
+${domain} {
+  bind $PRIVATE_ADDR
+  hosts /etc/coredns/hosts {
+    ttl ${ttl}
+    reload 5s
+    fallthrough
+  }
+  # The public names of the domain
+  forward . ${upstreams}
+  cache ${ttl}
+  errors
+}
+
+. {
+  bind $PRIVATE_ADDR
+  forward . ${upstreams}
+  cache 30
+  errors
+}
+COREFILE
+
+if [ -z "$(${docker_cmd} ps -a -q -f name=^/swarm_tf_dns$)" ]; then
+  ${docker_cmd} run -d --restart always --name swarm_tf_dns --network host \
+    -v /etc/swarm_tf/dns:/etc/coredns:ro ${image} -conf /etc/coredns/Corefile
+fi
+mark local_dns end
@@ -0,0 +1,49 @@
+#!/bin/bash
+
+# Keep the availability of this manager: drained when the cluster has more than ${drain_above} nodes, so the
+# workloads do not slow down the raft writes. Checked every minute, the cluster size changes with the autoscaler.
+
+cat <<'SCRIPT' | sudo tee /usr/local/bin/swarm-tf-manager-availability > /dev/null
+#!/bin/bash
+
+[ "$(docker info --format '{{.Swarm.ControlAvailable}}' 2>/dev/null)" == "true" ] || exit 0
+
+NODES=$(docker node ls -q | wc -l)
+if [ $NODES -gt ${drain_above} ]; then
+  WANTED=drain
+else
+  WANTED=${availability}
+fi
+
+NODE_ID=$(docker info --format '{{.Swarm.NodeID}}')
+if [ "$(docker node inspect --format '{{.Spec.Availability}}' $NODE_ID)" != "$WANTED" ]; then
+  docker node update --availability $WANTED $NODE_ID
+fi
+SCRIPT
+sudo chmod +x /usr/local/bin/swarm-tf-manager-availability
+
+cat <<'UNIT' | sudo tee /etc/systemd/system/swarm-tf-manager-availability.service > /dev/null
+[Unit]
+Description=Swarm manager availability
+After=docker.service
+
+[Service]
+Type=oneshot
+ExecStart=/usr/local/bin/swarm-tf-manager-availability
+UNIT
+
+cat <<'UNIT' | sudo tee /etc/systemd/system/swarm-tf-manager-availability.timer > /dev/null
+[Unit]
+Description=Swarm manager availability
+
+[Timer]
+OnBootSec=1min
+OnUnitActiveSec=1min
+
+[Install]
+WantedBy=timers.target
+UNIT
+
+sudo systemctl daemon-reload
+sudo systemctl enable swarm-tf-manager-availability.timer
+sudo systemctl start swarm-tf-manager-availability.timer
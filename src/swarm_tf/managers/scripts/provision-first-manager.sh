@@ -2,12 +2,19 @@
 
 MANAGER_PRIVATE_ADDR=$1
 
+${mark}
+
 # Wait until Docker is running correctly
+mark docker_wait start
 while [ -z "$(${docker_cmd} info | grep CPUs)" ]; do
   echo Waiting for Docker to start...
   sleep 2
 done
+mark docker_wait end
+mark_docker_install
 
-${docker_cmd} swarm init --advertise-addr $MANAGER_PRIVATE_ADDR
-
-${docker_cmd} network create -d overlay --attachable main
+# The control plane and the data path (VXLAN) only in the private network
+mark swarm_init start
+${docker_cmd} swarm init --advertise-addr $MANAGER_PRIVATE_ADDR --listen-addr $MANAGER_PRIVATE_ADDR:2377 \
+  --data-path-addr $MANAGER_PRIVATE_ADDR ${data_path_port}
+mark swarm_init end
@@ -3,14 +3,23 @@
 MANAGER_PRIVATE_ADDR=$1
 JOIN_TOKEN=$2
 
+${mark}
+
 # Wait until Docker is running correctly
+mark docker_wait start
 while [ -z "$(${docker_cmd} info | grep CPUs)" ]; do
   echo Waiting for Docker to start...
   sleep 2
 done
+mark docker_wait end
+mark_docker_install
 
 # Check if we are not already joined into a Swarm
 if [ -z "$(${docker_cmd} info | grep 'Swarm: active')" ]; then
   # Join cluster
-  ${docker_cmd} swarm join --token $JOIN_TOKEN $MANAGER_PRIVATE_ADDR:2377;
+  mark swarm_join start
+  PRIVATE_ADDR=$(curl -s http://169.254.169.254/metadata/v1/interfaces/private/0/ipv4/address)
+  ${docker_cmd} swarm join --token $JOIN_TOKEN --advertise-addr $PRIVATE_ADDR --listen-addr $PRIVATE_ADDR:2377 \
+    --data-path-addr $PRIVATE_ADDR $MANAGER_PRIVATE_ADDR:2377;
+  mark swarm_join end
 fi
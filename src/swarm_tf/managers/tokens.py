@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+Swarm join token provider for the terraform "external" data source.
+
+The tokens are fetched from the first manager with a single (multiplexed) SSH connection and cached locally,
+keyed by the swarm ID. The next plans read the cache and do not connect to the manager. The cache entry is
+invalidated when the first manager is replaced (new droplet id), when the TTL expires or when the tokens are
+rotated with:
+
+    python -m swarm_tf.managers.tokens --rotate worker|manager
+
+This file must only use the python standard library, because terraform executes it directly.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+SSH_OPTIONS = [
+    "-o", "IdentitiesOnly=true",
+    "-o", "StrictHostKeyChecking=no",
+    "-o", "UserKnownHostsFile=/dev/null",
+    "-o", "LogLevel=ERROR",
+    "-o", "ControlMaster=auto",
+    "-o", "ControlPath=~/.ssh/swarm_tf-%r@%h:%p",
+    "-o", "ControlPersist=60",
+]
+
+FETCH_COMMAND = "timeout 5 docker info --format '{{.Swarm.Cluster.ID}}' && " \
+                "timeout 5 docker swarm join-token manager -q && " \
+                "timeout 5 docker swarm join-token worker -q"
+
+ROTATE_COMMAND = "timeout 5 docker swarm join-token --rotate -q {}"
+
+DEFAULT_CACHE = ".terraform/swarm_tokens.json"
+
+# Tokens rotated outside swarm_tf are fetched again after this delay at most
+DEFAULT_TTL = 3600
+
+
+class TokenCache:
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self.data = {"hosts": {}, "swarms": {}}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.data = json.load(f)
+
+    def get(self, host, manager_id, ttl=DEFAULT_TTL):
+        entry = self.data["hosts"].get(host)
+        if entry is None or entry["manager_id"] != manager_id:
+            return None
+
+        tokens = self.data["swarms"].get(entry["swarm_id"])
+        if tokens is None or time.time() - tokens["updated"] > ttl:
+            return None
+        return tokens
+
+    def put(self, host, manager_id, swarm_id, manager, worker, user, private_key):
+        self.data["hosts"][host] = {"manager_id": manager_id, "swarm_id": swarm_id,
+                                    "user": user, "private_key": private_key}
+        self.data["swarms"][swarm_id] = {"manager": manager, "worker": worker, "updated": time.time()}
+        return self.data["swarms"][swarm_id]
+
+    def invalidate(self, host=None):
+        if host is None:
+            self.data = {"hosts": {}, "swarms": {}}
+        elif host in self.data["hosts"]:
+            del self.data["hosts"][host]
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.data, f, indent=2)
+        os.chmod(tmp, 0o600)
+        os.replace(tmp, self.path)
+
+
+def ssh(host, user, private_key, command):
+    cmd = ["ssh"] + SSH_OPTIONS + ["-i", os.path.expanduser(private_key), "{}@{}".format(user, host), command]
+    return subprocess.check_output(cmd, universal_newlines=True).split()
+
+
+def fetch(host, user, private_key):
+    """Return (swarm_id, manager_token, worker_token) using one SSH session"""
+    result = ssh(host, user, private_key, FETCH_COMMAND)
+    if len(result) != 3:
+        raise RuntimeError("Unexpected answer from {}: {}".format(host, " ".join(result)))
+    return result
+
+
+def get_tokens(query):
+    cache = TokenCache(query.get("cache") or DEFAULT_CACHE)
+    host = query["host"]
+    manager_id = query.get("manager_id", "")
+
+    tokens = cache.get(host, manager_id, int(query.get("ttl") or DEFAULT_TTL))
+    if tokens is None:
+        swarm_id, manager, worker = fetch(host, query["user"], query["private_key"])
+        tokens = cache.put(host, manager_id, swarm_id, manager, worker, query["user"], query["private_key"])
+        cache.save()
+
+    return {"manager": tokens["manager"], "worker": tokens["worker"]}
+
+
+def rotate(cache_path, role):
+    """Rotate the token of the role on every cached swarm and refresh the cache"""
+    cache = TokenCache(cache_path)
+    for host, entry in list(cache.data["hosts"].items()):
+        ssh(host, entry["user"], entry["private_key"], ROTATE_COMMAND.format(role))
+        swarm_id, manager, worker = fetch(host, entry["user"], entry["private_key"])
+        cache.put(host, entry["manager_id"], swarm_id, manager, worker, entry["user"], entry["private_key"])
+    cache.save()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Swarm join tokens with local cache")
+    parser.add_argument("--cache", default=DEFAULT_CACHE, help="Path of the cache file")
+    parser.add_argument("--rotate", choices=["worker", "manager"], help="Rotate the join token of the role")
+    parser.add_argument("--invalidate", action="store_true", help="Remove all the cached tokens")
+    args = parser.parse_args()
+
+    if args.rotate:
+        rotate(args.cache, args.rotate)
+    elif args.invalidate:
+        cache = TokenCache(args.cache)
+        cache.invalidate()
+        cache.save()
+    else:
+        # Called by the terraform external data source: the query is a JSON object in the stdin
+        json.dump(get_tokens(json.load(sys.stdin)), sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from terraobject import Terraobject
+from terrascript import output, terraform, backend
+from terrascript.terraform.d import terraform_remote_state
+
+from swarm_tf.common.synth import synthesize, run_terraform, write_atomic
+
+TOPOLOGY = os.path.join(".swarm_tf", "topology.json")
+
+
+class Topology:
+    """Split a cluster in several terraform root modules (e.g. one per region or per node group).
+
+    Each module has its own Terraobject and state, so a change in one region only plans that region. The outputs
+    of a module are read by the other modules through the terraform_remote_state data source, and the terrascript
+    wrapper runs terraform on the modules in parallel, respecting these dependencies."""
+
+    def __init__(self, directory="regions", backend_name="local", backend_config=None):
+        """`backend_config` values can use the "{module}" placeholder, e.g. {"key": "swarm/{module}.tfstate"}.
+        The default local backend keeps the state in each module folder"""
+        self.directory = directory
+        self.backend_name = backend_name
+        self.backend_config = backend_config or {}
+        self.modules = {}
+        self.dependencies = {}
+
+    def module(self, name):
+        """Return the Terraobject of the module, creating it on the first call"""
+        if name not in self.modules:
+            o = Terraobject()
+            o.shared["__module"] = name
+            if self.backend_name != "local":
+                o.terrascript.add(terraform(backend=backend(self.backend_name, **self.get_backend_config(name))))
+            self.modules[name] = o
+            self.dependencies[name] = set()
+        return self.modules[name]
+
+    def get_backend_config(self, name):
+        if self.backend_name == "local" and not self.backend_config:
+            return {"path": os.path.join("..", name, "terraform.tfstate")}
+        return {key: value.format(module=name) if isinstance(value, str) else value
+                for key, value in self.backend_config.items()}
+
+    def export(self, o, name, value, sensitive=None):
+        """Create an output in the module `o` that can be read by the other modules"""
+        o.terrascript.add(output(name, value=value, sensitive=sensitive))
+
+    def remote_output(self, o, module, name):
+        """Reference to the output `name` of another module. The module `o` will be planned/applied after it"""
+        current = o.shared["__module"]
+        if module == current:
+            raise ValueError("The module '{}' can not read its own outputs".format(module))
+        if module not in self.modules:
+            raise ValueError("The module '{}' does not exist".format(module))
+
+        self.dependencies[current].add(module)
+        key = "remote_state:" + module
+        if key not in o.shared:
+            state = terraform_remote_state(module,
+                                           backend=self.backend_name,
+                                           config=self.get_backend_config(module))
+            o.terrascript.add(state)
+            o.shared[key] = state
+        return "${{data.terraform_remote_state.{}.{}}}".format(module, name)
+
+    def check_cycles(self):
+        visiting = set()
+        done = set()
+
+        def visit(name, path):
+            if name in done:
+                return
+            if name in visiting:
+                raise ValueError("Circular dependency between the modules: " + " -> ".join(path + [name]))
+            visiting.add(name)
+            for dependency in self.dependencies[name]:
+                visit(dependency, path + [name])
+            visiting.remove(name)
+            done.add(name)
+
+        for module in self.modules:
+            visit(module, [])
+
+    def synthesize(self):
+        """Write all the modules in one pass. Return the changed sections per module"""
+        self.check_cycles()
+        changed = {}
+        for name, o in self.modules.items():
+            changed[name] = synthesize(o, os.path.join(self.directory, name))
+
+        write_atomic(TOPOLOGY, json.dumps({
+            "modules": {
+                name: {
+                    "path": os.path.join(self.directory, name),
+                    "depends_on": sorted(self.dependencies[name])
+                } for name in self.modules
+            }
+        }, indent=2, sort_keys=True))
+        return changed
+
+
+def load_topology(path=TOPOLOGY):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)["modules"]
+
+
+def run_modules(modules, args, parallel=4, env=None):
+    """Run terraform on all the modules with at most `parallel` at the same time. A module only starts after the
+    modules it depends on finished successfully (dependencies are reversed for destroy). Return the exit code"""
+    if args[0] == "destroy":
+        dependencies = {name: set() for name in modules}
+        for name, module in modules.items():
+            for dependency in module["depends_on"]:
+                dependencies[dependency].add(name)
+    else:
+        dependencies = {name: set(module["depends_on"]) for name, module in modules.items()}
+
+    pending = set(modules)
+    succeeded = set()
+    failed = set()
+    running = {}
+    with ThreadPoolExecutor(max_workers=parallel) as executor:
+        while pending or running:
+            for name in sorted(pending):
+                if dependencies[name] & failed:
+                    print("[{}] Skipped: a module it depends on failed".format(name))
+                    pending.remove(name)
+                    failed.add(name)
+                elif dependencies[name] <= succeeded:
+                    pending.remove(name)
+                    future = executor.submit(run_terraform, args, modules[name]["path"], "[{}] ".format(name), env)
+                    running[future] = name
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                if future.result() == 0:
+                    succeeded.add(name)
+                else:
+                    failed.add(name)
+
+    if failed:
+        print("Failed modules: {}".format(", ".join(sorted(failed))))
+        return 1
+    return 0
@@ -1,8 +1,12 @@
 import os
 from terrascript.template.d import *
-from terrascript import connection, function, provisioner, output
+from terrascript import connection, function, provisioner, resource
 
-from swarm_tf.common import Node
+from swarm_tf.common import Node, DropletGroup, VolumeClaim, mark_script
+from swarm_tf.common.profiles import PerformanceProfile
+from swarm_tf.common.variables import Variables, Field, AVAILABILITIES, duration, non_negative, node_errors, \
+    positive, profile_error
+from swarm_tf.workers.autoscaler import read_scale
 
 
 class Worker(Node):
@@ -13,6 +17,11 @@ class Worker(Node):
         if not("worker_nodes" in o.shared):
             self.o.shared["worker_nodes"] = []
 
+    def get_total_instances(self):
+        if self.variables.autoscale:
+            return read_scale(self.variables.name, self.variables.total_instances)
+        return self.variables.total_instances
+
     def prepare_template(self):
         if "join_cluster_as_worker" in self.o.shared:
             return
@@ -21,26 +30,103 @@ class Worker(Node):
                              template=function.file(os.path.join(self.curdir, "scripts", "join.sh")),
                              vars={
                                   "docker_cmd": self.variables.docker_cmd,
+                                  "mark": mark_script(),
                                   "availability": self.variables.availability,
-                                  "manager_private_ip": self.variables.manager_private_ip
+                                  "manager_private_ip": self.variables.manager_private_ip,
+                                  "join_token": self.variables.join_token
                              })
         self.o.shared["join_cluster_as_worker"] = tmpl
-        self.o.terrascript.add(tmpl)
+        self.add(tmpl)
+
+    def is_cloud_init(self):
+        if self.variables.bootstrap not in ["ssh", "cloud-init"]:
+            raise ValueError("Invalid bootstrap '{}'. Use 'ssh' or 'cloud-init'".format(self.variables.bootstrap))
+        return self.variables.bootstrap == "cloud-init"
+
+    def cloud_init_parts(self):
+        return super().cloud_init_parts() + [{
+            "filename": "50-join-cluster-as-worker.sh",
+            "content_type": "text/x-shellscript",
+            "content": self.o.shared["join_cluster_as_worker"].rendered
+        }]
+
+    def create_readiness_gate(self, droplets):
+        host = self.variables.gate_host
+        if host is None:
+            if not self.o.shared.get("manager_nodes"):
+                raise ValueError("The cloud-init bootstrap of '{}' needs a manager for its readiness gate: create the "
+                                 "managers first or set gate_host".format(self.variables.name))
+            host = self.o.shared["manager_nodes"][0].ipv4_address
+
+        tmpl = template_file("wait_for_{}".format(self.variables.name),
+                             template=function.file(os.path.join(self.curdir, "scripts", "wait-for-workers.sh")),
+                             vars={
+                                 "docker_cmd": self.variables.docker_cmd,
+                                 "name": self.variables.name,
+                                 "total_instances": self.total_instances,
+                                 "timeout": self.variables.bootstrap_timeout
+                             })
+        self.add(tmpl)
 
-    def node(self, number):
-        conn = connection(type="ssh",
-                          user=self.variables.provision_user,
-                          private_key=function.file(self.variables.provision_ssh_key),
-                          timeout=self.variables.connection_timeout)
         prov = list()
         prov.append(provisioner("file",
-                                content=self.o.shared["join_cluster_as_worker"].rendered,
-                                destination="/tmp/join_cluster_as_worker.sh"))
-
+                                content=tmpl.rendered,
+                                destination="/tmp/wait_for_{}.sh".format(self.variables.name)))
         prov.append(provisioner("remote-exec",
                                 inline=[
-                                  "chmod +x /tmp/join_cluster_as_worker.sh",
-                                  "/tmp/join_cluster_as_worker.sh {}".format(self.variables.join_token)]))
+                                    "chmod +x /tmp/wait_for_{}.sh".format(self.variables.name),
+                                    "/tmp/wait_for_{}.sh".format(self.variables.name)]))
+
+        gate = resource("null_resource", "{}_ready".format(self.variables.name),
+                        connection=connection(type="ssh",
+                                              host=host,
+                                              user=self.variables.provision_user,
+                                              private_key=function.file(self.variables.provision_ssh_key),
+                                              timeout=self.variables.connection_timeout),
+                        triggers={
+                            "cluster_instance_ids": ",".join([droplet.join_ids() if isinstance(droplet, DropletGroup)
+                                                              else droplet.id for droplet in droplets])
+                        },
+                        provisioner=prov)
+        self.o.shared[self.variables.name + "_ready"] = gate
+        self.add(gate)
+
+    def get_connection(self):
+        return connection(type="ssh",
+                          user=self.variables.provision_user,
+                          private_key=function.file(self.variables.provision_ssh_key),
+                          timeout=self.variables.connection_timeout)
+
+    def provisioners(self):
+        prov = list()
+        if not self.is_cloud_init():
+            prov += self.bootstrap_provisioners()
+            prov.append(provisioner("file",
+                                    content=self.o.shared["join_cluster_as_worker"].rendered,
+                                    destination="/tmp/join_cluster_as_worker.sh"))
+
+            prov.append(provisioner("remote-exec",
+                                    inline=[
+                                      "chmod +x /tmp/join_cluster_as_worker.sh",
+                                      "/tmp/join_cluster_as_worker.sh {}".format(self.variables.join_token)]))
+
+        if self.o.shared.get("manager_nodes"):
+            # Drain the node from the first manager before it leaves: its tasks move to the other nodes first
+            prov.append(provisioner("remote-exec",
+                                    when="destroy",
+                                    connection=connection(type="ssh",
+                                                          host=self.o.shared["manager_nodes"][0].ipv4_address,
+                                                          user=self.variables.provision_user,
+                                                          private_key=function.file(self.variables.provision_ssh_key),
+                                                          timeout=self.variables.connection_timeout),
+                                    inline=[
+                                      "{} node update --availability drain ${{self.name}}".format(
+                                          self.variables.docker_cmd),
+                                      "timeout {} sh -c 'while [ -n \"$({} node ps -q -f desired-state=running "
+                                      "${{self.name}})\" ]; do sleep 2; done'".format(self.variables.drain_timeout,
+                                                                                     self.variables.docker_cmd)
+                                    ],
+                                    on_failure="continue"))
 
         prov.append(provisioner("remote-exec",
                                 when="destroy",
@@ -48,72 +134,151 @@ class Worker(Node):
                                   "docker swarm leave",
                                 ],
                                 on_failure="continue"))
+        return prov
 
-        return self.create_droplet(droplet_type="worker", number=number, conn=conn, prov=prov)
+    def node(self, number):
+        return self.create_droplet(droplet_type="worker", number=number, conn=self.get_connection(),
+                                   prov=self.provisioners(), cloud_init=self.is_cloud_init())
+
+    def node_group(self):
+        return self.create_droplet_group(droplet_type="worker", conn=self.get_connection(), prov=self.provisioners(),
+                                         cloud_init=self.is_cloud_init())
 
     def create_workers(self):
         self.prepare_template()
-        for i in range(0, self.variables.total_instances):
-            self.node(i+1)
+        if self.variables.fleet:
+            droplets = [self.node_group()]
+        else:
+            droplets = [self.node(i+1) for i in range(0, self.total_instances)]
 
+        if self.is_cloud_init():
+            self.create_readiness_gate(droplets)
+        self.create_dns(droplets)
+        self.register_registry_mirror(droplets)
 
-class WorkerVariables:
+
+class WorkerVariables(Variables):
 
     # Timeout for connection to servers
-    connection_timeout = "2m"
+    connection_timeout = Field("2m", (str,), check=duration)
 
     # "Domain name used in droplet hostnames, e.g example.com"
-    domain = None
+    domain = Field(None, (str,))
 
     # Join token for the nodes"
-    join_token = None
+    join_token = Field(None, (str,))
 
     # Private ip adress of a manager node, used to have a node join the existing cluster
-    manager_private_ip = None
+    manager_private_ip = Field(None, (str,))
 
     # A list of SSH IDs or fingerprints to enable in the format [12345, 123456] that are added to worker nodes"
-    ssh_keys = []
+    ssh_keys = Field([], list, items=(str, int))
 
     # File path to SSH private key used to access the provisioned nodes. Ensure this key is listed in the manager
     # and work ssh keys list"
-    provision_ssh_key = "~/.ssh/id_rsa"
+    provision_ssh_key = Field("~/.ssh/id_rsa", (str,))
 
     # User used to log in to the droplets via ssh for issueing Docker commands"
-    provision_user = "root"
+    provision_user = Field("root", (str,))
 
     # Datacenter region in which the cluster will be created"
-    region = "nyc3"
+    region = Field("nyc3", (str,))
 
     # Total number of instances of this type in cluster"
-    total_instances = 1
+    total_instances = Field(1, (int,), check=non_negative)
 
     # Operating system for the worker nodes"
-    image = "ubuntu-18-04-x64"
+    image = Field("ubuntu-18-04-x64", (str,))
+
+    # Name of a snapshot built with swarm_build_image (Docker pre-installed). When defined the droplets are created
+    # from this snapshot instead of `image` and the default user_data (get_user_data_script) is not used
+    snapshot = Field(None, (str,))
 
     # Droplet size of worker nodes
-    size = "s-1vcpu-1gb"
+    size = Field("s-1vcpu-1gb", (str,))
 
     # Enable backups of the worker nodes"
-    backups = "false"
+    backups = Field("false", (str, bool))
 
     # Prefix for name of worker nodes"
-    name = "worker"
+    name = Field("worker", (str,))
 
     # "User data content for worker nodes. Use this for installing a configuration management tool, such as
     # Puppet or installing Docker"
-    user_data = ""
+    user_data = Field("", (str,))
 
     # Docker command
-    docker_cmd = "sudo docker"
+    docker_cmd = Field("sudo docker", (str,))
 
     # List of DigitalOcean tag ids
-    tags = []
+    tags = Field([], list, items=(str,))
 
     # Availability of the node ('active'|'pause'|'drain')"
-    availability = "active"
+    availability = Field("active", (str,), choices=AVAILABILITIES)
 
     # Persistent volume to attach to the Droplets (Array, one volume per droplet)"
-    persistent_volumes = None
+    persistent_volumes = Field(None, list, items=(VolumeClaim,))
 
     # Create the Host entries in the domain specified above
-    create_dns = False
+    create_dns = Field(False, (bool,))
+
+    # TTL of the Digital Ocean DNS records
+    dns_ttl = Field(60, (int,), check=positive)
+
+    # Create one counted record per kind (name, internal name, tag) for the whole group instead of one record per node
+    dns_grouped = Field(False, (bool,))
+
+    # Create all the instances as one counted droplet resource instead of one resource per droplet.
+    # The outputs and DNS entries are created per group and the node list in o.shared["worker_nodes"]
+    # receives lists (splat expressions) instead of single values
+    fleet = Field(False, (bool,))
+
+    # How the nodes join the cluster ('ssh'|'cloud-init'). With 'ssh' the join and volume scripts are uploaded
+    # and executed by terraform provisioners, one node at time. With 'cloud-init' the scripts are delivered in the
+    # user_data and the nodes configure themselves at the first boot. A readiness gate running on the first manager
+    # ("<name>_ready" null_resource) waits until all the nodes joined the cluster. The user_data changes are ignored
+    # (lifecycle ignore_changes): a new join token or manager address only applies to the new nodes
+    bootstrap = Field("ssh", (str,), choices=["ssh", "cloud-init"])
+
+    # Public address of the manager running the readiness gate of the cloud-init bootstrap (default: the first
+    # manager of the Terraobject, e.g. set it in a Topology module without managers)
+    gate_host = Field(None, (str,))
+
+    # Seconds the readiness gate waits for the nodes to join the cluster
+    bootstrap_timeout = Field(600, (int,), check=positive)
+
+    # Seconds a destroyed node waits for its tasks to leave after being drained from the first manager
+    drain_timeout = Field(300, (int,), check=positive)
+
+    # Performance profile: a preset name ('web'|'batch'|'stateful') or a swarm_tf.common.profiles.PerformanceProfile
+    # with the Docker daemon, kernel and swap settings applied before the node joins the cluster.
+    # Dry-run: swarm_profile <name>
+    profile = Field(None, (str, PerformanceProfile), check=profile_error)
+
+    # Run a pull-through cache of the Docker Hub on every node of the group. The node groups created next use it
+    # as registry mirror (e.g. a small dedicated group with availability 'drain')
+    registry_mirror = Field(False, (bool,))
+
+    # URLs of the registry mirrors configured in the Docker daemon, e.g. ["http://10.0.0.2:5000"]. None uses the
+    # mirrors of the node groups created before with registry_mirror = True
+    registry_mirrors = Field(None, list, items=(str,))
+
+    # Images pulled during the provisioning, before the node joins the cluster, e.g. ["nginx:1.15", "redis:5"]
+    prepull_images = Field([], list, items=(str,))
+
+    # Images pulled in parallel
+    prepull_parallel = Field(4, (int,), check=positive)
+
+    # Use the number of instances decided by the autoscaler (swarm_autoscale) when available.
+    # total_instances is the initial size of the group
+    autoscale = Field(False, (bool,))
+
+    def errors(self):
+        errors = node_errors(self)
+        # Without them the join script fails on the droplets, after the droplets are created
+        if not self.join_token:
+            errors.append("join_token is required, e.g. function.lookup(o.shared[\"swarm_tokens\"].result, "
+                          "\"worker\", \"\")")
+        if not self.manager_private_ip:
+            errors.append("manager_private_ip is required, e.g. o.shared[\"manager_nodes\"][0].ipv4_address_private")
+        return errors
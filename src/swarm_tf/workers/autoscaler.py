@@ -0,0 +1,193 @@
+import json
+import math
+import os
+import re
+import subprocess
+import time
+
+from swarm_tf.common.docker_api import DockerApiError, group_node_number, is_group_node
+from swarm_tf.common.synth import section_targets, write_atomic
+
+SCALE_FILE = os.path.join(".swarm_tf", "scale.json")
+
+
+def read_scale(group, default, path=SCALE_FILE):
+    """Number of instances of the group decided by the autoscaler, or `default`"""
+    if not os.path.exists(path):
+        return default
+    with open(path) as f:
+        return json.load(f).get("groups", {}).get(group, {}).get("instances", default)
+
+
+def constraint_matches(node, constraint):
+    """True if the swarm node satisfies the placement constraint (e.g. "node.labels.type == web"). The constraints
+    on attributes not known here are considered satisfied"""
+    match = re.match(r"^\s*([\w.-]+)\s*(==|!=)\s*(.*?)\s*$", constraint)
+    if match is None:
+        return True
+    key, operator, expected = match.groups()
+    spec = node.get("Spec", {})
+    description = node.get("Description", {})
+    attributes = {
+        "node.id": node.get("ID"),
+        "node.hostname": description.get("Hostname"),
+        "node.role": spec.get("Role"),
+        "node.platform.os": description.get("Platform", {}).get("OS"),
+        "node.platform.arch": description.get("Platform", {}).get("Architecture")
+    }
+    if key.startswith("node.labels."):
+        value = (spec.get("Labels") or {}).get(key[len("node.labels."):])
+    elif key.startswith("engine.labels."):
+        value = (description.get("Engine", {}).get("Labels") or {}).get(key[len("engine.labels."):])
+    elif key in attributes:
+        value = attributes[key]
+    else:
+        return True
+    # Swarm compares the values ignoring the case
+    return ((value or "").lower() == expected.lower()) == (operator == "==")
+
+
+class AutoscalePolicy:
+    def __init__(self, min_instances=1, max_instances=10, scale_up_threshold=0.75, scale_down_threshold=0.35,
+                 cooldown_up=300, cooldown_down=900):
+        if min_instances < 1 or max_instances < min_instances:
+            raise ValueError("Invalid instance limits: min {} max {}".format(min_instances, max_instances))
+        if not 0 < scale_down_threshold < scale_up_threshold <= 1:
+            raise ValueError("The thresholds must be 0 < scale_down_threshold < scale_up_threshold <= 1")
+        self.min_instances = min_instances
+        self.max_instances = max_instances
+        self.scale_up_threshold = scale_up_threshold
+        self.scale_down_threshold = scale_down_threshold
+        self.cooldown_up = cooldown_up
+        self.cooldown_down = cooldown_down
+
+    @property
+    def target_utilization(self):
+        return (self.scale_up_threshold + self.scale_down_threshold) / 2
+
+    def desired(self, current, metrics):
+        """Target number of instances. Between the thresholds (hysteresis band) the size does not change"""
+        utilization = metrics["utilization"]
+        desired = current
+        if metrics["pending_tasks"] > 0 or utilization > self.scale_up_threshold:
+            desired = max(current + 1, math.ceil(current * utilization / self.target_utilization))
+        elif utilization < self.scale_down_threshold:
+            # Scale down one node at time: the load moves to the remaining nodes
+            desired = current - 1
+        return min(self.max_instances, max(self.min_instances, desired))
+
+
+class Autoscaler:
+    """Compute the size of a worker group from the swarm load and apply only the configuration of the group.
+
+    The load is read from the manager Docker API: the CPU and memory reserved by the running tasks on the nodes of
+    the group compared to the capacity of these nodes, and the tasks waiting (pending) for a node."""
+
+    def __init__(self, client, group, policy, state_path=SCALE_FILE):
+        self.client = client
+        self.group = group
+        self.policy = policy
+        self.state_path = state_path
+
+    def load_state(self):
+        if not os.path.exists(self.state_path):
+            return {"groups": {}}
+        with open(self.state_path) as f:
+            return json.load(f)
+
+    def group_nodes(self):
+        return [node for node in self.client.nodes() if is_group_node(node, self.group)]
+
+    def is_pending_for_group(self, task, nodes):
+        """True if a node of the group could run the pending task (its placement constraints match a node of the
+        group). The tasks waiting for another group do not scale this one"""
+        constraints = task["Spec"].get("Placement", {}).get("Constraints") or []
+        return not nodes or any([all([constraint_matches(node, constraint) for constraint in constraints])
+                                 for node in nodes])
+
+    def metrics(self):
+        group_nodes = self.group_nodes()
+        nodes = [node for node in group_nodes
+                 if node["Status"]["State"] == "ready" and node["Spec"]["Availability"] == "active"]
+        node_ids = set([node["ID"] for node in nodes])
+
+        cpu_total = sum([node["Description"]["Resources"]["NanoCPUs"] for node in nodes])
+        memory_total = sum([node["Description"]["Resources"]["MemoryBytes"] for node in nodes])
+        cpu_reserved = memory_reserved = pending = 0
+        for task in self.client.tasks({"desired-state": ["running"]}):
+            if task["Status"]["State"] == "pending":
+                if self.is_pending_for_group(task, group_nodes):
+                    pending += 1
+            elif task.get("NodeID") in node_ids:
+                reservations = task["Spec"].get("Resources", {}).get("Reservations", {})
+                cpu_reserved += reservations.get("NanoCPUs", 0)
+                memory_reserved += reservations.get("MemoryBytes", 0)
+
+        return {
+            "nodes": len(nodes),
+            "cpu": cpu_reserved / cpu_total if cpu_total else 0,
+            "memory": memory_reserved / memory_total if memory_total else 0,
+            "utilization": max(cpu_reserved / cpu_total if cpu_total else 0,
+                               memory_reserved / memory_total if memory_total else 0),
+            "pending_tasks": pending
+        }
+
+    def evaluate(self, now=None):
+        """Return (current, desired, metrics, reason). The current size is the last size applied by the
+        autoscaler or, if the group was never scaled, the number of active nodes of the group"""
+        now = time.time() if now is None else now
+        metrics = self.metrics()
+        current = read_scale(self.group, metrics["nodes"], self.state_path)
+        desired = self.policy.desired(current, metrics)
+        last = self.load_state()["groups"].get(self.group, {}).get("updated", 0)
+
+        if desired > current and now - last < self.policy.cooldown_up:
+            return current, current, metrics, "scale up in cooldown"
+        if desired < current and now - last < self.policy.cooldown_down:
+            return current, current, metrics, "scale down in cooldown"
+        if desired == current:
+            return current, current, metrics, "no change"
+        return current, desired, metrics, "scale from {} to {}".format(current, desired)
+
+    def save(self, instances, now=None):
+        state = self.load_state()
+        state["groups"][self.group] = {"instances": instances, "updated": time.time() if now is None else now}
+        write_atomic(self.state_path, json.dumps(state, indent=2, sort_keys=True))
+
+    def drain(self, instances, timeout=600, poll=5):
+        """Drain the nodes removed by a scale down to `instances` (the last ones of the group) and wait for their
+        tasks to be rescheduled on the other nodes. Return the drained nodes"""
+        nodes = [node for node in self.group_nodes() if group_node_number(node, self.group) > instances]
+        for node in nodes:
+            if node["Spec"]["Availability"] != "drain":
+                self.client.set_availability(node["ID"], "drain")
+
+        start = time.time()
+        node_ids = [node["ID"] for node in nodes]
+        while node_ids and [task for task in self.client.tasks({"node": node_ids, "desired-state": ["running"]})
+                            if task["Status"]["State"] == "running"]:
+            if time.time() - start > timeout:
+                raise RuntimeError("Timeout waiting for the tasks to leave the drained nodes")
+            time.sleep(poll)
+        return nodes
+
+    def apply(self, instances):
+        """Save the new size, regenerate the configuration and apply only the resources of the group. The nodes
+        removed by a scale down are drained before their droplets are destroyed"""
+        drained = self.drain(instances)
+        previous = section_targets(self.group)
+        self.save(instances)
+        subprocess.check_call(["python", "main.py"])
+        args = ["terraform", "apply", "-auto-approve"]
+        args += ["-target={}".format(target) for target in sorted(previous | section_targets(self.group))]
+        returncode = subprocess.call(args)
+        for node in drained:
+            try:
+                if returncode == 0:
+                    self.client.remove_node(node["ID"])
+                elif node["Spec"]["Availability"] != "drain":
+                    self.client.set_availability(node["ID"], "active")
+            except DockerApiError:
+                # The node already left the swarm
+                pass
+        return returncode
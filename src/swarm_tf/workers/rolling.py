@@ -0,0 +1,139 @@
+import math
+import subprocess
+import time
+
+from swarm_tf.common.docker_api import is_group_node
+from swarm_tf.common.synth import section_targets
+
+
+class RollingUpdate:
+    """Replace the droplets of a worker group in batches, draining the nodes before destroying them.
+
+    For each batch: drain the nodes and wait for their tasks to be rescheduled, replace the droplets with terraform,
+    remove the old nodes from the swarm and wait for the new ones to join. The next batch only starts when every
+    replicated service runs at least `min_capacity` of its replicas. A batch is reduced so that at most
+    `max_unavailable` nodes of the group are down or drained at the same time, counting the nodes already
+    unavailable before the update."""
+
+    def __init__(self, client, group, batch_size=1, max_unavailable=1, min_capacity=0.8, fleet=False,
+                 timeout=900, poll=5):
+        if batch_size < 1 or max_unavailable < 1:
+            raise ValueError("batch_size and max_unavailable must be at least 1")
+        if not 0 <= min_capacity <= 1:
+            raise ValueError("min_capacity must be between 0 and 1")
+        self.client = client
+        self.group = group
+        self.batch_size = batch_size
+        self.max_unavailable = max_unavailable
+        self.min_capacity = min_capacity
+        self.fleet = fleet
+        self.timeout = timeout
+        self.poll = poll
+
+    def log(self, message):
+        print("[{}] {}".format(self.group, message), flush=True)
+
+    def wait(self, description, condition):
+        start = time.time()
+        while not condition():
+            if time.time() - start > self.timeout:
+                raise RuntimeError("Timeout waiting for " + description)
+            time.sleep(self.poll)
+
+    def group_nodes(self):
+        nodes = [node for node in self.client.nodes() if is_group_node(node, self.group)]
+        return sorted(nodes, key=lambda node: node["Description"]["Hostname"])
+
+    def node_number(self, node):
+        return int(node["Description"]["Hostname"][len(self.group) + 1:].split(".")[0])
+
+    def address(self, node):
+        """Terraform address of the droplet of the node, as (taint address, target address)"""
+        number = self.node_number(node)
+        if self.fleet:
+            return ("digitalocean_droplet.{}.{}".format(self.group, number - 1),
+                    "digitalocean_droplet.{}[{}]".format(self.group, number - 1))
+        address = "digitalocean_droplet.{}_{:02d}".format(self.group, number)
+        return address, address
+
+    def running_tasks(self, node_id):
+        return [task for task in self.client.tasks({"node": [node_id], "desired-state": ["running"]})
+                if task["Status"]["State"] == "running"]
+
+    def has_capacity(self):
+        """True if every replicated service runs at least min_capacity of its replicas"""
+        running = {}
+        for task in self.client.tasks({"desired-state": ["running"]}):
+            if task["Status"]["State"] == "running":
+                running[task["ServiceID"]] = running.get(task["ServiceID"], 0) + 1
+
+        for service in self.client.services():
+            replicated = service["Spec"].get("Mode", {}).get("Replicated")
+            if replicated is None:
+                continue
+            if running.get(service["ID"], 0) < math.ceil(replicated.get("Replicas", 0) * self.min_capacity):
+                return False
+        return True
+
+    def next_batch(self, pending):
+        """The next nodes to replace: at most batch_size of the pending ones, taking the active nodes down only while
+        fewer than max_unavailable nodes of the group are down or drained (the unavailable ones do not count twice)"""
+        unavailable = set([node["ID"] for node in self.group_nodes()
+                           if node["Status"]["State"] != "ready" or node["Spec"]["Availability"] != "active"])
+        budget = self.max_unavailable - len(unavailable)
+        batch = []
+        for node in pending:
+            if len(batch) == self.batch_size:
+                break
+            if node["ID"] in unavailable:
+                batch.append(node)
+            elif budget > 0:
+                batch.append(node)
+                budget -= 1
+        return batch
+
+    def is_ready(self, hostname, old_ids):
+        return any([node["Description"]["Hostname"] == hostname and node["ID"] not in old_ids and
+                    node["Status"]["State"] == "ready" for node in self.client.nodes()])
+
+    def replace(self, addresses):
+        for taint, _ in addresses:
+            subprocess.check_call(["terraform", "taint", taint])
+        subprocess.check_call(["terraform", "apply", "-auto-approve"] +
+                              ["-target={}".format(target) for _, target in addresses])
+
+    def run(self):
+        nodes = self.group_nodes()
+        if not nodes:
+            raise RuntimeError("No nodes of the group '{}' found in the swarm".format(self.group))
+
+        old_ids = set([node["ID"] for node in nodes])
+        self.wait("the services capacity before the update", self.has_capacity)
+        pending = list(nodes)
+        while pending:
+            self.wait("fewer than {} unavailable nodes".format(self.max_unavailable),
+                      lambda: self.next_batch(pending))
+            batch = self.next_batch(pending)
+            pending = [node for node in pending if node not in batch]
+            hostnames = [node["Description"]["Hostname"] for node in batch]
+            self.log("Updating {}".format(", ".join(hostnames)))
+
+            for node in batch:
+                self.client.set_availability(node["ID"], "drain")
+            self.wait("the tasks to leave the drained nodes",
+                      lambda: all([not self.running_tasks(node["ID"]) for node in batch]))
+            self.wait("the tasks to be rescheduled", self.has_capacity)
+
+            self.replace([self.address(node) for node in batch])
+
+            for node in batch:
+                self.client.remove_node(node["ID"])
+            for hostname in hostnames:
+                self.wait("{} to join the swarm".format(hostname), lambda: self.is_ready(hostname, old_ids))
+            self.wait("the services capacity after the update", self.has_capacity)
+
+        # Update the resources depending on the new droplets (e.g. DNS entries)
+        args = ["terraform", "apply", "-auto-approve"]
+        args += ["-target={}".format(target) for target in sorted(section_targets(self.group))]
+        subprocess.check_call(args)
+        self.log("Rolling update finished")
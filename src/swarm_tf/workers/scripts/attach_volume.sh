@@ -1,5 +1,81 @@
 #!/usr/bin/env bash
 
-mkdir -p ${mount}
-mount -o discard,defaults ${volume_name} ${mount}
-echo ${volume_name} ${mount} ext4 defaults,nofail,discard 0 0 | sudo tee -a /etc/fstab
+${mark}
+
+install_package() {
+  if [ -z "$(command -v $1)" ]; then
+    sudo apt-get update -qq
+    sudo DEBIAN_FRONTEND=noninteractive apt-get install -y -qq $2
+  fi
+}
+
+mark volume_attach start
+
+# Wait for the Digital Ocean volumes of the droplet, in the stripe order. The by-id paths have the volume names and
+# are stable, unlike /dev/sdX
+VOLUMES="${volumes}"
+DEVICES=""
+for VOLUME in $VOLUMES; do
+  DEVICES="$DEVICES /dev/disk/by-id/scsi-0DO_Volume_$VOLUME"
+done
+for DEV in $DEVICES; do
+  while [ ! -e $DEV ]; do
+    echo Waiting for $DEV...
+    sleep 1
+  done
+done
+DEVICES=$(echo $DEVICES)
+
+if [ ${stripes} -eq 1 ]; then
+  DEVICE=$DEVICES
+elif [ "${stripe_mode}" == "lvm" ]; then
+  DEVICE=/dev/swarm_tf/data
+  install_package lvcreate lvm2
+  sudo vgchange -ay swarm_tf > /dev/null 2>&1
+  if [ ! -b $DEVICE ]; then
+    sudo pvcreate $DEVICES
+    sudo vgcreate swarm_tf $DEVICES
+    sudo lvcreate --yes --stripes ${stripes} --stripesize 256k --extents 100%FREE --name data swarm_tf
+  fi
+else
+  DEVICE=/dev/md/swarm_tf
+  install_package mdadm mdadm
+  sudo mdadm --assemble --scan > /dev/null 2>&1
+  if [ ! -b $DEVICE ]; then
+    sudo mdadm --create $DEVICE --run --level=0 --chunk=256 --raid-devices=${stripes} $DEVICES
+    sudo mdadm --detail --scan | grep swarm_tf | sudo tee -a /etc/mdadm/mdadm.conf
+  fi
+fi
+
+# Create the file system only when the device is empty (new volume)
+if [ -z "$(sudo blkid -o value -s TYPE $DEVICE)" ]; then
+  if [ "${filesystem}" == "xfs" ]; then
+    install_package mkfs.xfs xfsprogs
+  fi
+  sudo mkfs -t ${filesystem} ${mkfs_options} $DEVICE
+fi
+FSTYPE=$(sudo blkid -o value -s TYPE $DEVICE)
+UUID=$(sudo blkid -o value -s UUID $DEVICE)
+
+# Read ahead (KB) of the volumes and of the striped device, also after reboots
+if [ -n "${readahead}" ]; then
+  echo 'ACTION=="add|change", KERNEL=="sd[a-z]*|md*|dm-*", ATTR{bdi/read_ahead_kb}="${readahead}"' \
+    | sudo tee /etc/udev/rules.d/60-swarm-tf-readahead.rules > /dev/null
+  for DEV in $DEVICES $DEVICE; do
+    sudo blockdev --setra $(( ${readahead} * 2 )) $DEV
+  done
+fi
+
+sudo mkdir -p ${mount}
+if [ -z "$(grep "UUID=$UUID" /etc/fstab)" ]; then
+  echo "UUID=$UUID ${mount} $FSTYPE ${mount_options} 0 2" | sudo tee -a /etc/fstab
+fi
+mountpoint -q ${mount} || sudo mount ${mount}
+
+# Discard the unused blocks periodically instead of online (mount option discard)
+if [ "${fstrim}" == "true" ]; then
+  sudo systemctl enable fstrim.timer
+  sudo systemctl start fstrim.timer
+fi
+
+mark volume_attach end
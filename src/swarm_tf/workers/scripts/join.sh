@@ -1,11 +1,23 @@
 #!/bin/bash
 
+# The join token is the first argument (ssh provisioning) or rendered in the template (cloud-init)
+JOIN_TOKEN=$${1:-${join_token}}
+
+${mark}
+
 # Wait until Docker is running correctly
+mark docker_wait start
 while [ -z "$(${docker_cmd} info | grep CPUs)" ]; do
   echo Waiting for Docker to start...
   sleep 2
 done
+mark docker_wait end
+mark_docker_install
 
-# Join cluster
-${docker_cmd} swarm join --token $1 \
-  --availability ${availability} ${manager_private_ip}:2377
+# Join cluster. The data path (VXLAN) only in the private network
+mark swarm_join start
+PRIVATE_ADDR=$(curl -s http://169.254.169.254/metadata/v1/interfaces/private/0/ipv4/address)
+${docker_cmd} swarm join --token $JOIN_TOKEN \
+  --availability ${availability} --advertise-addr $PRIVATE_ADDR --data-path-addr $PRIVATE_ADDR \
+  ${manager_private_ip}:2377
+mark swarm_join end
@@ -0,0 +1,17 @@
+#!/bin/bash
+
+# Readiness gate: wait until all the nodes of the group joined the swarm
+START=$(date +%s)
+while true; do
+  READY=$(${docker_cmd} node ls --format '{{.Hostname}} {{.Status}}' | grep "^${name}-[0-9]*\." | grep -c Ready)
+  if [ "$READY" -ge ${total_instances} ]; then
+    echo "$READY of ${total_instances} ${name} nodes are ready"
+    exit 0
+  fi
+  if [ $(( $(date +%s) - START )) -ge ${timeout} ]; then
+    echo "Timeout waiting for the ${name} nodes: $READY of ${total_instances} are ready"
+    exit 1
+  fi
+  echo "Waiting for the ${name} nodes: $READY of ${total_instances} are ready..."
+  sleep 5
+done
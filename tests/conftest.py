@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+
+@pytest.fixture
+def terraform_calls(tmp_path, monkeypatch):
+    """A fake terraform on the PATH writing its arguments to the returned file, one line per call"""
+    calls = tmp_path / "calls"
+    bin_directory = tmp_path / "bin"
+    bin_directory.mkdir()
+    terraform = bin_directory / "terraform"
+    terraform.write_text("#!/bin/sh\necho \"$@\" >> {}\nexit ${{TERRAFORM_EXIT_CODE:-0}}\n".format(calls))
+    terraform.chmod(0o755)
+    monkeypatch.setenv("PATH", "{}{}{}".format(bin_directory, os.pathsep, os.environ["PATH"]))
+    monkeypatch.delenv("TERRASCRIPT_FORCE", raising=False)
+    monkeypatch.delenv("TERRASCRIPT_DRIFT", raising=False)
+    return calls
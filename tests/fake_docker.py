@@ -0,0 +1,104 @@
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import parse_qs, urlparse
+
+
+def node(group, number, state="ready", availability="active", cpus=2, memory=4 << 30, labels=None):
+    return {
+        "ID": "{}-{:02d}-id".format(group, number),
+        "Version": {"Index": 1},
+        "Spec": {"Role": "worker", "Availability": availability, "Labels": labels or {}},
+        "Description": {"Hostname": "{}-{:02d}.example.com".format(group, number),
+                        "Resources": {"NanoCPUs": int(cpus * 1e9), "MemoryBytes": memory}},
+        "Status": {"State": state}
+    }
+
+
+def task(node_id=None, state="running", cpus=0, memory=0, constraints=None):
+    return {
+        "NodeID": node_id,
+        "ServiceID": "service",
+        "Status": {"State": state},
+        "Spec": {"Resources": {"Reservations": {"NanoCPUs": int(cpus * 1e9), "MemoryBytes": memory}},
+                 "Placement": {"Constraints": constraints or []}}
+    }
+
+
+class ThreadingUnixServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class FakeDockerApi:
+    """Docker Engine API serving the `nodes` and `tasks` lists. A drained node loses its tasks. Listens on
+    `socket_path` (unix socket) when set, else on a local TCP port"""
+
+    def __init__(self, nodes, tasks, socket_path=None):
+        self.nodes = nodes
+        self.tasks = tasks
+        self.socket_path = socket_path
+        self.requests = []
+        self.server = None
+
+    def handle(self, method, path, query, body):
+        self.requests.append((method, path))
+        if method == "GET" and path == "/nodes":
+            return 200, self.nodes
+        if method == "GET" and path == "/tasks":
+            filters = json.loads(query.get("filters", ["{}"])[0])
+            return 200, [task for task in self.tasks
+                         if "node" not in filters or task["NodeID"] in filters["node"]]
+        match = re.match(r"^/nodes/([^/]+)(/update)?$", path)
+        node = [node for node in self.nodes if match and node["ID"] == match.group(1)]
+        if not node:
+            return 404, {"message": "node not found"}
+        if method == "GET":
+            return 200, node[0]
+        if method == "POST":
+            node[0]["Spec"] = body
+            if body["Availability"] == "drain":
+                self.tasks = [task for task in self.tasks if task["NodeID"] != node[0]["ID"]]
+            return 200, None
+        self.nodes.remove(node[0])
+        return 200, None
+
+    def __enter__(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def respond(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                status, content = fake.handle(self.command, re.sub(r"^/v[0-9.]+", "", url.path),
+                                              parse_qs(url.query), body)
+                data = b"" if content is None else json.dumps(content).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_DELETE = respond
+
+            def log_message(self, format, *args):
+                pass
+
+        if self.socket_path is not None:
+            self.server = ThreadingUnixServer(self.socket_path, Handler)
+        else:
+            self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def host(self):
+        if self.socket_path is not None:
+            return "unix://" + self.socket_path
+        return "tcp://127.0.0.1:{}".format(self.server.server_address[1])
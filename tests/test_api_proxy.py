@@ -0,0 +1,84 @@
+import os
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from api_proxy import MockApi
+
+from swarm_tf.common.api_proxy import AdaptiveLimit, ApiProxy, TokenBucket
+
+
+@pytest.fixture
+def mock():
+    mock = MockApi(5, latency=0)
+    mock.url = mock.start()
+    yield mock
+    mock.stop()
+
+
+def get_all(url, requests, parallelism=8):
+    def call(number):
+        with urllib.request.urlopen(url + "/v2/droplets/{}".format(number), timeout=30) as response:
+            return response.status
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        return list(executor.map(call, range(requests)))
+
+
+def test_token_bucket_paces_after_the_burst():
+    bucket = TokenBucket(rate=20, burst=3)
+    assert [bucket.acquire() < 0.01 for _ in range(3)] == [True, True, True]
+    assert 0.03 < bucket.acquire() < 0.2
+
+
+def test_token_bucket_limit_and_pause():
+    bucket = TokenBucket(rate=20, burst=10)
+    bucket.limit(0)
+    assert bucket.acquire() > 0.03
+    bucket.pause(0.2)
+    assert bucket.acquire() >= 0.15
+
+
+def test_adaptive_limit_halves_on_throttling_and_grows_back():
+    limit = AdaptiveLimit(initial=8, maximum=9, window=2)
+    limit.acquire()
+    limit.release(throttled=True)
+    assert limit.limit == 4
+    for _ in range(12):
+        limit.acquire()
+        limit.release()
+    assert limit.limit == 9
+    limit.acquire()
+    limit.release(throttled=True)
+    assert limit.limit == 4
+
+
+def test_proxy_paces_the_requests_within_the_limit(mock):
+    with ApiProxy(upstream=mock.url, rate=3, burst=1) as proxy:
+        assert get_all(proxy.url, 9) == [200] * 9
+    assert mock.throttled == 0
+    assert proxy.stats.throttled == 0
+    assert sum(proxy.stats.calls["droplets"].values()) == 9
+
+
+def test_proxy_retries_the_throttled_requests(mock):
+    with ApiProxy(upstream=mock.url, rate=100, burst=20, max_delay=1) as proxy:
+        assert get_all(proxy.url, 20) == [200] * 20
+    assert mock.throttled > 0
+    assert proxy.stats.throttled == mock.throttled
+    assert proxy.stats.retries == mock.throttled
+
+
+def test_proxy_hourly_budget_follows_the_api():
+    proxy = ApiProxy(upstream="http://127.0.0.1:1", hourly_limit=5000)
+    proxy.sync_hourly([("Content-Type", "application/json"), ("RateLimit-Remaining", "2")])
+    assert proxy.hourly.tokens == 2
+    proxy.sync_hourly([("ratelimit-remaining", "4000")])
+    assert proxy.hourly.tokens == 2
+    start = time.monotonic()
+    proxy.hourly.acquire()
+    proxy.hourly.acquire()
+    assert time.monotonic() - start < 0.1
@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+from swarm_tf.common.docker_api import DockerClient
+from swarm_tf.workers.autoscaler import Autoscaler, AutoscalePolicy, constraint_matches
+
+from fake_docker import FakeDockerApi, node, task
+
+GB = 1 << 30
+
+
+def autoscaler(api, tmpdir, group="web"):
+    policy = AutoscalePolicy(min_instances=1, max_instances=5, cooldown_up=300, cooldown_down=900)
+    return Autoscaler(DockerClient(api.host), group, policy, os.path.join(str(tmpdir), "scale.json"))
+
+
+def cluster():
+    return [node("web", 1, labels={"group": "web"}), node("web", 2, labels={"group": "web"}),
+            node("db", 1, labels={"group": "db"})]
+
+
+def test_constraint_matches():
+    web = node("web", 1, labels={"group": "web"})
+    assert constraint_matches(web, "node.labels.group == web")
+    assert constraint_matches(web, "node.labels.group==WEB")
+    assert not constraint_matches(web, "node.labels.group != web")
+    assert not constraint_matches(web, "node.labels.group == db")
+    assert not constraint_matches(web, "node.role == manager")
+    assert constraint_matches(web, "node.hostname == web-01.example.com")
+    assert constraint_matches(web, "node.unknown == anything")
+
+
+def test_scale_up_when_utilization_above_threshold(tmpdir):
+    tasks = [task("web-01-id", cpus=1.8), task("web-02-id", cpus=1.8)]
+    with FakeDockerApi(cluster(), tasks) as api:
+        current, desired, metrics, reason = autoscaler(api, tmpdir).evaluate(now=10000)
+    assert metrics["nodes"] == 2
+    assert metrics["utilization"] == pytest.approx(0.9)
+    assert (current, desired) == (2, 4)
+
+
+def test_scale_up_for_tasks_pending_on_the_group(tmpdir):
+    tasks = [task("web-01-id", cpus=1), task(state="pending", constraints=["node.labels.group == web"])]
+    with FakeDockerApi(cluster(), tasks) as api:
+        current, desired, metrics, reason = autoscaler(api, tmpdir).evaluate(now=10000)
+    assert metrics["pending_tasks"] == 1
+    assert (current, desired) == (2, 3)
+
+
+def test_tasks_pending_on_another_group_are_ignored(tmpdir):
+    tasks = [task("web-01-id", cpus=1), task("web-02-id", cpus=1),
+             task(state="pending", constraints=["node.labels.group == db"]),
+             task(state="pending", constraints=["node.role == manager"])]
+    with FakeDockerApi(cluster(), tasks) as api:
+        current, desired, metrics, reason = autoscaler(api, tmpdir).evaluate(now=10000)
+    assert metrics["pending_tasks"] == 0
+    assert (current, desired, reason) == (2, 2, "no change")
+
+
+def test_scale_down_and_cooldown(tmpdir):
+    tasks = [task("web-01-id", memory=GB // 2)]
+    with FakeDockerApi(cluster(), tasks) as api:
+        scaler = autoscaler(api, tmpdir)
+        assert scaler.evaluate(now=10000)[:2] == (2, 1)
+
+        scaler.save(2, now=10000)
+        assert scaler.evaluate(now=10500) == (2, 2, scaler.metrics(), "scale down in cooldown")
+        assert scaler.evaluate(now=11000)[:2] == (2, 1)
+
+
+def test_drain_the_removed_nodes(tmpdir):
+    tasks = [task("web-01-id", cpus=0.1), task("web-02-id", cpus=0.1)]
+    with FakeDockerApi(cluster(), tasks) as api:
+        drained = autoscaler(api, tmpdir).drain(1, poll=0.01)
+        assert [node["ID"] for node in drained] == ["web-02-id"]
+        availability = {node["ID"]: node["Spec"]["Availability"] for node in api.nodes}
+        assert availability == {"web-01-id": "active", "web-02-id": "drain", "db-01-id": "active"}
+        assert [task["NodeID"] for task in api.tasks] == ["web-01-id"]
+
+        assert autoscaler(api, tmpdir).drain(2, poll=0.01) == []
@@ -0,0 +1,26 @@
+import json
+
+import pytest
+from terraobject import Terraobject
+
+from swarm_tf.workers import Worker, WorkerVariables
+
+
+def workers(o, **values):
+    variables = WorkerVariables(join_token="token", manager_private_ip="10.0.0.2", domain="example.com",
+                                total_instances=2, bootstrap="cloud-init", **values)
+    Worker(o, variables).create_workers()
+    return json.loads(o.terrascript.dump())
+
+
+def test_cloud_init_droplets_ignore_the_user_data_changes():
+    config = workers(Terraobject(), gate_host="203.0.113.1")
+    for droplet in config["resource"]["digitalocean_droplet"].values():
+        assert droplet["lifecycle"] == {"ignore_changes": ["user_data"]}
+    assert config["resource"]["null_resource"]["worker_ready"]["connection"]["host"] == "203.0.113.1"
+
+
+def test_readiness_gate_needs_a_manager():
+    with pytest.raises(ValueError) as error:
+        workers(Terraobject())
+    assert "gate_host" in str(error.value)
@@ -0,0 +1,31 @@
+import pytest
+
+from fake_docker import FakeDockerApi, node
+from swarm_tf.common.docker_api import DockerApiError, DockerClient
+
+
+def test_client_over_tcp():
+    with FakeDockerApi([node("worker", 1)], []) as api:
+        assert [item["ID"] for item in DockerClient(api.host).nodes()] == ["worker-01-id"]
+
+
+def test_client_over_a_unix_socket(tmp_path):
+    with FakeDockerApi([node("worker", 1)], [], socket_path=str(tmp_path / "docker.sock")) as api:
+        client = DockerClient(api.host)
+        assert [item["ID"] for item in client.nodes()] == ["worker-01-id"]
+        with pytest.raises(DockerApiError) as error:
+            client.node("unknown")
+        assert error.value.status == 404
+
+
+def test_client_uses_docker_host(monkeypatch):
+    monkeypatch.setenv("DOCKER_HOST", "unix:///var/run/docker.sock")
+    assert DockerClient().socket_path == "/var/run/docker.sock"
+    monkeypatch.delenv("DOCKER_HOST")
+    assert (DockerClient().host, DockerClient().port) == ("localhost", 2374)
+
+
+@pytest.mark.parametrize("host", ["ssh://root@10.0.0.1", "unix://", "tcp://"])
+def test_client_rejects_unsupported_hosts(host):
+    with pytest.raises(ValueError):
+        DockerClient(host)
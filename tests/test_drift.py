@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+from swarm_tf.common.drift import DriftDetector
+from swarm_tf.common.synth import Manifest, run_terraform
+
+
+def configuration(image="ubuntu-18-04-x64", extra_data=None):
+    data = {"digitalocean_image": {"base": {"name": image}}}
+    data.update(extra_data or {})
+    return json.dumps({
+        "data": data,
+        "resource": {
+            "digitalocean_droplet": {
+                "manager": {"image": "${data.digitalocean_image.base.id}", "size": "s-1vcpu-1gb"}
+            },
+            "digitalocean_tag": {"cluster": {"name": "cluster"}}
+        }
+    })
+
+
+@pytest.fixture
+def cluster(tmp_path, terraform_calls, monkeypatch):
+    """A configuration directory with a state"""
+    monkeypatch.setenv("TERRASCRIPT_DRIFT", "1")
+    monkeypatch.delenv("DIGITALOCEAN_TOKEN", raising=False)
+    directory = tmp_path / "cluster"
+    directory.mkdir()
+    (directory / "terraform.tfstate").write_text(json.dumps({"version": 4, "resources": []}))
+    return str(directory), terraform_calls
+
+
+def apply(directory, content):
+    manifest = Manifest(directory)
+    manifest.write_section("main", content)
+    manifest.save()
+    return run_terraform(["apply", "-auto-approve"], directory)
+
+
+def calls(path):
+    return path.read_text().splitlines() if path.exists() else []
+
+
+def test_drift_apply_of_a_data_source_change_is_recorded(cluster):
+    directory, calls_path = cluster
+    assert apply(directory, configuration()) == 0
+    assert calls(calls_path) == ["apply -auto-approve"]
+
+    assert apply(directory, configuration(image="ubuntu-20-04-x64")) == 0
+    assert calls(calls_path)[1:] == ["apply -auto-approve -target=digitalocean_droplet.manager"]
+    assert Manifest(directory).is_applied()
+
+    assert apply(directory, configuration(image="ubuntu-20-04-x64")) == 0
+    assert len(calls(calls_path)) == 2
+
+
+def test_drift_apply_records_the_data_sources_without_users(cluster, capsys):
+    directory, calls_path = cluster
+    apply(directory, configuration())
+
+    unused = {"digitalocean_ssh_key": {"deploy": {"name": "deploy"}}}
+    assert apply(directory, configuration(extra_data=unused)) == 0
+    assert "No drift" in capsys.readouterr().out
+    assert Manifest(directory).is_applied()
+
+    # Removed data source
+    assert apply(directory, configuration()) == 0
+    assert Manifest(directory).is_applied()
+    assert len(calls(calls_path)) == 1
+
+
+class FakeApi:
+    def __init__(self, items):
+        self.items = items
+        self.paths = []
+
+    def list(self, path, key):
+        self.paths.append(path)
+        return self.items.get(path, [])
+
+
+def test_records_without_domain_are_not_checked(tmp_path):
+    records = [{"address": "digitalocean_record.www", "type": "digitalocean_record", "id": "1",
+                "attributes": {"domain": "example.com", "value": "203.0.113.1"}},
+               {"address": "digitalocean_record.legacy", "type": "digitalocean_record", "id": "2",
+                "attributes": {"value": "203.0.113.2"}}]
+    api = FakeApi({"/domains/example.com/records": [{"id": 1, "data": "203.0.113.9", "ttl": 60}]})
+    detector = DriftDetector(Manifest(str(tmp_path)), api)
+    listings = detector.listings(records)
+    assert api.paths == ["/domains/example.com/records"]
+    assert detector.drift_reason(records[0], listings) == "value changed to 203.0.113.9"
+    assert detector.drift_reason(records[1], listings) is None
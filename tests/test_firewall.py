@@ -0,0 +1,19 @@
+from terraobject import Terraobject
+
+from swarm_tf.common.firewall import FirewallBuilder
+
+
+def internal_ports(o):
+    rules = FirewallBuilder(o, "example.com", "cluster").inbound_rules()
+    return [(rule["protocol"], rule["port_range"]) for rule in rules if "source_tags" in rule and "port_range" in rule]
+
+
+def test_swarm_ports_between_the_nodes():
+    assert internal_ports(Terraobject()) == [("tcp", "2377"), ("tcp", "7946"), ("udp", "4789"), ("udp", "7946")]
+
+
+def test_local_dns_opens_the_dns_port():
+    o = Terraobject()
+    o.shared["local_dns"] = {"hosts": ["203.0.113.1"], "servers": ["10.0.0.1"]}
+    assert internal_ports(o) == [("tcp", "53"), ("tcp", "2377"), ("tcp", "7946"), ("udp", "53"), ("udp", "4789"),
+                                 ("udp", "7946")]
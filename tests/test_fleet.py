@@ -0,0 +1,52 @@
+import json
+
+from terraobject import Terraobject
+
+from swarm_tf.common.drift import config_entities
+from swarm_tf.workers import Worker, WorkerVariables
+
+
+def workers(**values):
+    o = Terraobject()
+    variables = WorkerVariables(join_token="token", manager_private_ip="10.0.0.2", domain="example.com",
+                                tags=["cluster"], create_dns=True, **values)
+    Worker(o, variables).create_workers()
+    return o, config_entities(json.loads(o.terrascript.dump()))
+
+
+def addresses(entities, prefix):
+    return sorted([address for address in entities if address.startswith(prefix)])
+
+
+def test_fleet_creates_one_counted_droplet():
+    o, entities = workers(total_instances=3, fleet=True)
+    assert addresses(entities, "digitalocean_droplet.") == ["digitalocean_droplet.worker"]
+    droplet = entities["digitalocean_droplet.worker"]
+    assert droplet["count"] == 3
+    assert droplet["name"] == '${format("worker-%02d", count.index + 1)}.example.com'
+    assert o.shared["worker_nodes"][0].id == "${digitalocean_droplet.worker.*.id}"
+
+    assert entities["output.worker_ids"]["value"] == ["${digitalocean_droplet.worker.*.id}"]
+    assert entities["output.worker_ipv4_private"]["value"] == ["${digitalocean_droplet.worker.*.ipv4_address_private}"]
+
+    record = entities["digitalocean_record.example_com_worker"]
+    assert record["count"] == 3
+    assert record["name"] == '${format("worker-%02d", count.index + 1)}'
+    assert record["value"] == "${element(digitalocean_droplet.worker.*.ipv4_address, count.index)}"
+    assert entities["digitalocean_record.example_com_worker-internal"]["value"] == \
+        "${element(digitalocean_droplet.worker.*.ipv4_address_private, count.index)}"
+    assert entities["digitalocean_record.example_com_worker-cluster"]["name"] == "cluster"
+
+
+def test_grouped_dns_records_of_the_droplets():
+    _, entities = workers(total_instances=2, dns_grouped=True)
+    assert addresses(entities, "digitalocean_droplet.") == ["digitalocean_droplet.worker_01",
+                                                            "digitalocean_droplet.worker_02"]
+    assert addresses(entities, "digitalocean_record.") == ["digitalocean_record.example_com_worker",
+                                                           "digitalocean_record.example_com_worker-cluster",
+                                                           "digitalocean_record.example_com_worker-internal"]
+    record = entities["digitalocean_record.example_com_worker"]
+    assert record["count"] == 2
+    assert record["name"] == '${element(list("worker-01","worker-02"), count.index)}'
+    assert record["value"] == "${element(list(digitalocean_droplet.worker_01.ipv4_address," \
+                              "digitalocean_droplet.worker_02.ipv4_address), count.index)}"
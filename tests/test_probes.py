@@ -0,0 +1,56 @@
+import json
+
+import pytest
+
+from swarm_tf.common.probes import DEFAULTS, check, load_config
+
+
+def test_load_config_merges_the_defaults(tmp_path):
+    path = tmp_path / "probes.json"
+    path.write_text(json.dumps({"timeout": 60, "network": {"min_mbps": 500}}))
+    config = load_config(str(path))
+    assert config["timeout"] == 60
+    assert config["network"]["min_mbps"] == 500
+    assert config["network"]["seconds"] == DEFAULTS["network"]["seconds"]
+    assert DEFAULTS["network"]["min_mbps"] is None
+    assert load_config() == DEFAULTS
+
+
+def test_load_config_yaml(tmp_path):
+    pytest.importorskip("yaml")
+    path = tmp_path / "probes.yml"
+    path.write_text("disk:\n  targets: [{group: persistent, path: /data}]\n  min_read_iops: 3000\n")
+    config = load_config(str(path))
+    assert config["disk"]["targets"] == [{"group": "persistent", "path": "/data"}]
+    assert config["disk"]["min_read_iops"] == 3000
+
+
+@pytest.mark.parametrize("content", [{"unknown": 1}, {"mesh": {"min_rpm": 10}}])
+def test_load_config_rejects_unknown_settings(tmp_path, content):
+    path = tmp_path / "probes.json"
+    path.write_text(json.dumps(content))
+    with pytest.raises(ValueError):
+        load_config(str(path))
+
+
+def test_check_reports_the_errors_and_the_thresholds():
+    config = load_config()
+    config["network"]["min_mbps"] = 500
+    config["mesh"]["max_error_rate"] = 0.01
+    report = {
+        "network": [{"node": "a", "peer": "b", "mbps": 900, "rtt_ms": 1.2, "error": None},
+                    {"node": "b", "peer": "a", "mbps": 200, "rtt_ms": 1.1, "error": None},
+                    {"node": "c", "peer": "a", "mbps": None, "error": "unreachable"}],
+        "mesh": [{"node": "a", "rps": 3000, "error_rate": 0.05, "error": None}],
+        "disk": [{"node": "a", "path": "/data", "read_iops": 100, "error": None}]
+    }
+    assert check(report, config) == [
+        "network c -> a: unreachable",
+        "network b -> a: mbps 200 < 500",
+        "mesh a: error_rate 0.05 > 0.01"
+    ]
+
+
+def test_check_passes_without_thresholds():
+    report = {"network": [{"node": "a", "peer": "b", "mbps": 1, "rtt_ms": 100, "error": None}]}
+    assert check(report, load_config()) == []
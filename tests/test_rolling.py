@@ -0,0 +1,28 @@
+from swarm_tf.common.docker_api import DockerClient
+from swarm_tf.workers.rolling import RollingUpdate
+
+from fake_docker import FakeDockerApi, node
+
+
+def hostnames(batch):
+    return [node["Description"]["Hostname"].split(".")[0] for node in batch]
+
+
+def test_batch_size_is_not_limited_by_max_unavailable():
+    nodes = [node("web", number) for number in range(1, 5)]
+    with FakeDockerApi(nodes, []) as api:
+        rolling = RollingUpdate(DockerClient(api.host), "web", batch_size=3, max_unavailable=4)
+        assert hostnames(rolling.next_batch(nodes)) == ["web-01", "web-02", "web-03"]
+
+
+def test_max_unavailable_counts_the_nodes_already_unavailable():
+    nodes = [node("web", 1), node("web", 2), node("web", 3), node("web", 4, state="down"),
+             node("db", 1, state="down")]
+    with FakeDockerApi(nodes, []) as api:
+        rolling = RollingUpdate(DockerClient(api.host), "web", batch_size=3, max_unavailable=2)
+        # web-04 is down: only one active node can be taken down with it
+        assert hostnames(rolling.next_batch(nodes[:3])) == ["web-01"]
+        assert hostnames(rolling.next_batch(nodes[:4])) == ["web-01", "web-04"]
+
+        api.nodes[0]["Spec"]["Availability"] = "drain"
+        assert hostnames(rolling.next_batch(nodes[1:3])) == []
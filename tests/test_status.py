@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from swarm_tf.common.status import Cluster
+
+
+class FakeClient:
+    def __init__(self, events, error=None):
+        self.events_list = events
+        self.error = error
+
+    async def events(self, filters=None):
+        for event in self.events_list:
+            await asyncio.sleep(0)
+            yield event
+        if self.error is not None:
+            raise self.error
+
+
+def event(action, node_id):
+    return {"Type": "node", "Action": action, "Actor": {"ID": node_id}, "timeNano": 1}
+
+
+def collect(cluster):
+    async def run():
+        received = []
+        with pytest.raises(RuntimeError) as error:
+            async for item in cluster.events():
+                received.append(item)
+        return received, str(error.value)
+    return asyncio.run(run())
+
+
+def test_events_report_the_stopped_streams(capsys):
+    cluster = Cluster([])
+    cluster.clients = {
+        "10.0.0.1": FakeClient([event("update", "a"), event("remove", "b")], ConnectionResetError("reset by peer")),
+        "10.0.0.2": FakeClient([event("update", "a")])
+    }
+    received, error = collect(cluster)
+
+    assert sorted([item["Action"] for item in received]) == ["remove", "update"]
+    assert error == "The event streams of all the managers stopped"
+    stderr = capsys.readouterr().err
+    assert "Events of 10.0.0.1 stopped: reset by peer" in stderr
+    assert "Events of 10.0.0.2 stopped: the stream was closed" in stderr
+
+
+def test_events_without_reachable_manager():
+    received, error = collect(Cluster([]))
+    assert received == []
+    assert error.startswith("No manager reachable")
@@ -0,0 +1,105 @@
+import json
+
+import pytest
+
+from swarm_tf.common.synth import Manifest, is_unchanged, run_terraform
+
+
+def section(droplets):
+    return json.dumps({"resource": {"digitalocean_droplet": {name: {"size": size} for name, size in droplets.items()}}})
+
+
+@pytest.fixture
+def directory(tmp_path):
+    directory = tmp_path / "cluster"
+    directory.mkdir()
+    return str(directory)
+
+
+def write(directory, **sections):
+    manifest = Manifest(directory)
+    changed = [name for name, content in sorted(sections.items()) if manifest.write_section(name, content)]
+    changed += manifest.remove_sections(sections.keys())
+    manifest.save()
+    return changed
+
+
+def calls(path):
+    return path.read_text().splitlines() if path.exists() else []
+
+
+def test_manifest_rewrites_only_the_changed_sections(directory):
+    assert write(directory, main=section({"a": "s-1vcpu-1gb"}), worker=section({"b": "s-1vcpu-1gb"})) == \
+        ["main", "worker"]
+    assert write(directory, main=section({"a": "s-1vcpu-1gb"}), worker=section({"b": "s-2vcpu-2gb"})) == ["worker"]
+    assert write(directory, main=section({"a": "s-1vcpu-1gb"})) == ["worker"]
+    assert sorted(Manifest(directory).sections) == ["main"]
+
+
+def test_manifest_applied_digest(directory):
+    write(directory, main=section({"a": "s-1vcpu-1gb"}))
+    manifest = Manifest(directory)
+    assert not manifest.is_applied()
+    manifest.mark_applied()
+    manifest.save()
+    assert Manifest(directory).is_applied()
+    assert Manifest(directory).applied_entities() == Manifest(directory).data["applied_entities"]
+
+    write(directory, main=section({"a": "s-2vcpu-2gb"}))
+    assert not Manifest(directory).is_applied()
+
+
+def test_manifest_partial_apply_of_the_targets(directory):
+    write(directory, main=section({"a": "s-1vcpu-1gb", "b": "s-1vcpu-1gb"}))
+    manifest = Manifest(directory)
+    manifest.mark_applied()
+    manifest.save()
+    write(directory, main=section({"a": "s-2vcpu-2gb", "b": "s-2vcpu-2gb"}))
+    manifest = Manifest(directory)
+    manifest.mark_applied(["digitalocean_droplet.a"])
+    assert not manifest.is_applied()
+    manifest.mark_applied(["digitalocean_droplet.b"])
+    assert manifest.is_applied()
+
+
+def test_unchanged_plan_and_apply_skip_terraform(directory, terraform_calls, monkeypatch):
+    write(directory, main=section({"a": "s-1vcpu-1gb"}))
+    assert not is_unchanged(["plan"], directory)
+    assert run_terraform(["apply"], directory) == 0
+    assert is_unchanged(["plan"], directory)
+    assert not is_unchanged(["output"], directory)
+    assert run_terraform(["plan"], directory) == 0
+    assert calls(terraform_calls) == ["apply"]
+
+    monkeypatch.setenv("TERRASCRIPT_FORCE", "1")
+    assert not is_unchanged(["plan"], directory)
+
+
+def test_failed_and_targeted_applies_are_not_recorded(directory, terraform_calls, monkeypatch):
+    write(directory, main=section({"a": "s-1vcpu-1gb", "b": "s-1vcpu-1gb"}))
+    monkeypatch.setenv("TERRAFORM_EXIT_CODE", "1")
+    assert run_terraform(["apply"], directory) == 1
+    assert not Manifest(directory).is_applied()
+    monkeypatch.setenv("TERRAFORM_EXIT_CODE", "0")
+    run_terraform(["apply", "-target=digitalocean_droplet.a"], directory)
+    assert not Manifest(directory).is_applied()
+
+
+@pytest.mark.parametrize("command", [["destroy", "-force"], ["taint", "digitalocean_droplet.a"],
+                                     ["import", "digitalocean_droplet.a", "1"],
+                                     ["state", "rm", "digitalocean_droplet.a"]])
+def test_state_commands_forget_the_last_apply(directory, terraform_calls, command):
+    write(directory, main=section({"a": "s-1vcpu-1gb"}))
+    run_terraform(["apply"], directory)
+    run_terraform(command, directory)
+    assert not Manifest(directory).is_applied()
+    assert Manifest(directory).applied_entities() is None
+    run_terraform(["apply"], directory)
+    assert calls(terraform_calls) == ["apply", " ".join(command), "apply"]
+
+
+def test_state_list_keeps_the_last_apply(directory, terraform_calls):
+    write(directory, main=section({"a": "s-1vcpu-1gb"}))
+    run_terraform(["apply"], directory)
+    run_terraform(["state", "list"], directory)
+    assert Manifest(directory).is_applied()
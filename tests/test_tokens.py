@@ -0,0 +1,89 @@
+import json
+import os
+import time
+
+import pytest
+
+from swarm_tf.managers import tokens
+from swarm_tf.managers.tokens import TokenCache, get_tokens, rotate
+
+
+class FakeManager:
+    """The swarm of the first manager, answering the ssh commands of the token provider"""
+
+    def __init__(self):
+        self.worker = "SWMTKN-worker-1"
+        self.commands = []
+
+    def ssh(self, host, user, private_key, command):
+        self.commands.append((host, command))
+        if command == tokens.ROTATE_COMMAND.format("worker"):
+            self.worker = "SWMTKN-worker-{}".format(int(self.worker.rsplit("-", 1)[1]) + 1)
+            return [self.worker]
+        return ["swarm-id", "SWMTKN-manager-1", self.worker]
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    manager = FakeManager()
+    monkeypatch.setattr(tokens, "ssh", manager.ssh)
+    return manager
+
+
+def query(cache, manager_id="1001", ttl=None):
+    return {"host": "203.0.113.1", "user": "root", "private_key": "~/.ssh/id_rsa", "manager_id": manager_id,
+            "cache": cache, "ttl": ttl}
+
+
+def test_token_cache_expiry_and_manager_replacement(tmp_path):
+    cache = TokenCache(str(tmp_path / "tokens.json"))
+    cache.put("203.0.113.1", "1001", "swarm-id", "manager-token", "worker-token", "root", "key")
+    assert cache.get("203.0.113.1", "1001")["worker"] == "worker-token"
+    assert cache.get("203.0.113.1", "1002") is None
+    assert cache.get("203.0.113.2", "1001") is None
+
+    cache.data["swarms"]["swarm-id"]["updated"] = time.time() - 120
+    assert cache.get("203.0.113.1", "1001", ttl=60) is None
+    assert cache.get("203.0.113.1", "1001", ttl=600) is not None
+
+
+def test_token_cache_save_and_invalidate(tmp_path):
+    path = str(tmp_path / "cache" / "tokens.json")
+    cache = TokenCache(path)
+    cache.put("203.0.113.1", "1001", "swarm-id", "manager-token", "worker-token", "root", "key")
+    cache.save()
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert TokenCache(path).get("203.0.113.1", "1001")["manager"] == "manager-token"
+
+    cache.invalidate("203.0.113.1")
+    assert cache.get("203.0.113.1", "1001") is None
+    cache.invalidate()
+    assert cache.data == {"hosts": {}, "swarms": {}}
+
+
+def test_get_tokens_connects_only_on_a_cache_miss(tmp_path, manager):
+    cache = str(tmp_path / "tokens.json")
+    assert get_tokens(query(cache)) == {"manager": "SWMTKN-manager-1", "worker": "SWMTKN-worker-1"}
+    get_tokens(query(cache))
+    assert len(manager.commands) == 1
+
+    # The first manager was replaced
+    get_tokens(query(cache, manager_id="1002"))
+    assert len(manager.commands) == 2
+
+    with open(cache) as f:
+        data = json.load(f)
+    data["swarms"]["swarm-id"]["updated"] -= 120
+    with open(cache, "w") as f:
+        json.dump(data, f)
+    get_tokens(query(cache, manager_id="1002", ttl="60"))
+    assert len(manager.commands) == 3
+
+
+def test_rotate_refreshes_the_cache(tmp_path, manager):
+    cache = str(tmp_path / "tokens.json")
+    get_tokens(query(cache))
+    rotate(cache, "worker")
+    assert manager.commands[1] == ("203.0.113.1", tokens.ROTATE_COMMAND.format("worker"))
+    assert get_tokens(query(cache)) == {"manager": "SWMTKN-manager-1", "worker": "SWMTKN-worker-2"}
+    assert len(manager.commands) == 3
@@ -0,0 +1,97 @@
+import json
+import os
+
+import pytest
+
+from swarm_tf.common.drift import config_entities
+from swarm_tf.topology import Topology, run_modules
+
+
+@pytest.fixture
+def terraform_log(tmp_path, monkeypatch):
+    """A fake terraform writing "<module> <arguments>" to the returned file. It fails in the modules containing a
+    "fail" file"""
+    log = tmp_path / "log"
+    bin_directory = tmp_path / "bin"
+    bin_directory.mkdir()
+    terraform = bin_directory / "terraform"
+    terraform.write_text("#!/bin/sh\necho \"$(basename \"$PWD\") $@\" >> {}\n[ ! -f fail ]\n".format(log))
+    terraform.chmod(0o755)
+    monkeypatch.setenv("PATH", "{}{}{}".format(bin_directory, os.pathsep, os.environ["PATH"]))
+    monkeypatch.delenv("TERRASCRIPT_DRIFT", raising=False)
+    return log
+
+
+@pytest.fixture
+def modules(tmp_path):
+    """network <- managers <- workers, and a monitoring module without dependencies"""
+    depends_on = {"network": [], "managers": ["network"], "workers": ["managers"], "monitoring": []}
+    result = {}
+    for name, dependencies in depends_on.items():
+        (tmp_path / name).mkdir()
+        result[name] = {"path": str(tmp_path / name), "depends_on": dependencies}
+    return result
+
+
+def order(log):
+    return [line.split()[0] for line in log.read_text().splitlines()]
+
+
+def test_modules_run_after_their_dependencies(modules, terraform_log):
+    assert run_modules(modules, ["apply"], parallel=4) == 0
+    ran = order(terraform_log)
+    assert sorted(ran) == ["managers", "monitoring", "network", "workers"]
+    assert ran.index("network") < ran.index("managers") < ran.index("workers")
+
+
+def test_destroy_reverses_the_dependencies(modules, terraform_log):
+    assert run_modules(modules, ["destroy", "-force"], parallel=1) == 0
+    ran = order(terraform_log)
+    assert ran.index("workers") < ran.index("managers") < ran.index("network")
+
+
+def test_failed_module_skips_its_dependents(modules, terraform_log, capsys):
+    with open(os.path.join(modules["managers"]["path"], "fail"), "w"):
+        pass
+    assert run_modules(modules, ["apply"], parallel=2) == 1
+    assert sorted(order(terraform_log)) == ["managers", "monitoring", "network"]
+    output = capsys.readouterr().out
+    assert "[workers] Skipped: a module it depends on failed" in output
+    assert "Failed modules: managers, workers" in output
+
+
+def test_remote_output_reads_the_state_of_the_other_module():
+    topology = Topology()
+    topology.module("network")
+    workers = topology.module("workers")
+    assert topology.remote_output(workers, "network", "vpc_id") == "${data.terraform_remote_state.network.vpc_id}"
+    topology.remote_output(workers, "network", "region")
+    assert topology.dependencies == {"network": set(), "workers": {"network"}}
+
+    entities = config_entities(json.loads(workers.terrascript.dump()))
+    assert [address for address in entities if address.startswith("data.")] == ["data.terraform_remote_state.network"]
+    state = entities["data.terraform_remote_state.network"]
+    assert state["backend"] == "local"
+    assert state["config"] == {"path": os.path.join("..", "network", "terraform.tfstate")}
+
+    with pytest.raises(ValueError):
+        topology.remote_output(workers, "workers", "vpc_id")
+    with pytest.raises(ValueError):
+        topology.remote_output(workers, "storage", "vpc_id")
+
+
+def test_remote_backend_config_of_each_module():
+    topology = Topology(backend_name="s3", backend_config={"bucket": "states", "key": "swarm/{module}.tfstate"})
+    assert topology.get_backend_config("workers") == {"bucket": "states", "key": "swarm/workers.tfstate"}
+
+
+def test_circular_dependencies_are_rejected():
+    topology = Topology()
+    network, managers, workers = [topology.module(name) for name in ["network", "managers", "workers"]]
+    topology.remote_output(managers, "network", "vpc_id")
+    topology.remote_output(workers, "managers", "manager_ips")
+    topology.check_cycles()
+    topology.remote_output(network, "workers", "worker_ips")
+    with pytest.raises(ValueError) as error:
+        topology.check_cycles()
+    assert "Circular dependency between the modules" in str(error.value)
@@ -0,0 +1,32 @@
+import pytest
+from terraobject import Terraobject
+
+from swarm_tf.common import get_user_data_script
+from swarm_tf.workers import Worker, WorkerVariables
+
+
+def worker(**values):
+    variables = WorkerVariables(join_token="token", manager_private_ip="10.0.0.2", **values)
+    return Worker(Terraobject(), variables)
+
+
+@pytest.mark.parametrize("swap_size", ["2G", "4G", "0"])
+def test_snapshot_skips_the_docker_user_data(swap_size):
+    user_data = get_user_data_script(swap_size)
+    assert worker(user_data=user_data).get_user_data() == user_data
+    assert worker(user_data=user_data, snapshot="docker-base").get_user_data() == ""
+
+
+def test_snapshot_keeps_the_custom_user_data():
+    assert worker(user_data="#!/bin/bash\necho hi", snapshot="docker-base").get_user_data() == "#!/bin/bash\necho hi"
+
+
+def test_default_user_data_is_the_script_file():
+    user_data = get_user_data_script()
+    assert user_data.startswith('${file("') and user_data.endswith('/scripts/install-docker-ce.sh")}')
+
+
+def test_swap_size_replaces_the_swap_file_of_the_script():
+    assert get_user_data_script("4G").startswith('${replace(file("')
+    assert get_user_data_script("4G").endswith('"fallocate -l 2G", "fallocate -l 4G")}')
+    assert get_user_data_script("0").endswith('"/(?s)# Install Swap file.*# Install Docker/", "# Install Docker")}')
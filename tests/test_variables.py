@@ -0,0 +1,101 @@
+import json
+
+import pytest
+
+from swarm_tf.common.variables import Field, Variables, duration, non_negative, positive
+from swarm_tf.workers import WorkerVariables
+
+
+class GroupVariables(Variables):
+    name = Field("group", (str,))
+    size = Field(1, (int,), check=positive)
+    spare = Field(0, (int,), check=non_negative)
+    timeout = Field("2m", (str,), check=duration)
+    availability = Field("active", (str,), choices=["active", "pause", "drain"])
+    tags = Field([], list, items=(str,))
+    ports = Field([], list, items=(int,))
+    domain = Field(None, (str,))
+    total = Field(1, (int,), convert=lambda value: int(value) if isinstance(value, str) else value)
+
+    def errors(self):
+        errors = []
+        if self.tags and not self.domain:
+            errors.append("tags need a domain")
+        if self.spare > self.size:
+            errors.append("spare must be <= size")
+        return errors
+
+
+def test_defaults_and_assigned_values():
+    variables = GroupVariables(size=3)
+    assert (variables.name, variables.size, variables.domain) == ("group", 3, None)
+    assert variables.assigned() == {"size": 3}
+    with pytest.raises(AttributeError):
+        variables.unknown = 1
+    with pytest.raises(AttributeError):
+        GroupVariables(unknown=1)
+
+
+@pytest.mark.parametrize("name, value, message", [
+    ("size", "3", "size must be int"),
+    ("size", True, "size must be int"),
+    ("size", None, "size can not be None"),
+    ("size", 0, "Invalid size 0: must be > 0"),
+    ("spare", -1, "Invalid spare -1: must be >= 0"),
+    ("timeout", "2 minutes", "use a duration"),
+    ("availability", "paused", "Use 'active'|'pause'|'drain'"),
+    ("tags", "web", "tags must be a list"),
+    ("tags", ["web", 1], "Invalid item 1 in tags"),
+    ("ports", [80, True], "Invalid item True in ports"),
+])
+def test_invalid_values(name, value, message):
+    with pytest.raises(ValueError) as error:
+        GroupVariables(**{name: value})
+    assert message in str(error.value)
+
+
+def test_none_is_accepted_when_it_is_the_default():
+    assert GroupVariables(domain=None).domain is None
+
+
+def test_convert():
+    assert GroupVariables(total="4").total == 4
+
+
+def test_list_default_is_a_copy():
+    variables = GroupVariables()
+    variables.tags.append("web")
+    assert variables.tags == ["web"]
+    assert GroupVariables().tags == []
+
+
+def test_errors_are_aggregated():
+    variables = GroupVariables(tags=["web"], size=1, spare=2)
+    with pytest.raises(ValueError) as error:
+        variables.freeze()
+    assert str(error.value) == "Invalid variables for 'group':\n  tags need a domain\n  spare must be <= size"
+    assert not variables.frozen
+
+
+def test_freeze_and_copy():
+    variables = GroupVariables(tags=["web"], domain="example.com").freeze()
+    assert variables.tags == ("web",)
+    with pytest.raises(AttributeError):
+        variables.size = 2
+    other = variables.copy(size=2)
+    other.tags.append("api")
+    assert (other.size, other.tags, variables.tags) == (2, ["web", "api"], ("web",))
+    assert variables.copy() == variables
+
+
+def test_load(tmp_path):
+    path = tmp_path / "cluster.json"
+    path.write_text(json.dumps({"workers": {"name": "web", "total_instances": 2, "tags": ["web"]}}))
+    variables = WorkerVariables.load(str(path), "workers")
+    assert (variables.name, variables.total_instances, variables.tags) == ("web", 2, ["web"])
+    with pytest.raises(ValueError):
+        WorkerVariables.load(str(path), "managers")
+    path.write_text(json.dumps({"total_instances": -1}))
+    with pytest.raises(ValueError) as error:
+        WorkerVariables.load(str(path))
+    assert str(path) in str(error.value)
@@ -0,0 +1,131 @@
+import json
+import os
+import re
+import subprocess
+
+import pytest
+from terraobject import Terraobject
+
+from swarm_tf.common import VOLUMES_PLACEHOLDER, VolumeClaim
+from swarm_tf.common.drift import config_entities
+from swarm_tf.workers import Worker, WorkerVariables
+
+ATTACH_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "swarm_tf",
+                             "workers", "scripts", "attach_volume.sh")
+
+
+def workers(bootstrap="ssh", total_instances=1, fleet=False, **claim):
+    o = Terraobject()
+    claims = [VolumeClaim(o, "nyc3", "data-{}".format(number), size=100, **claim)
+              for number in range(1, total_instances + 1)]
+    variables = WorkerVariables(join_token="token", manager_private_ip="10.0.0.2", domain="example.com", name="db",
+                                bootstrap=bootstrap, gate_host="203.0.113.1", total_instances=total_instances,
+                                fleet=fleet, persistent_volumes=claims)
+    Worker(o, variables).create_workers()
+    return config_entities(json.loads(o.terrascript.dump()))
+
+
+def attach_template(entities):
+    return [value for address, value in entities.items() if address.startswith("data.template_file.attach_volume_")]
+
+
+def test_striped_volumes_over_ssh():
+    entities = workers(stripes=3, filesystem="xfs")
+    volumes = [address for address in entities if address.startswith("digitalocean_volume.")]
+    assert sorted(volumes) == ["digitalocean_volume.data-1-01", "digitalocean_volume.data-1-02",
+                               "digitalocean_volume.data-1-03"]
+    # The file system is created on the striped device, not on each volume
+    assert "initial_filesystem_type" not in entities["digitalocean_volume.data-1-01"]
+
+    [template] = attach_template(entities)
+    assert (template["vars"]["stripes"], template["vars"]["stripe_mode"], template["vars"]["filesystem"]) == \
+        (3, "raid0", "xfs")
+    assert template["vars"]["volumes"] == VOLUMES_PLACEHOLDER
+
+    droplet = entities["digitalocean_droplet.db_01"]
+    assert droplet["volume_ids"] == ["${digitalocean_volume.data-1-01.id}", "${digitalocean_volume.data-1-02.id}",
+                                     "${digitalocean_volume.data-1-03.id}"]
+    uploads = [step["file"]["content"] for step in droplet["provisioner"]
+               if "file" in step and step["file"]["destination"] == "/tmp/attach_volume.sh"]
+    assert re.match(r'^\$\{replace\(data\.template_file\.attach_volume_data_\w+\.rendered, "__SWARM_TF_VOLUMES__", '
+                    r'"data-1-01 data-1-02 data-1-03"\)\}$', uploads[0])
+
+
+def test_striped_volumes_over_cloud_init():
+    entities = workers(bootstrap="cloud-init", stripes=2, stripe_mode="lvm")
+    assert attach_template(entities)[0]["vars"]["stripe_mode"] == "lvm"
+    assert re.match(r'^\$\{replace\(data\.template_cloudinit_config\.db_user_data_attach_volume_data_\w+\.rendered, '
+                    r'"__SWARM_TF_VOLUMES__", "data-1-01 data-1-02"\)\}$',
+                    entities["digitalocean_droplet.db_01"]["user_data"])
+
+
+def test_striped_volumes_of_a_fleet():
+    entities = workers(total_instances=2, fleet=True, stripes=2)
+    droplet = entities["digitalocean_droplet.db"]
+    assert droplet["volume_ids"] == [
+        "${element(list(digitalocean_volume.data-1-01.id,digitalocean_volume.data-2-01.id), count.index)}",
+        "${element(list(digitalocean_volume.data-1-02.id,digitalocean_volume.data-2-02.id), count.index)}"]
+    uploads = [step["file"]["content"] for step in droplet["provisioner"] if "file" in step and
+               step["file"]["destination"] == "/tmp/attach_volume.sh"]
+    assert uploads[0].endswith(', "__SWARM_TF_VOLUMES__", element(list("data-1-01 data-1-02","data-2-01 data-2-02"), '
+                               'count.index))}')
+
+
+def test_striped_claim_has_no_single_volume():
+    with pytest.raises(ValueError):
+        VolumeClaim(Terraobject(), "nyc3", "data", size=100, stripes=2).create()
+
+
+def render(claim, volumes):
+    """The attach script as rendered by the template_file data source"""
+    values = dict(claim.template_vars(), mark="mark() { :; }", volumes=volumes)
+    with open(ATTACH_SCRIPT) as f:
+        template = f.read()
+    return re.sub(r"\$(\$)?\{(\w+)\}", lambda match: "${" + match.group(2) + "}" if match.group(1) else
+                  str(values[match.group(2)]), template)
+
+
+@pytest.fixture
+def run_attach(tmp_path):
+    """Run the rendered attach script with the volumes in a temporary directory and the privileged commands
+    (sudo) only recorded. Return the recorded commands"""
+    bin_directory = tmp_path / "bin"
+    bin_directory.mkdir()
+    log = tmp_path / "sudo.log"
+    sudo = bin_directory / "sudo"
+    sudo.write_text("#!/bin/sh\n[ -t 0 ] || cat > /dev/null\necho \"$@\" >> {}\n".format(log))
+    sudo.chmod(0o755)
+    devices = tmp_path / "by-id"
+    devices.mkdir()
+
+    def run(claim):
+        for name in claim.volume_names():
+            (devices / "scsi-0DO_Volume_{}".format(name)).touch()
+        script = render(claim, " ".join(claim.volume_names())).replace("/dev/disk/by-id", str(devices))
+        env = dict(os.environ, PATH="{}{}{}".format(bin_directory, os.pathsep, os.environ["PATH"]))
+        subprocess.run(["bash", "-c", script], env=env, check=True, stdin=subprocess.DEVNULL,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=30)
+        return log.read_text().splitlines()
+    return run
+
+
+def test_attach_script_raid0_xfs(run_attach, tmp_path):
+    commands = run_attach(VolumeClaim(Terraobject(), "nyc3", "data", stripes=2, filesystem="xfs", mount="/srv"))
+    devices = " ".join([str(tmp_path / "by-id" / "scsi-0DO_Volume_data-0{}".format(number)) for number in [1, 2]])
+    assert "mdadm --create /dev/md/swarm_tf --run --level=0 --chunk=256 --raid-devices=2 " + devices in commands
+    assert "mkfs -t xfs /dev/md/swarm_tf" in commands
+    assert "mount /srv" in commands
+
+
+def test_attach_script_lvm(run_attach):
+    commands = run_attach(VolumeClaim(Terraobject(), "nyc3", "data", stripes=3, stripe_mode="lvm", readahead=512))
+    assert "lvcreate --yes --stripes 3 --stripesize 256k --extents 100%FREE --name data swarm_tf" in commands
+    assert "mkfs -t ext4 /dev/swarm_tf/data" in commands
+    assert "blockdev --setra 1024 /dev/swarm_tf/data" in commands
+    assert not [command for command in commands if command.startswith("mdadm")]
+
+
+def test_attach_script_single_volume(run_attach, tmp_path):
+    commands = run_attach(VolumeClaim(Terraobject(), "nyc3", "data"))
+    assert "mkfs -t ext4 {}".format(tmp_path / "by-id" / "scsi-0DO_Volume_data") in commands
+    assert not [command for command in commands if command.startswith(("mdadm", "lvcreate"))]